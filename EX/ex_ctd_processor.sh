@@ -40,8 +40,12 @@ tmp_output_destination="$output_dir/$cruise_number/$today/tmp"
 mkdir -p "$tmp_output_destination"
 cd "EX" || exit 1
 
+# list each folder once, not once per dive
+ctd_listing=$(ls "$ctd_dir")
+tracking_listing=$(ls "$tracking_dir")
+
 # Given a cruise number, identify the number of dives in the cruise
-dive_count=`(ls "$ctd_dir" | grep "$cruise_number" | wc -l | tr -d " ")`
+dive_count=`(echo "$ctd_listing" | grep "$cruise_number" | wc -l | tr -d " ")`
 if((dive_count == 0)); then
   printf "\n${txt_error}No dives matching cruise number $cruise_number found in $base_dir$txt_reset\n\n"
   exit 1
@@ -49,12 +53,14 @@ fi
 
 printf "\n${txt_bold}Found $dive_count dives$txt_reset\n"
 
-dives=($(ls "$ctd_dir"| grep .cnv))
+dives=($(echo "$ctd_listing" | grep .cnv))
 
 ## iterate through each of the dives
 for((i = 0; i < dive_count; ++i)); do
   num=$((i+1))
-  dive=${dives[i]:7:6}
+  # the part of the file name between "<cruise number>_" and the next "_"
+  dive=${dives[i]#"${cruise_number}_"}
+  dive=${dive%%_*}
   ctd_file_names="$(eval echo "$temp_ctd_file_names")"
   tracking_file_names="$(eval echo "$temp_tracking_file_names")"
 
@@ -63,7 +69,7 @@ for((i = 0; i < dive_count; ++i)); do
   printf "                  Dive $num/$dive_count\n"
 
   # GRAB a COPY of CTD CNV FILES LOCALLY
-  ctd_cnv_file=($(ls "$ctd_dir" | grep "$ctd_file_names"))
+  ctd_cnv_file=($(echo "$ctd_listing" | grep "$ctd_file_names"))
   ctd_cnv_file_path="${ctd_dir}/${ctd_cnv_file[0]}"  # only expect one file per dive
   if [[ ! -f "$tmp_output_destination/${ctd_cnv_file[0]}" ]]; then
     mkdir -p "$tmp_output_destination/ctd" && cp "$ctd_cnv_file_path" "$tmp_output_destination/ctd"
@@ -71,7 +77,7 @@ for((i = 0; i < dive_count; ++i)); do
     echo "Skip copying file over: $ctd_cnv_file_path"
   fi
 
-  nav_csv_file=($(ls "$tracking_dir" | grep "$tracking_file_names"))
+  nav_csv_file=($(echo "$tracking_listing" | grep "$tracking_file_names"))
   nav_csv_file_path="${tracking_dir}/${nav_csv_file[0]}"  # only expect one file per dive
   if [[ ! -f "$tmp_output_destination/$nav_csv_file_path" ]]; then
     mkdir -p "$tmp_output_destination/nav" && cp "$nav_csv_file_path" "$tmp_output_destination/nav"
@@ -80,9 +86,8 @@ for((i = 0; i < dive_count; ++i)); do
   fi
 
   # GRAB the START DATE of a DIVE
-  dive_start_year=$(grep -m 1 "start_time" $ctd_cnv_file_path | awk '{print $6}')
-  dive_start_month=$(grep -m 1 "start_time" $ctd_cnv_file_path | awk '{print $4}')
-  dive_start_day=$(grep -m 1 "start_time" $ctd_cnv_file_path | awk '{print $5}')
+  # "# start_time = Aug 24 2023 ...", read once
+  read -r _ _ _ dive_start_month dive_start_day dive_start_year _ < <(grep -m 1 "start_time" "$ctd_cnv_file_path")
   # convert the month from text to number
   case $dive_start_month in
     Jan) dive_start_month=01;;
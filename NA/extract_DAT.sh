@@ -1,10 +1,14 @@
 #!/bin/sh
-# Usage: ./extract_DAT.sh <dive_number> <cruise_source_path> <tmp_folder> <output_destination_path>
+# Usage: ./extract_DAT.sh <dive_number> <cruise_source_path> <tmp_folder> <output_destination_path> [matching_dat_files]
+# matching_dat_files: optional text file listing the DAT files for this dive, one per line in time order
+#                     (written by cruise_scheduler.py from dat_catalog.py, skips searching the navest folder)
+# DAT_JOBS: number of DAT files read at the same time (4 if not set)
 
 dive_number=$1
 cruise_source_path=$2
 tmp_folder=$3
 output_destination_path=$4
+matching_dat_list=$5
 
 # progress bar visual
 function ProgressBar {
@@ -18,9 +22,9 @@ function ProgressBar {
 }
 
 # check number of params
-if (( $# != 4 )); then
+if (( $# != 4 && $# != 5 )); then
   echo "Illegal number of parameters"
-  echo "Usage: ./extract_DAT.sh <dive_number> <cruise_source_path> <tmp_folder> <output_destination_path>"
+  echo "Usage: ./extract_DAT.sh <dive_number> <cruise_source_path> <tmp_folder> <output_destination_path> [matching_dat_files]"
   exit 1
 fi
 
@@ -40,7 +44,12 @@ ctd_nav_tsv="$tmp_folder/ctd_nav/$dive_number.CTD.NAV.tsv"
 o2s_nav_tsv="$tmp_folder/o2s_nav/$dive_number.O2S.NAV.tsv"
 
 # check file existence
-if file "${dat_path}" | grep -q empty; then
+if [ -n "$matching_dat_list" ]; then
+  if [ ! -f "$matching_dat_list" ]; then
+    printf "${txt_error}\nERROR: $matching_dat_list does not exist\n"
+    exit 1
+  fi
+elif file "${dat_path}" | grep -q empty; then
   printf "${txt_error}\nERROR: No DAT files found in ${dat_path}${txt_reset}\n"
   exit 1
 else
@@ -96,30 +105,52 @@ mkdir -p "${tmp_folder}/dat"
 output_file="${tmp_folder}/dat/${dive_number}.DAT"
 rm -f "${output_file}"  # remove file if it exists (don't want to append data to the end)
 
-# subtract 1 hour from start time to get first dat file
-start_dive_unix_timestamp=$(date -j -v-1H -f "%Y-%m-%dT%H:%M:%S" "$start_dive_time" "+%s")
-end_dive_unix_timestamp=$(date -j -f "%Y-%m-%dT%H:%M:%S" $end_dive_time "+%s")
-matching_dat_files=()  # array to store dat file names that fall within the dive start and end times
+if [ -n "$matching_dat_list" ]; then
+  # the DAT files for this dive were already picked from the cruise's DAT catalog
+  sorted_matching_dat_files=($(cat "$matching_dat_list"))
+else
+  # subtract 1 hour from start time to get first dat file
+  start_dive_unix_timestamp=$(date -j -v-1H -f "%Y-%m-%dT%H:%M:%S" "$start_dive_time" "+%s")
+  end_dive_unix_timestamp=$(date -j -f "%Y-%m-%dT%H:%M:%S" $end_dive_time "+%s")
+  matching_dat_files=()  # array to store dat file names that fall within the dive start and end times
 
-# loop over each line in DAT_files
-while IFS= read -r line; do
-  file_name=$(basename "$line")
-	dat_file_unix_timestamp=$(date -j -f "%Y%m%d_%H%M.DAT" "$file_name" "+%s")
-  if [[ $dat_file_unix_timestamp -ge $start_dive_unix_timestamp  && $dat_file_unix_timestamp -le $end_dive_unix_timestamp  ]]; then
-    matching_dat_files+=($line)
-  fi
-done < "$dat_files"
+  # loop over each line in DAT_files
+  while IFS= read -r line; do
+    file_name=$(basename "$line")
+  	dat_file_unix_timestamp=$(date -j -f "%Y%m%d_%H%M.DAT" "$file_name" "+%s")
+    if [[ $dat_file_unix_timestamp -ge $start_dive_unix_timestamp  && $dat_file_unix_timestamp -le $end_dive_unix_timestamp  ]]; then
+      matching_dat_files+=($line)
+    fi
+  done < "$dat_files"
 
-# sort the array in ascending order
-sorted_matching_dat_files=($(printf '%s\n' "${matching_dat_files[@]}" | sort -n))
+  # sort the array in ascending order
+  sorted_matching_dat_files=($(printf '%s\n' "${matching_dat_files[@]}" | sort -n))
+fi
 array_length="${#sorted_matching_dat_files[@]}"
+dat_jobs=${DAT_JOBS:-4}
+parts_folder="${tmp_folder}/dat/${dive_number}_parts"
+mkdir -p "${parts_folder}"
 i=0
 
-# for each file in the matching DAT file array, extract the VFR SOLN_DEADRECK data
+# for each file in the matching DAT file array, extract the VFR SOLN_DEADRECK data. up to dat_jobs files are
+# read at the same time, each into its own part, and the parts are appended in file order afterwards so the
+# output is the same as reading them one after another
 for file in "${sorted_matching_dat_files[@]}"; do
-  ProgressBar $((++i)) $array_length
+  ((++i))
   search_string="VFR.*SOLN_DEADRECK.*"
-  ag --nonumbers "${search_string}" $file | awk -F ' ' '{print $2, $3, $10}' | awk -F"." '!seen[$1]++' >> "${output_file}"
+  ag --nonumbers "${search_string}" $file | awk -F ' ' '{print $2, $3, $10}' | awk -F"." '!seen[$1]++' > "${parts_folder}/${i}" &
+  if (( i % dat_jobs == 0 )); then
+    wait
+    ProgressBar $i $array_length
+  fi
+done
+wait
+for ((part = 1; part <= array_length; part++)); do
+  cat "${parts_folder}/${part}" >> "${output_file}"
 done
+rm -rf "${parts_folder}"
+if (( array_length > 0 )); then
+  ProgressBar $array_length $array_length
+fi
 
 printf "\r\033[K${txt_success}✔${txt_reset} Extracted DAT files.\n\033[K\r"
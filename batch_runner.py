@@ -0,0 +1,221 @@
+import argparse
+import hashlib
+import json
+import os
+import signal
+import sys
+import threading
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from config_file_handler import ConfigFileHandler, app_data_dir, cruise_preset, read_config
+from cruise_scheduler import CruiseScheduler
+from ex_merge import expand_template
+from job_queue import JobQueue
+from worker_pool import WorkerPool
+
+# the queue and the configs it runs are kept next to the GUI's settings
+BATCH_DIR = os.path.join(app_data_dir() or os.path.expanduser('~'), 'CTDProcess')
+GUI_CONFIG_FILE = os.path.join(BATCH_DIR, 'ctd_process_config.json')
+
+
+def cruise_config(base_config, entry):
+    # the base settings with one cruise's own on top. ${cruise} in the base or output folder is filled in, so
+    # one config can cover every cruise on the NAS
+    config = dict(base_config, **entry)
+    config['base_dir'] = expand_template(config['base_dir'], config)
+    config['output_dir'] = expand_template(config['output_dir'], config)
+    return config
+
+
+def manifest_entries(manifest_file):
+    # a .json manifest is a list of settings for each cruise (at least its cruise_number), anything else is
+    # one CRUISE[=BASE_DIR] per line with # comments
+    with open(manifest_file, 'r') as manifest:
+        if manifest_file.endswith('.json'):
+            return json.load(manifest)
+        lines = [line.split('#', 1)[0].strip() for line in manifest]
+    return [cruise_spec(line) for line in lines if line]
+
+
+def cruise_spec(spec):
+    cruise_number, _, base_dir = spec.partition('=')
+    entry = {'cruise_number': cruise_number.strip()}
+    if base_dir.strip():
+        entry['base_dir'] = base_dir.strip()
+    return entry
+
+
+class BatchRunner:
+    # runs the queued cruises, up to max_cruises at a time, with all of their dives sharing one pool of
+    # max_dives workers so the NAS only ever sees max_dives dives being read at once. the workers are recycled
+    # by the worker_max_jobs and worker_max_memory_mb settings of pool_config
+    def __init__(self, job_queue, max_cruises=1, max_dives=4, force=False, config_dir=BATCH_DIR, pool_config=None, profile=False):
+        self.job_queue = job_queue
+        self.pool_config = pool_config or ConfigFileHandler.default_config()
+        self.max_cruises = max(1, max_cruises)
+        self.max_dives = max(1, max_dives)
+        self.force = force
+        # profiles every cruise, including the ones queued before
+        self.profile = profile
+        self.config_dir = os.path.join(config_dir, 'batch_configs')
+        self.stop_event = threading.Event()
+        self.print_lock = threading.Lock()
+        self.failed = []
+        # the cruises being run, to be woken up when the batch is stopped
+        self.schedulers = set()
+        self.schedulers_lock = threading.Lock()
+
+    def run(self):
+        # the workers run in their own process groups, so Ctrl+C is left to the batch
+        dive_pool = WorkerPool.for_config(self.pool_config, self.max_dives)
+        cruise_pool = ThreadPoolExecutor(max_workers=self.max_cruises)
+        running = set()
+        quit_now = False
+        try:
+            while True:
+                while len(running) < self.max_cruises and not self.stop_event.is_set():
+                    job = self.job_queue.next_pending()
+                    if job is None:
+                        break
+                    running.add(cruise_pool.submit(self.run_cruise, job, dive_pool))
+                if not running:
+                    break
+                # wakes up to notice Ctrl+C
+                _, running = wait(running, timeout=0.5, return_when=FIRST_COMPLETED)
+        except KeyboardInterrupt:
+            quit_now = True
+            raise
+        finally:
+            if quit_now:
+                # the second Ctrl+C: the running dives are killed instead of waited for. the cruises they belong
+                # to go back to pending when the queue is next loaded
+                cruise_pool.shutdown(wait=False, cancel_futures=True)
+                dive_pool.shutdown(wait=False, cancel_futures=True)
+                dive_pool.abort_all()
+            else:
+                cruise_pool.shutdown()
+                dive_pool.shutdown()
+        if self.stop_event.is_set():
+            self.print('\nBatch stopped, run again to pick up the remaining cruises')
+            return 1
+        return 1 if self.failed else 0
+
+    def run_cruise(self, job, dive_pool):
+        cruise_number = job['cruise_number']
+        config = dict(job['config'])
+        if self.profile:
+            config['profile'] = True
+
+        def log(message):
+            self.print('\n'.join(f'[{cruise_number}] {line}' if line else '' for line in message.split('\n')))
+
+        try:
+            # EX.R reads its settings from a config file. one per job, the same cruise can be queued for more than
+            # one output directory and those jobs can run at the same time
+            os.makedirs(self.config_dir, exist_ok=True)
+            job_hash = hashlib.sha1(job['id'].encode('utf-8')).hexdigest()[:12]
+            config_file_path = os.path.join(self.config_dir, f'{cruise_number}_{job_hash}_config.json')
+            with open(config_file_path, 'w') as config_file:
+                json.dump(config, config_file, indent=2)
+            config['config_file_path'] = config_file_path
+            scheduler = CruiseScheduler(config, self.max_dives, self.force, log=log, pool=dive_pool)
+            with self.schedulers_lock:
+                self.schedulers.add(scheduler)
+            try:
+                # a stop from before the scheduler was added is picked up from stop_event
+                returncode = scheduler.run(self.stop_event)
+            finally:
+                with self.schedulers_lock:
+                    self.schedulers.discard(scheduler)
+            failed = [result.dive for result in scheduler.results if not result.ok]
+            message = f'{len(failed)} dive(s) skipped: {", ".join(failed)}' if failed else ''
+        except Exception as err:
+            log(f'\n{type(err).__name__}: {err}\n')
+            returncode = 1
+            message = str(err)
+        # a cruise that got every dive done before the batch was stopped still counts as done
+        cancelled = self.stop_event.is_set() and returncode != 0
+        self.job_queue.finish(job, returncode, cancelled, message)
+        if returncode != 0 and not cancelled:
+            self.failed.append(cruise_number)
+
+    def print(self, message):
+        with self.print_lock:
+            print(message, flush=True)
+
+    def stop(self, signum=None, frame=None):
+        if self.stop_event.is_set():
+            # a second Ctrl+C stops without waiting for the running dives
+            raise KeyboardInterrupt
+        self.print('\nStopping, waiting for the running dives to finish (Ctrl+C again to quit now)')
+        self.stop_event.set()
+        with self.schedulers_lock:
+            schedulers = list(self.schedulers)
+        for scheduler in schedulers:
+            scheduler.stop()
+
+
+def print_status(job_queue):
+    for job in job_queue.jobs:
+        line = f'{job["cruise_number"]:<10}{job["status"]:<9}{job["attempts"]:>3} run(s)  {job["config"]["output_dir"]}'
+        if job.get('message'):
+            line += f'  ({job["message"]})'
+        print(line)
+    print(', '.join(f'{count} {status}' for status, count in job_queue.counts().items()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Merge the sensor data of several cruises without the GUI. Cruises are added to a queue '
+                    'that is kept between runs, so an interrupted batch picks up where it stopped',
+    )
+    parser.add_argument('cruises', nargs='*', metavar='CRUISE[=BASE_DIR]', help='cruise numbers to queue')
+    parser.add_argument('--manifest', help='file listing the cruises to queue (.json list of settings, or CRUISE[=BASE_DIR] lines)')
+    parser.add_argument('--config', help='settings shared by every cruise (defaults to the GUI\'s saved settings)')
+    parser.add_argument('--queue', default=os.path.join(BATCH_DIR, 'batch_queue.json'), help='queue file')
+    parser.add_argument('--cruises', dest='max_cruises', type=int, default=1, help='number of cruises processed at the same time')
+    parser.add_argument('--dives', dest='max_dives', type=int, help='number of dives processed at the same time, across all cruises')
+    parser.add_argument('--force', action='store_true', help='reprocess dives that are already up to date')
+    parser.add_argument('--profile', action='store_true', help='profile every dive of the cruises run')
+    parser.add_argument('--retry-failed', action='store_true', help='queue the cruises that failed last time again')
+    parser.add_argument('--clear-done', action='store_true', help='remove finished cruises from the queue')
+    parser.add_argument('--status', action='store_true', help='show the queue and exit')
+    args = parser.parse_args()
+
+    batch_queue = JobQueue(args.queue)
+    if args.status:
+        print_status(batch_queue)
+        sys.exit(0)
+
+    if args.config:
+        base_config = read_config(args.config)
+    elif os.path.exists(GUI_CONFIG_FILE):
+        base_config = read_config(GUI_CONFIG_FILE)
+    else:
+        base_config = ConfigFileHandler.default_config()
+    entries = [cruise_spec(spec) for spec in args.cruises]
+    if args.manifest:
+        entries += manifest_entries(args.manifest)
+    configs = [cruise_config(base_config, entry) for entry in entries]
+    for config in configs:
+        if cruise_preset(config['cruise_number']) is None:
+            parser.error(f'{config["cruise_number"]}: cruise number should start with "NA" or "EX"')
+    for config in configs:
+        batch_queue.add(config)
+
+    if args.clear_done:
+        batch_queue.remove_done()
+    if args.retry_failed:
+        batch_queue.retry_failed()
+    if not batch_queue.counts()['pending']:
+        print('Nothing to do, every queued cruise has finished')
+        print_status(batch_queue)
+        sys.exit(0)
+
+    runner = BatchRunner(batch_queue, args.max_cruises, args.max_dives or base_config['max_workers'], args.force, pool_config=base_config, profile=args.profile)
+    signal.signal(signal.SIGINT, runner.stop)
+    returncode = runner.run()
+    print()
+    print_status(batch_queue)
+    sys.exit(returncode)
@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+from cruise_scheduler import CruiseScheduler
+from dat_catalog import DatCatalog, dive_time_window
+from dive_discovery import discover_dives, discover_na_dives
+from ex_merge import ExMerger
+from na_merge import NaMerger
+from stage_events import StageRecorder
+from synthetic_cruise import generate_ex_cruise, generate_na_cruise
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS isn't reported there
+    resource = None
+
+GENERATORS = {'EX': generate_ex_cruise, 'NA': generate_na_cruise}
+
+
+def peak_rss(who='self'):
+    # bytes, ru_maxrss is in kilobytes on Linux but bytes on macOS
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(parent, name)) for parent, _, names in os.walk(directory) for name in names)
+
+
+def ex_stages(config, recorder):
+    with recorder.stage('discover'):
+        dives = discover_dives(config)
+    merger = ExMerger(config)
+    return sum(merger.merge_dive(dive, ctd_file, nav_file, recorder)[1] for dive, ctd_file, nav_file in dives)
+
+
+def na_stages(config, recorder):
+    dive_reports_source = os.path.join(config['base_dir'], 'processed', 'dive_reports')
+    with recorder.stage('discover'):
+        dives = discover_na_dives(dive_reports_source)
+    with recorder.stage('dat scan'):
+        # no saved catalog, so this is the cost of a first run
+        dat_catalog = DatCatalog(os.path.join(config['base_dir'], 'raw', 'nav', 'navest'))
+    merger = NaMerger(config)
+    row_count = 0
+    for dive, ctd_nav_tsv, o2s_nav_tsv in dives:
+        with recorder.stage('dat scan'):
+            dat_files = dat_catalog.files_for_dive(*dive_time_window(ctd_nav_tsv, o2s_nav_tsv))
+        row_count += merger.merge_dive(dive, ctd_nav_tsv, o2s_nav_tsv, dat_files, recorder)[1]
+    return row_count
+
+
+def run_stages(kind, config):
+    # one dive after another in this process, timing every stage
+    recorder = StageRecorder()
+    start = time.perf_counter()
+    row_count = (ex_stages if kind == 'EX' else na_stages)(config, recorder)
+    return {'wall': time.perf_counter() - start, 'rows': row_count, 'stages': recorder.totals(), 'peak_rss': peak_rss()}
+
+
+def run_scheduler(config, workers):
+    # the whole cruise the way the GUI runs it, with worker processes
+    scheduler = CruiseScheduler(config, workers, force=True)
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        returncode = scheduler.run()
+    wall = time.perf_counter() - start
+    peaks = [peak for peak in (peak_rss(), peak_rss('children')) if peak is not None]
+    return {
+        'wall': wall,
+        'rows': sum(result.row_count for result in scheduler.results),
+        'returncode': returncode,
+        'workers': scheduler.max_workers,
+        'peak_rss': max(peaks) if peaks else None,
+    }
+
+
+def in_new_process(function, *args):
+    # so peak RSS only covers this measurement
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(function, *args).result()
+
+
+def benchmark(kind, root, dives, dive_hours, sample_rate, workers):
+    start = time.perf_counter()
+    config = GENERATORS[kind](root, dives=dives, dive_hours=dive_hours, sample_rate=sample_rate)
+    return {
+        'dives': dives,
+        'dive_hours': dive_hours,
+        'sample_rate': sample_rate,
+        'generate': time.perf_counter() - start,
+        'input_bytes': directory_size(config['base_dir']),
+        'stages': in_new_process(run_stages, kind, config),
+        'scheduler': in_new_process(run_scheduler, config, workers),
+    }
+
+
+def megabytes(size):
+    return 'n/a' if size is None else f'{size / 2 ** 20:.1f} MB'
+
+
+def rows_per_second(run):
+    return run['rows'] / run['wall'] if run['wall'] else 0.0
+
+
+def report(kind, result):
+    stages, scheduler = result['stages'], result['scheduler']
+    print(f'\n{kind}: {result["dives"]} dives of {result["dive_hours"]:g} h at {result["sample_rate"]:g} Hz, '
+          f'{megabytes(result["input_bytes"])} of input (generated in {result["generate"]:.2f} s)')
+    print(f'  {"stage":<12}{"wall s":>10}{"share":>8}')
+    for name, seconds in stages['stages'].items():
+        print(f'  {name:<12}{seconds:>10.3f}{seconds / stages["wall"]:>8.0%}')
+    print(f'  {"total":<12}{stages["wall"]:>10.3f}   {stages["rows"]} rows, {rows_per_second(stages):,.0f} rows/s, '
+          f'peak RSS {megabytes(stages["peak_rss"])}')
+    print(f'  scheduler ({scheduler["workers"]} workers): {scheduler["wall"]:.3f} s, {rows_per_second(scheduler):,.0f} rows/s, '
+          f'peak RSS {megabytes(scheduler["peak_rss"])}' + ('' if scheduler['returncode'] == 0 else ', SOME DIVES FAILED'))
+
+
+def slowdowns(results, baseline, max_slowdown):
+    # rows/s that dropped more than max_slowdown (a fraction) compared to a saved run
+    found = []
+    for kind, result in results.items():
+        if kind not in baseline:
+            continue
+        for run in ['stages', 'scheduler']:
+            before, after = rows_per_second(baseline[kind][run]), rows_per_second(result[run])
+            if before and after < before * (1 - max_slowdown):
+                found.append(f'{kind} {run}: {after:,.0f} rows/s, was {before:,.0f} rows/s')
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the EX and NA processing on a generated cruise')
+    parser.add_argument('--kind', choices=['EX', 'NA', 'both'], default='both')
+    parser.add_argument('--dives', type=int, default=4)
+    parser.add_argument('--dive-hours', type=float, default=2.0)
+    parser.add_argument('--sample-rate', type=float, default=1.0, help='CTD (and navest) samples per second')
+    parser.add_argument('--workers', type=int, help='defaults to max_workers from the default config')
+    parser.add_argument('--root', help='where the cruises are generated, a temporary directory by default')
+    parser.add_argument('--keep', action='store_true', help="don't delete the generated cruises")
+    parser.add_argument('--json', dest='json_file', help='save the results to this file')
+    parser.add_argument('--baseline', help='results saved with --json to compare against')
+    parser.add_argument('--max-slowdown', type=float, default=0.2, help='fail if rows/s drops by more than this fraction')
+    args = parser.parse_args()
+
+    bench_root = args.root or tempfile.mkdtemp(prefix='ctd_benchmark_')
+    results = {}
+    try:
+        for cruise_kind in (['EX', 'NA'] if args.kind == 'both' else [args.kind]):
+            results[cruise_kind] = benchmark(cruise_kind, bench_root, args.dives, args.dive_hours, args.sample_rate, args.workers)
+            report(cruise_kind, results[cruise_kind])
+    finally:
+        if not args.keep:
+            shutil.rmtree(bench_root, ignore_errors=True)
+
+    if args.json_file:
+        with open(args.json_file, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            found_slowdowns = slowdowns(results, json.load(baseline_file), args.max_slowdown)
+        for slowdown in found_slowdowns:
+            print(f'SLOWER: {slowdown}')
+        sys.exit(1 if found_slowdowns else 0)
@@ -0,0 +1,44 @@
+import json
+import os
+
+from ex_merge import CnvHeader
+
+CATALOG_VERSION = 1
+
+
+class CnvCatalog:
+    # the header of every CNV file in a cruise, saved to cache_file. a saved header is used as long as the
+    # file's size and mtime haven't changed, otherwise the file's header is read again
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.entries = {}
+        self.changed = False
+        self.load()
+
+    def header(self, file_path):
+        stat = os.stat(file_path)
+        entry = self.entries.get(file_path)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'header': CnvHeader(file_path).to_dict()}
+            self.entries[file_path] = entry
+            self.changed = True
+        return CnvHeader.from_dict(entry['header'])
+
+    def load(self):
+        if self.cache_file is None:
+            return
+        try:
+            with open(self.cache_file, 'r') as catalog_file:
+                saved = json.load(catalog_file)
+        except (OSError, ValueError):
+            return
+        if saved.get('version') == CATALOG_VERSION:
+            self.entries = saved['files']
+
+    def save(self):
+        if self.cache_file is None or not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with open(self.cache_file, 'w') as catalog_file:
+            json.dump({'version': CATALOG_VERSION, 'files': self.entries}, catalog_file)
+        self.changed = False
@@ -1,6 +1,11 @@
 import errno
 import json
 import os
+import shutil
+import sys
+
+# cruise number prefix -> processor preset
+CRUISE_PRESETS = ('EX', 'NA')
 
 
 class ConfigFileHandler:
@@ -12,10 +17,8 @@ class ConfigFileHandler:
         self.load_config()
 
     def get_save_path(self):
-        if os.name == 'nt':
-            self.config_file_path = os.getenv('LOCALAPPDATA')
-        else:
-            self.config_file_path = os.getenv('HOME') + '/Library/Application Support'
+        self.config_file_path = app_data_dir()
+        os.makedirs(self.config_file_path, exist_ok=True)
 
     def load_config(self):
         current_dir = os.getcwd()
@@ -35,10 +38,19 @@ class ConfigFileHandler:
                 self.config = json.load(config_file)
         except FileNotFoundError:
             self.load_default_config()
+        else:
+            # configs saved by older versions are missing newer settings
+            for key, value in self.default_config().items():
+                self.config.setdefault(key, value)
         os.chdir(current_dir)
 
     def load_default_config(self):
-        self.config = {
+        self.config = self.default_config()
+        self.save_config(self.config)
+
+    @staticmethod
+    def default_config():
+        return {
             'cruise_number': '',
             'base_dir': '/Volumes/maxarray2/varsadditional',
             'output_dir': '/Volumes/maxarray2/varsadditional',
@@ -61,8 +73,47 @@ class ConfigFileHandler:
                 'latitude': 6,
                 'longitude': 7
             },
+            # merge_engine: "python" = merge dives in-process, "r" = run EX.R or extract_DAT.sh + NA.R for each dive
+            'merge_engine': 'python',
+            # max_workers: number of dives processed at the same time
+            'max_workers': 4,
+            # join_tolerance: seconds between sensor readings that still count as a match (0 = same second only)
+            # join_direction: "nearest", "backward" (earlier readings only), or "forward" (later readings only)
+            'join_tolerance': 0,
+            'join_direction': 'nearest',
+            # resample_seconds: resolution of the merged rows, each sensor stream is reduced to one row per bin
+            # resample_reducer: "first", "mean", "median", "min", or "max" of the samples in a bin (Python merge engine only)
+            'resample_seconds': 1,
+            'resample_reducer': 'first',
+            # output_format: "csv" = _ROVDATA.csv only, "csv+npz" = also a typed _ROVDATA.npz of each dive
+            'output_format': 'csv',
+            # csv_decimals: decimal places for some of the csv's columns, e.g. {"Latitude": 6, "Depth": 2}. other
+            # columns are written like R's write.csv, up to 15 significant digits (Python merge engine only)
+            # csv_gzip: write _ROVDATA.csv.gz instead of _ROVDATA.csv
+            'csv_decimals': {},
+            'csv_gzip': False,
+            # rov_store: also load every merged dive into a time-indexed store, for lookups with rov_store.py
+            # rov_store_dir: where the store is kept, ${output_dir} and ${cruise} are filled in
+            'rov_store': True,
+            'rov_store_dir': '${output_dir}/.ctd_process/rov_store',
+            # worker_max_jobs: dives a merge worker (and its R session) handles before it's replaced (0 = no limit)
+            # worker_max_memory_mb: a worker using more than this after a dive is replaced (0 = no limit)
+            'worker_max_jobs': 50,
+            'worker_max_memory_mb': 2048,
+            # dat_cache_mb: memory each worker keeps decoded DAT files in, so dives that share a file decode it once
+            # dat_cache_spill: also save decoded DAT files in the temp folder, for the other workers to use
+            'dat_cache_mb': 256,
+            'dat_cache_spill': True,
+            # io_threads: input files of a dive read at the same time (the NAV files and each DAT file)
+            'io_threads': 4,
+            # prefetch_mb: local disk used to copy the next dives' input files while the current ones merge (0 = off)
+            # prefetch_dives: how many dives ahead of the workers to copy
+            'prefetch_mb': 2048,
+            'prefetch_dives': 2,
+            # profile: run every dive under cProfile and tracemalloc (and Rprof with the R merge engine), the dumps
+            # and a summary of the hotspots and allocations go in <output_dir>/<cruise>_profile_<run start>
+            'profile': False,
         }
-        self.save_config(self.config)
 
     def save_config(self, new_config):
         current_dir = os.getcwd()
@@ -84,3 +135,43 @@ class ConfigFileHandler:
             return False
         os.chdir(current_dir)
         return True
+
+
+def app_data_dir():
+    # the folder the CTDProcess settings folder is kept in
+    if os.name == 'nt':
+        return os.getenv('LOCALAPPDATA')
+    if sys.platform == 'darwin':
+        return os.getenv('HOME') + '/Library/Application Support'
+    # Linux has no ~/Library. settings saved there by older versions are moved over
+    return moved_app_data(os.getenv('HOME') + '/Library/Application Support',
+                          os.getenv('XDG_CONFIG_HOME') or os.getenv('HOME') + '/.config')
+
+
+def moved_app_data(old_dir, new_dir):
+    # moves the CTDProcess folder from old_dir to new_dir the first time -> the folder it's kept in now
+    old_settings = os.path.join(old_dir, 'CTDProcess')
+    new_settings = os.path.join(new_dir, 'CTDProcess')
+    if not os.path.isdir(old_settings) or os.path.exists(new_settings):
+        return new_dir
+    try:
+        os.makedirs(new_dir, exist_ok=True)
+        shutil.move(old_settings, new_settings)
+    except OSError as err:
+        print(f'Could not move the settings in {old_settings} to {new_settings}, using them where they are: {err}')
+        return old_dir
+    print(f'Moved the settings in {old_settings} to {new_settings}')
+    return new_dir
+
+
+def cruise_preset(cruise_number):
+    # "EX" or "NA", from the start of the cruise number, or None if it's neither
+    return next((preset for preset in CRUISE_PRESETS if cruise_number.startswith(preset)), None)
+
+
+def read_config(config_file_path):
+    # used by the processors, which are handed the path of the config file saved by the GUI
+    config = ConfigFileHandler.default_config()
+    with open(config_file_path, 'r') as config_file:
+        config.update(json.load(config_file))
+    return config
@@ -0,0 +1,572 @@
+import argparse
+import functools
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+from concurrent.futures import wait
+from datetime import date, datetime, timezone
+
+from cnv_catalog import CnvCatalog
+from config_file_handler import cruise_preset, read_config
+from dat_cache import cruise_dat_cache
+from dat_catalog import DatCatalog, dive_time_window
+from dive_discovery import DirectoryCache, discover_dives, discover_na_dives
+from ex_merge import ExMerger
+from na_merge import NaMerger
+from prefetch import Prefetcher, localize, prefetched_inputs
+from profiling import profile_dir_name, profiled, write_run_summary
+from rovdata_csv import gzip_rovdata_csv, rovdata_file_name
+from rov_store import dive_store_path, rov_store_dir, store_dive
+from rovdata_npz import read_rovdata_csv, rovdata_csv_to_npz
+from run_manifest import RunManifest, file_state, relevant_config
+from stage_events import StageRecorder, file_sizes, format_stage_totals, stage_totals, write_trace
+from worker_pool import WorkerPool, run_r_script
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# catalogs, manifests, and other state kept between runs, inside the output directory
+STATE_DIR_NAME = '.ctd_process'
+# decoded DAT files spilled by the workers, next to the dives' temp folders and removed with them
+DAT_CACHE_DIR_NAME = '.dat_cache'
+
+
+class DiveResult:
+    def __init__(self, dive, ok, message='', row_count=0, output_file=None):
+        self.dive = dive
+        self.ok = ok
+        self.message = message
+        self.row_count = row_count
+        self.output_file = output_file
+        self.inputs = {}
+        self.skipped = False
+        self.events = []
+        # what profiling measured, if the run was profiled
+        self.profile = None
+        # lines the R scripts and extract_DAT.sh printed (stdout and stderr), logged with the dive
+        self.output = []
+
+    @property
+    def seconds(self):
+        if not self.events:
+            return 0.0
+        return max(event.end for event in self.events) - min(event.start for event in self.events)
+
+    def to_dict(self):
+        return {
+            'dive': self.dive,
+            'ok': self.ok,
+            'skipped': self.skipped,
+            'message': self.message,
+            'rows': self.row_count,
+            'output_file': self.output_file,
+            'seconds': round(self.seconds, 6),
+            'stages': {stage: round(seconds, 6) for stage, seconds in stage_totals(self.events).items()},
+            'events': [event.to_dict() for event in self.events],
+            **({'profile': self.profile.to_dict()} if self.profile is not None else {}),
+        }
+
+
+class DiveJob:
+    def __init__(self, dive, function, args, input_files):
+        self.dive = dive
+        self.function = function
+        self.args = args
+        self.input_files = input_files
+        # where the Prefetcher copies this dive's input files, if it's running
+        self.prefetch_dir = None
+        # where the dive's profile goes, if the run is profiled
+        self.profile_dir = None
+
+
+def run_job(job):
+    recorder = StageRecorder(job.dive)
+    # input files that were copied ahead of time are read from the copies, which were hashed as they were made
+    prefetched = prefetched_inputs(job.prefetch_dir, job.dive) if job.prefetch_dir else {}
+    # input files are hashed before they are read, so a file that changes mid-merge gets picked up next run
+    try:
+        with recorder.stage('hash', file_sizes([file_path for file_path in job.input_files if file_path not in prefetched])):
+            inputs = {
+                file_path: prefetched[file_path]['state'] if file_path in prefetched else file_state(file_path)
+                for file_path in job.input_files
+            }
+    except OSError as err:
+        result = DiveResult(job.dive, False, str(err))
+    else:
+        args = localize(job.args, {file_path: entry['path'] for file_path, entry in prefetched.items()})
+        if job.profile_dir is None:
+            result = job.function(*args, recorder)
+        else:
+            with profiled(job.profile_dir, job.dive) as profile:
+                result = job.function(*args, recorder)
+            result.profile = profile
+        result.inputs = inputs
+    result.events = recorder.events
+    return result
+
+
+def copy_into(file_path, directory):
+    os.makedirs(directory, exist_ok=True)
+    shutil.copy(file_path, directory)
+
+
+def run_command(command, cwd, env=None):
+    # (exit status, lines printed to stdout and stderr) of a command
+    completed = subprocess.run(command, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace')
+    return completed.returncode, completed.stdout.splitlines()
+
+
+def r_dive_result(config, dive, dive_start_date, returncode, message, recorder):
+    # the R scripts only write the csv, the typed copy is made from it
+    output_file = os.path.join(config['output_dir'], rovdata_file_name(config['cruise_number'], dive, dive_start_date))
+    if returncode != 0:
+        return DiveResult(dive, False, message, output_file=output_file)
+    try:
+        with recorder.stage('write', file_sizes([output_file])):
+            if config['output_format'] == 'csv+npz':
+                rovdata_csv_to_npz(output_file, {'cruise_number': config['cruise_number'], 'dive': dive, 'dive_start_date': dive_start_date})
+            if rov_store_dir(config) is not None:
+                store_dive(rov_store_dir(config), config['cruise_number'], dive, read_rovdata_csv(output_file))
+            if config['csv_gzip']:
+                output_file = gzip_rovdata_csv(output_file)
+    except (OSError, ValueError) as err:
+        return DiveResult(dive, False, str(err), output_file=output_file)
+    return DiveResult(dive, True, output_file=output_file)
+
+
+def run_ex_dive(config, dive, ctd_file, nav_file, header, tmp_dir, recorder):
+    try:
+        if config['merge_engine'] == 'python':
+            output_file, row_count = ExMerger(config).merge_dive(dive, ctd_file, nav_file, recorder, header)
+            return DiveResult(dive, True, row_count=row_count, output_file=output_file)
+        # grab a copy of the files locally for EX.R
+        with recorder.stage('copy', file_sizes([ctd_file, nav_file])):
+            copy_into(ctd_file, os.path.join(tmp_dir, 'ctd'))
+            copy_into(nav_file, os.path.join(tmp_dir, 'nav'))
+        dive_start_date = header.dive_start_date()
+    except (OSError, ValueError) as err:
+        return DiveResult(dive, False, str(err))
+    with recorder.stage('merge'):
+        # EX.R skips the header lines it's told about instead of reading up to *END* again. it runs in this
+        # worker's R session, which already has the packages loaded
+        returncode, output = run_r_script(
+            os.path.join(REPO_DIR, 'EX'),
+            'EX.R',
+            [config['config_file_path'], dive, dive_start_date, tmp_dir, str(header.line_count), header.system_utc_text or ''],
+        )
+    result = r_dive_result(config, dive, dive_start_date, returncode, f'EX.R exited with {returncode}', recorder)
+    result.output = output
+    return result
+
+
+def run_na_dive(config, dive, ctd_nav_tsv, o2s_nav_tsv, dat_files, tmp_dir, recorder):
+    try:
+        if config['merge_engine'] == 'python':
+            # altitude records go straight from the DAT files into the merge. DAT files the cruise's earlier dives
+            # already decoded come from the cache
+            dat_cache = cruise_dat_cache(config, os.path.join(os.path.dirname(tmp_dir), DAT_CACHE_DIR_NAME))
+            output_file, row_count = NaMerger(config).merge_dive(dive, ctd_nav_tsv, o2s_nav_tsv, dat_files, recorder, dat_cache)
+            return DiveResult(dive, True, row_count=row_count, output_file=output_file)
+
+        # grab a copy of the tsv files locally for extract_DAT.sh and NA.R
+        with recorder.stage('copy', file_sizes([ctd_nav_tsv, o2s_nav_tsv])):
+            copy_into(ctd_nav_tsv, os.path.join(tmp_dir, 'ctd_nav'))
+            copy_into(o2s_nav_tsv, os.path.join(tmp_dir, 'o2s_nav'))
+        dive_start_date = NaMerger.dive_start_date(ctd_nav_tsv)
+        dat_list = os.path.join(tmp_dir, 'DAT_files.txt')
+        with open(dat_list, 'w') as list_file:
+            list_file.writelines(f'{file_path}\n' for file_path in dat_files)
+    except (OSError, ValueError) as err:
+        return DiveResult(dive, False, str(err))
+
+    na_dir = os.path.join(REPO_DIR, 'NA')
+    with recorder.stage('dat decode', file_sizes(dat_files)):
+        extract_returncode, extract_output = run_command(
+            ['sh', './extract_DAT.sh', dive, config['base_dir'], tmp_dir, config['output_dir'], dat_list],
+            na_dir,
+            dict(os.environ, DAT_JOBS=str(config['io_threads'])),
+        )
+    if extract_returncode != 0:
+        # if extract_DAT.sh fails, skip this dive
+        result = DiveResult(dive, False, f'extract_DAT.sh exited with {extract_returncode}')
+        result.output = extract_output
+        return result
+    with recorder.stage('merge'):
+        returncode, output = run_r_script(na_dir, 'NA.R', [config['cruise_number'], dive, dive_start_date, tmp_dir, config['output_dir']])
+    result = r_dive_result(config, dive, dive_start_date, returncode, f'NA.R exited with {returncode}', recorder)
+    result.output = extract_output + output
+    return result
+
+
+class CruiseScheduler:
+    # listener, if given, is called from the thread running the cruise with ('stage', StageEvent) for cruise
+    # wide stages, ('start', number of dives), ('running', dive) when a worker picks a dive up, ('dive', DiveResult)
+    # as each dive finishes, and ('trace', path). log is called with every progress message. dives run in a
+    # WorkerPool of their own unless one that's kept for the session, or shared with other cruises, is passed in
+    def __init__(self, config, max_workers=None, force=False, listener=None, log=print, pool=None):
+        self.config = config
+        self.cruise_number = config['cruise_number']
+        self.max_workers = max(1, int(max_workers or config['max_workers']))
+        self.force = force
+        self.tmp_root = os.path.join(config['output_dir'], self.cruise_number)
+        self.tmp_output_destination = os.path.join(self.tmp_root, date.today().strftime('%Y%m%d'), 'tmp')
+        self.state_dir = os.path.join(config['output_dir'], STATE_DIR_NAME)
+        self.manifest = RunManifest(os.path.join(self.state_dir, f'{self.cruise_number}_manifest.json'))
+        self.store_dir = rov_store_dir(config)
+        self.profile_dir = None
+        self.listener = listener
+        self.log = log
+        self.pool = pool
+        self.active_pool = None
+        self.pending = {}
+        # what run() is woken up by: ('running', dive) and ('done', future) from the pool, ('stop', None) from stop()
+        self.wakeups = queue.Queue()
+        self.results = []
+        self.recorder = StageRecorder()
+        # directory listings from the last run, only listed again when a directory changed
+        self.directories = DirectoryCache(os.path.join(self.state_dir, f'{self.cruise_number}_directories.json'))
+
+    def notify(self, kind, payload):
+        if self.listener is not None:
+            self.listener(kind, payload)
+
+    def dive_jobs(self):
+        preset = cruise_preset(self.cruise_number)
+        if preset == 'EX':
+            return self.ex_dive_jobs()
+        if preset == 'NA':
+            return self.na_dive_jobs()
+        raise ValueError('Cruise number should start with "NA" or "EX"')
+
+    def ex_dive_jobs(self):
+        with self.recorder.stage('discover') as event:
+            dives = discover_dives(self.config, self.directories)
+            self.directories.save()
+            event.rows = len(dives)
+        cnv_catalog = CnvCatalog(os.path.join(self.state_dir, f'{self.cruise_number}_cnv_catalog.json'))
+        jobs = []
+        for dive, ctd_file, nav_file in dives:
+            if ctd_file is None or nav_file is None:
+                self.results.append(DiveResult(dive, False, 'Missing CTD or tracking file'))
+                continue
+            try:
+                # only files that are new or changed since the last run have their header read
+                with self.recorder.stage('cnv scan'):
+                    header = cnv_catalog.header(ctd_file)
+            except (OSError, ValueError) as err:
+                self.results.append(DiveResult(dive, False, str(err)))
+                continue
+            tmp_dir = os.path.join(self.tmp_output_destination, dive)
+            jobs.append(DiveJob(dive, run_ex_dive, (self.config, dive, ctd_file, nav_file, header, tmp_dir), [ctd_file, nav_file]))
+        cnv_catalog.save()
+        return jobs
+
+    def na_dive_jobs(self):
+        dive_reports_source = os.path.join(self.config['base_dir'], 'processed', 'dive_reports')
+        with self.recorder.stage('discover') as event:
+            dives = discover_na_dives(dive_reports_source, self.directories)
+            self.directories.save()
+            event.rows = len(dives)
+        with self.recorder.stage('dat scan') as event:
+            dat_catalog = DatCatalog(
+                os.path.join(self.config['base_dir'], 'raw', 'nav', 'navest'),
+                os.path.join(self.state_dir, f'{self.cruise_number}_dat_catalog.json'),
+            )
+            event.rows = len(dat_catalog.file_paths)
+        jobs = []
+        for dive, ctd_nav_tsv, o2s_nav_tsv in dives:
+            if ctd_nav_tsv is None or o2s_nav_tsv is None:
+                self.results.append(DiveResult(dive, False, 'Missing CTD.NAV or O2S.NAV file'))
+                continue
+            try:
+                # pick this dive's DAT files from the catalog instead of searching the navest folder
+                with self.recorder.stage('dat scan'):
+                    dat_files = dat_catalog.files_for_dive(*dive_time_window(ctd_nav_tsv, o2s_nav_tsv))
+            except (OSError, ValueError) as err:
+                self.results.append(DiveResult(dive, False, str(err)))
+                continue
+            tmp_dir = os.path.join(self.tmp_output_destination, dive)
+            jobs.append(DiveJob(
+                dive,
+                run_na_dive,
+                (self.config, dive, ctd_nav_tsv, o2s_nav_tsv, dat_files, tmp_dir),
+                [ctd_nav_tsv, o2s_nav_tsv, *dat_files],
+            ))
+        return jobs
+
+    def run(self, stop_event=None):
+        self.results = []
+        self.recorder = StageRecorder()
+        started = datetime.now(timezone.utc)
+        try:
+            jobs = self.dive_jobs()
+        except (OSError, ValueError) as err:
+            self.log(f'\n{err}\n')
+            return 1
+        for event in self.recorder.events:
+            self.notify('stage', event)
+        dive_count = len(jobs) + len(self.results)
+        if not dive_count:
+            self.log(f'\nNo dives matching cruise number {self.cruise_number} found in {self.config["base_dir"]}\n')
+            return 1
+        self.notify('start', dive_count)
+        for result in self.results:
+            self.report(result)
+
+        # only dives whose inputs or settings changed since they were last merged
+        config_values = relevant_config(self.config)
+        if not self.force:
+            for job in [job for job in jobs if self.manifest.is_current(job.dive, job.input_files, config_values) and self.is_stored(job.dive)]:
+                jobs.remove(job)
+                result = DiveResult(job.dive, True)
+                result.skipped = True
+                self.results.append(result)
+                self.notify('dive', result)
+            # remembers the new mtime of files that were touched but not changed
+            self.manifest.save()
+        skipped_count = sum(result.skipped for result in self.results)
+        self.log(f'\nFound {dive_count} dives, {skipped_count} already up to date')
+        if not jobs:
+            self.log('\nCruise complete!\n')
+            return 1 if any(not result.ok for result in self.results) else 0
+        self.log(f'Processing {len(jobs)} dives with {min(self.max_workers, len(jobs))} workers')
+
+        os.makedirs(self.tmp_output_destination, exist_ok=True)
+        if self.config['profile']:
+            # named like the trace, so a run's profiles and its trace go together
+            self.profile_dir = os.path.join(self.config['output_dir'], profile_dir_name(self.cruise_number, started))
+            for job in jobs:
+                job.profile_dir = self.profile_dir
+        pool = self.pool or WorkerPool.for_config(self.config, min(self.max_workers, len(jobs)))
+        self.active_pool = pool
+        prefetcher = self.start_prefetch(jobs)
+        try:
+            for job in jobs:
+                future = pool.submit(run_job, job, on_start=functools.partial(self.wakeups.put, ('running', job.dive)))
+                self.pending[future] = job.dive
+                future.add_done_callback(lambda future: self.wakeups.put(('done', future)))
+            if stop_event is not None and stop_event.is_set():
+                self.stop()
+            # nothing is polled, the pool and stop() wake this loop up
+            while self.pending:
+                kind, payload = self.wakeups.get()
+                if kind == 'done' and payload in self.pending:
+                    dive = self.pending.pop(payload)
+                    self.gather(dive, payload, config_values)
+                    if prefetcher is not None:
+                        prefetcher.dive_finished(dive)
+                elif kind == 'running' and payload in self.pending.values():
+                    self.notify('running', payload)
+                    if prefetcher is not None:
+                        prefetcher.dive_started(payload)
+                elif kind == 'stop':
+                    # dives already running finish, the rest are dropped
+                    for future in list(self.pending):
+                        future.cancel()
+        finally:
+            # only clean up once every worker has finished with this cruise. a pool that was passed in keeps running
+            if self.pool is None:
+                pool.shutdown()
+            else:
+                wait(self.pending)
+            self.pending = {}
+            if prefetcher is not None:
+                prefetcher.stop()
+            self.log('\nRemoving temp files...')
+            shutil.rmtree(self.tmp_root, ignore_errors=True)
+
+        failed = [result.dive for result in self.results if not result.ok]
+        cancelled = len(self.results) < dive_count
+        self.save_trace(started, dive_count, cancelled)
+        if self.profile_dir is not None:
+            self.save_profile_summary()
+        if cancelled:
+            self.log('\nCancelled, the next run picks up the remaining dives')
+        elif failed:
+            self.log(f'\nCruise complete, {len(failed)} dive(s) skipped: {", ".join(failed)}')
+        else:
+            self.log('\nCruise complete!')
+        self.log(f'\nMerged csv files saved to {self.config["output_dir"]}\n')
+        return 1 if failed or cancelled else 0
+
+    def stop(self):
+        # from another thread: the dives already running finish, the ones still queued are dropped
+        self.wakeups.put(('stop', None))
+
+    def start_prefetch(self, jobs):
+        # the dives the workers start with are read straight from the server, the rest are copied to local disk
+        # ahead of time. the copies go in the system's temp folder, which is local even if the output isn't
+        first_dives = min(self.max_workers, len(jobs))
+        max_bytes = int(self.config['prefetch_mb']) * 1024 * 1024
+        if not max_bytes or len(jobs) <= first_dives:
+            return None
+        cache_dir = tempfile.mkdtemp(prefix=f'{self.cruise_number}_prefetch_')
+        for job in jobs[first_dives:]:
+            job.prefetch_dir = cache_dir
+        prefetcher = Prefetcher(jobs[first_dives:], cache_dir, max_bytes, int(self.config['prefetch_dives']), self.prefetched)
+        prefetcher.start()
+        return prefetcher
+
+    def prefetched(self, event):
+        # from the prefetch thread
+        self.recorder.events.append(event)
+        self.notify('stage', event)
+
+    def is_stored(self, dive):
+        # a dive that's missing from the store (e.g. it was deleted) is merged again to load it
+        return self.store_dir is None or os.path.exists(dive_store_path(self.store_dir, self.cruise_number, dive))
+
+    def abort(self, dive):
+        # stops a dive that's being merged by killing its worker, the rest of the cruise carries on. called from
+        # other threads, e.g. the GUI's
+        future = next((future for future, pending_dive in list(self.pending.items()) if pending_dive == dive), None)
+        if future is None or self.active_pool is None:
+            return False
+        return self.active_pool.abort(future)
+
+    def gather(self, dive, future, config_values):
+        if future.cancelled():
+            return
+        try:
+            result = future.result()
+        except Exception as err:
+            result = DiveResult(dive, False, str(err))
+        self.results.append(result)
+        if result.ok:
+            self.manifest.record(result.dive, result.inputs, config_values, result.output_file)
+        else:
+            self.manifest.forget(result.dive)
+        self.manifest.save()
+        self.report(result)
+
+    def report(self, result):
+        for line in result.output:
+            if line.strip():
+                self.log(f'{result.dive}: {line}')
+        if result.ok:
+            self.log(f'{result.dive}: merged' + (f' ({result.row_count} rows in {result.seconds:.1f} s)' if result.row_count else ''))
+        else:
+            self.log(f'{result.dive}: SKIPPING DIVE - {result.message}')
+        self.notify('dive', result)
+
+    def save_trace(self, started, dive_count, cancelled):
+        # every stage event of the run, next to the merged files so runs can be compared
+        events = self.recorder.events + [event for result in self.results for event in result.events]
+        totals = stage_totals(events)
+        trace_file = os.path.join(self.config['output_dir'], f'{self.cruise_number}_trace_{started.strftime("%Y%m%dT%H%M%SZ")}.json')
+        finished = datetime.now(timezone.utc)
+        try:
+            write_trace(trace_file, {
+                'cruise_number': self.cruise_number,
+                'merge_engine': self.config['merge_engine'],
+                'workers': self.max_workers,
+                'started': started.isoformat(timespec='seconds'),
+                'finished': finished.isoformat(timespec='seconds'),
+                'seconds': round((finished - started).total_seconds(), 6),
+                'dive_count': dive_count,
+                'cancelled': cancelled,
+                'rows': sum(result.row_count for result in self.results),
+                'stages': {stage: round(seconds, 6) for stage, seconds in totals.items()},
+                'cruise_events': [event.to_dict() for event in self.recorder.events],
+                'dives': [result.to_dict() for result in self.results],
+            })
+        except OSError as err:
+            self.log(f'\nCould not save trace: {err}')
+            return
+        self.log(f'\nTime per stage: {format_stage_totals(totals)}')
+        self.log(f'Trace saved to {trace_file}')
+        self.notify('trace', trace_file)
+
+    def save_profile_summary(self):
+        profiles = [result.profile for result in self.results if result.profile is not None]
+        try:
+            summary_file = write_run_summary(self.profile_dir, f'{self.cruise_number}: {len(profiles)} dive(s) profiled', profiles)
+        except OSError as err:
+            self.log(f'\nCould not save profile summary: {err}')
+            return
+        if summary_file is not None:
+            self.log(f'Profiles saved to {self.profile_dir}, hotspots in {summary_file}')
+
+
+class CruiseRun(threading.Thread):
+    # runs a CruiseScheduler in the background with the same poll/terminate/returncode interface as Popen.
+    # everything the scheduler reports is also put on the events queue as (kind, payload), with ('line', message)
+    # for its output and ('done', returncode) last. notify is called after each one, from this thread. pool is
+    # a WorkerPool kept between runs, otherwise the scheduler starts its own
+    def __init__(self, config_file_path, notify=None, pool=None):
+        super().__init__(daemon=True)
+        self.config_file_path = config_file_path
+        self.notify = notify
+        self.pool = pool
+        self.scheduler = None
+        self.stop_event = threading.Event()
+        self.returncode = None
+        self.events = queue.Queue()
+        # progress collected from the scheduler
+        self.dive_count = 0
+        self.dive_results = []
+        self.cruise_events = []
+        self.trace_file = None
+
+    def run(self):
+        try:
+            config = read_config(self.config_file_path)
+            config['config_file_path'] = self.config_file_path
+            self.scheduler = CruiseScheduler(config, listener=self.handle_event, log=self.log, pool=self.pool)
+            # a terminate() from before the scheduler existed is picked up from stop_event
+            self.returncode = self.scheduler.run(self.stop_event)
+        except Exception as err:
+            self.log(f'\n{type(err).__name__}: {err}\n')
+            raise
+        finally:
+            if self.returncode is None:
+                self.returncode = 1
+            self.handle_event('done', self.returncode)
+
+    def log(self, message):
+        print(message)
+        self.handle_event('line', message)
+
+    def handle_event(self, kind, payload):
+        if kind == 'stage':
+            self.cruise_events.append(payload)
+        elif kind == 'start':
+            self.dive_count = payload
+        elif kind == 'dive':
+            self.dive_results.append(payload)
+        elif kind == 'trace':
+            self.trace_file = payload
+        self.events.put((kind, payload))
+        if self.notify is not None:
+            self.notify()
+
+    def stage_totals(self):
+        return stage_totals(self.cruise_events + [event for result in list(self.dive_results) for event in result.events])
+
+    def abort_dive(self, dive):
+        return self.scheduler is not None and self.scheduler.abort(dive)
+
+    def poll(self):
+        return None if self.is_alive() else self.returncode
+
+    def terminate(self):
+        self.stop_event.set()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge the sensor data of every dive in a cruise')
+    parser.add_argument('config_file_path', help='config file saved by the GUI')
+    parser.add_argument('--workers', type=int, help='number of dives processed at the same time')
+    parser.add_argument('--force', action='store_true', help='reprocess dives that are already up to date')
+    parser.add_argument('--profile', action='store_true', help='profile every dive, whatever the config file says')
+    args = parser.parse_args()
+    cli_config = read_config(args.config_file_path)
+    cli_config['config_file_path'] = args.config_file_path
+    if args.profile:
+        cli_config['profile'] = True
+    sys.exit(CruiseScheduler(cli_config, args.workers, args.force).run())
@@ -0,0 +1,95 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from rovdata_csv import format_r_number
+
+# values around R's switch between fixed and scientific notation, and what write.csv writes for them
+R_WRITE_CSV = [
+    (0.1, '0.1'),
+    (0.001, '0.001'),
+    (0.0012, '0.0012'),
+    (0.00012, '0.00012'),
+    (0.000123, '0.000123'),
+    (0.0001, '1e-04'),
+    (0.00001, '1e-05'),
+    (1.5e-10, '1.5e-10'),
+    (-0.001, '-0.001'),
+    (-0.0001, '-1e-04'),
+    (100.0, '100'),
+    (10000.0, '10000'),
+    (100000.0, '1e+05'),
+    (120000.0, '120000'),
+    (1200000.0, '1200000'),
+    (12000000.0, '1.2e+07'),
+    (123456789012.0, '123456789012'),
+    (-10000.0, '-10000'),
+    (1e100, '1e+100'),
+    (1e-100, '1e-100'),
+    (0.1 + 0.2, '0.3'),
+    (1 / 3, '0.333333333333333'),
+    (2 / 3, '0.666666666666667'),
+    (-1234.5678, '-1234.5678'),
+    (np.nan, 'NA'),
+    (np.inf, 'Inf'),
+    (-np.inf, '-Inf'),
+]
+
+
+def r_write_csv(values):
+    # the cells R itself writes for the values, when R is installed
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.csv')
+        output_file = os.path.join(tmp_dir, 'output.csv')
+        np.savetxt(input_file, values, fmt='%.17g', header='x', comments='')
+        subprocess.run(
+            ['Rscript', '-e', f'write.csv(read.csv("{input_file}"), "{output_file}", row.names = FALSE)'],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        with open(output_file, 'r') as output:
+            return output.read().splitlines()[1:]
+
+
+def parity_values(random_rows, seed):
+    rng = np.random.default_rng(seed)
+    # every decade R could write either way, with 1 to 4 significant digits, and random sensor-like values
+    mantissas = np.array([1.0, 1.2, 1.23, 1.234, 9.999])
+    decades = 10.0 ** np.arange(-8, 13)
+    grid = (mantissas[:, None] * decades[None, :]).ravel()
+    return np.concatenate([grid, -grid, rng.uniform(-7000, 7000, random_rows), rng.lognormal(0, 6, random_rows)])
+
+
+def check_parity(random_rows=2000, seed=0, use_r=False):
+    problems = [
+        f'{value!r}: {format_r_number(value)}, write.csv gives {expected}'
+        for value, expected in R_WRITE_CSV if format_r_number(value) != expected
+    ]
+    print(f'{len(R_WRITE_CSV)} known values, {len(problems)} differ')
+    if shutil.which('Rscript'):
+        values = parity_values(random_rows, seed)
+        differences = [
+            f'{value!r}: {format_r_number(value)}, R gives {expected}'
+            for value, expected in zip(values.tolist(), r_write_csv(values)) if format_r_number(value) != expected
+        ]
+        print(f'{len(values)} values written by R, {len(differences)} differ')
+        problems.extend(differences)
+    elif use_r:
+        problems.append('Rscript not found, only checked against the known values')
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that numbers are written the way R\'s write.csv writes them')
+    parser.add_argument('--rows', type=int, default=2000, help='number of random values on top of the fixed cases')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--r', dest='use_r', action='store_true', help='fail if Rscript is not installed')
+    args = parser.parse_args()
+    found_problems = check_parity(args.rows, args.seed, args.use_r)
+    for problem in found_problems:
+        print(problem)
+    sys.exit(1 if found_problems else 0)
@@ -0,0 +1,112 @@
+import collections
+import hashlib
+import os
+import threading
+
+from dat_extractor import ALT_COLUMN, extract_altitude
+from dive_series import DiveSeries
+
+
+def cache_key(file_path, stat):
+    # a DAT file is known by its name, size and mtime, not its folder: the prefetched copy of a file keeps the
+    # original's name and mtime, so it's the same entry whichever of the two a dive reads
+    return os.path.basename(file_path), stat.st_size, stat.st_mtime_ns
+
+
+def spill_file_name(file_path, stat):
+    # one file per version of a DAT file, so a file that's still being logged to is decoded again once it grows
+    name, size, mtime_ns = cache_key(file_path, stat)
+    name_hash = hashlib.sha1(name.encode()).hexdigest()[:16]
+    return f'{name_hash}_{size}_{mtime_ns}.series'
+
+
+class DatCache:
+    # the altitude records decoded from each DAT file, keyed by name, size and mtime. NA dives share the DAT
+    # files at the edges of their time windows, so a file is only decoded once however many dives use it.
+    # the least recently used records are dropped once they take up more than max_bytes. with a spill_dir,
+    # every decoded file is also saved there as a DiveSeries, so other workers on the same cruise memory-map
+    # it instead of decoding it again. files can be looked up from several threads at once
+    def __init__(self, max_bytes, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.bytes_cached = 0
+        # DAT bytes actually decoded, for the dat decode stage
+        self.bytes_decoded = 0
+        self.hits = 0
+        self.spill_hits = 0
+
+    def altitude(self, file_path):
+        stat = os.stat(file_path)
+        key = cache_key(file_path, stat)
+        with self.lock:
+            records = self.entries.get(key)
+            if records is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return records
+
+        spill_file = os.path.join(self.spill_dir, spill_file_name(file_path, stat)) if self.spill_dir else None
+        records = self.load_spilled(spill_file)
+        if records is None:
+            records = extract_altitude(file_path)
+            with self.lock:
+                self.bytes_decoded += stat.st_size
+            self.spill(spill_file, records)
+        with self.lock:
+            self.add(key, records)
+        return records
+
+    def load_spilled(self, spill_file):
+        if spill_file is None or not os.path.exists(spill_file):
+            return None
+        try:
+            records = DiveSeries.load(spill_file)
+        except (OSError, ValueError):
+            return None
+        with self.lock:
+            self.spill_hits += 1
+        return records
+
+    def spill(self, spill_file, records):
+        if spill_file is None:
+            return
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            records.save(spill_file)
+        except OSError:
+            # spilling only saves time, the records are still kept in memory
+            pass
+
+    def add(self, key, records):
+        # called with the lock held
+        if key in self.entries:
+            return
+        self.entries[key] = records
+        self.bytes_cached += series_bytes(records)
+        while self.bytes_cached > self.max_bytes and len(self.entries) > 1:
+            _, dropped = self.entries.popitem(last=False)
+            self.bytes_cached -= series_bytes(dropped)
+
+    def dive_altitude(self, dat_files):
+        # the same records as extract_dive_altitude
+        return DiveSeries.concatenate((self.altitude(file_path) for file_path in dat_files), [ALT_COLUMN])
+
+
+def series_bytes(series):
+    return series.seconds.nbytes + sum(values.nbytes for values in series.columns.values())
+
+
+# the cache of this (worker) process, and the spill folder of the cruise run it was made for
+dat_cache = None
+dat_cache_run = None
+
+
+def cruise_dat_cache(config, spill_dir):
+    # spill_dir is inside the cruise's temp folder, so a worker starts a new cache for every cruise it's given
+    global dat_cache, dat_cache_run
+    if dat_cache is None or dat_cache_run != spill_dir:
+        dat_cache = DatCache(int(config['dat_cache_mb']) * 1024 * 1024, spill_dir if config['dat_cache_spill'] else None)
+        dat_cache_run = spill_dir
+    return dat_cache
@@ -0,0 +1,122 @@
+import json
+import os
+import re
+
+import numpy as np
+
+# navest files are named after the hour they start, e.g. 20220407_0600.DAT
+DAT_FILE_NAME = re.compile(r'^(\d{4})(\d{2})(\d{2})_(\d{2})(\d{2})\.DAT$')
+CATALOG_VERSION = 1
+
+
+def read_first_and_last_line(file_path):
+    # same as `head -1` and `tail -1`, without reading the whole file
+    with open(file_path, 'rb') as tsv_file:
+        first_line = tsv_file.readline()
+        tsv_file.seek(0, os.SEEK_END)
+        size = tsv_file.tell()
+        tsv_file.seek(max(0, size - 65536))
+        last_line = tsv_file.read().rstrip(b'\n').rsplit(b'\n', 1)[-1]
+    return first_line.decode().rstrip('\r\n'), last_line.decode().rstrip('\r')
+
+
+def dive_time_window(ctd_nav_tsv, o2s_nav_tsv):
+    # earliest start and latest end of the CTD and O2S files, as epoch seconds
+    ctd_first, ctd_last = read_first_and_last_line(ctd_nav_tsv)
+    o2s_first, o2s_last = read_first_and_last_line(o2s_nav_tsv)
+    start_dive_time = min(ctd_first.split('\t', 1)[0], o2s_first.split('\t', 1)[0])
+    end_dive_time = max(ctd_last.split('\t', 1)[0], o2s_last.split('\t', 1)[0])
+    if not start_dive_time:
+        raise ValueError('No start dive time found')
+    if not end_dive_time:
+        raise ValueError(f'No end dive time found in {ctd_nav_tsv} or {o2s_nav_tsv}')
+    start, end = np.array([start_dive_time, end_dive_time], dtype='datetime64[s]').astype(np.int64)
+    return int(start), int(end)
+
+
+class DatCatalog:
+    # start time of every DAT file in raw/nav/navest, built once per cruise and saved to cache_file.
+    # the saved catalog is rebuilt whenever the mtime of one of the scanned directories changes.
+    def __init__(self, dat_path, cache_file=None):
+        self.dat_path = dat_path
+        self.cache_file = cache_file
+        self.dir_mtimes = {}
+        self.start_times = np.empty(0, dtype=np.int64)
+        self.file_paths = []
+
+        if not self.load():
+            self.build()
+            self.save()
+
+    def scan(self):
+        # find "$dat_path" -name "*.DAT", remembering the mtime of every directory visited
+        dir_mtimes = {}
+        found = []
+        directories = [self.dat_path]
+        while directories:
+            directory = directories.pop()
+            dir_mtimes[directory] = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        directories.append(entry.path)
+                    elif DAT_FILE_NAME.match(entry.name):
+                        found.append((entry.name, entry.path))
+        return dir_mtimes, found
+
+    def build(self):
+        self.dir_mtimes, found = self.scan()
+        iso_times = [
+            '{}-{}-{}T{}:{}'.format(*DAT_FILE_NAME.match(name).groups())
+            for name, _ in found
+        ]
+        start_times = np.array(iso_times, dtype='datetime64[m]').astype('datetime64[s]').astype(np.int64)
+        order = np.argsort(start_times, kind='stable')
+        self.start_times = start_times[order]
+        self.file_paths = [found[i][1] for i in order]
+
+    def is_current(self, dir_mtimes):
+        try:
+            return all(os.stat(directory).st_mtime_ns == mtime for directory, mtime in dir_mtimes.items())
+        except OSError:
+            return False
+
+    def load(self):
+        if self.cache_file is None:
+            return False
+        try:
+            with open(self.cache_file, 'r') as catalog_file:
+                saved = json.load(catalog_file)
+        except (OSError, ValueError):
+            return False
+        if saved.get('version') != CATALOG_VERSION or saved.get('dat_path') != self.dat_path:
+            return False
+        if not self.is_current(saved['dir_mtimes']):
+            return False
+        self.dir_mtimes = saved['dir_mtimes']
+        self.start_times = np.array(saved['start_times'], dtype=np.int64)
+        self.file_paths = saved['file_paths']
+        return True
+
+    def save(self):
+        if self.cache_file is None:
+            return
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with open(self.cache_file, 'w') as catalog_file:
+            json.dump({
+                'version': CATALOG_VERSION,
+                'dat_path': self.dat_path,
+                'dir_mtimes': self.dir_mtimes,
+                'start_times': self.start_times.tolist(),
+                'file_paths': self.file_paths,
+            }, catalog_file)
+
+    def files_between(self, start, end):
+        # every file that starts in [start, end], in time order
+        first = np.searchsorted(self.start_times, start, side='left')
+        last = np.searchsorted(self.start_times, end, side='right')
+        return self.file_paths[first:last]
+
+    def files_for_dive(self, start, end):
+        # the file that was already being written when the dive started begins up to an hour earlier
+        return self.files_between(start - 3600, end)
@@ -0,0 +1,138 @@
+import mmap
+import os
+
+import numpy as np
+
+from dive_series import DiveSeries
+
+# VFR 2022/04/17 18:00:02.615 13 0 SOLN_DEADRECK -174.606671 30.693783 0.000 2.330 100 0.16 59.80
+RECORD_PREFIX = b'VFR'
+RECORD_TYPE = b'SOLN_DEADRECK'
+DATE_FIELD = 2
+TIME_FIELD = 3
+ALT_FIELD = 10
+# records are ~100 bytes, anything longer is cut off here
+MAX_LINE_LENGTH = 512
+MAX_ALT_LENGTH = 32
+WHITESPACE = np.array([ord(' '), ord('\t'), ord('\r')], dtype=np.uint8)
+# the one column of the DiveSeries decoded from DAT files: one altitude per second, in file order
+ALT_COLUMN = 'Alt'
+
+
+def digits_to_int(rows, columns):
+    value = np.zeros(len(rows), dtype=np.int64)
+    for column in columns:
+        value = value * 10 + (rows[:, column].astype(np.int64) - ord('0'))
+    return value
+
+
+def all_digits(rows, columns):
+    return ((rows[:, columns] >= ord('0')) & (rows[:, columns] <= ord('9'))).all(axis=1)
+
+
+def parse_float_fields(fields):
+    # fixed width, zero padded byte rows -> float64, anything unparseable -> nan
+    width = fields.shape[1]
+    text = np.ascontiguousarray(fields).view(f'S{width}').reshape(-1)
+    try:
+        return text.astype(np.float64)
+    except ValueError:
+        parsed = np.full(len(text), np.nan)
+        for i, value in enumerate(text.tolist()):
+            try:
+                parsed[i] = float(value)
+            except ValueError:
+                pass
+        return parsed
+
+
+def field_bounds(is_field_start, is_space, field):
+    # column where the 1-based field starts in every row, and its length
+    ordinal = np.cumsum(is_field_start, axis=1)
+    in_field = (ordinal == field) & ~is_space
+    start = np.argmax(in_field, axis=1)
+    return start, in_field.sum(axis=1)
+
+
+def gather(rows, start, width):
+    columns = np.minimum(start[:, None] + np.arange(width), rows.shape[1] - 1)
+    return np.take_along_axis(rows, columns, axis=1)
+
+
+def decode_records(buffer):
+    # same records as `ag "VFR.*SOLN_DEADRECK.*" | awk '{print $2, $3, $10}' | awk -F"." '!seen[$1]++'`
+    newlines = np.flatnonzero(buffer == ord('\n'))
+    line_starts = np.concatenate(([0], newlines + 1))
+    line_ends = np.concatenate((newlines, [len(buffer)]))
+
+    prefix_length = len(RECORD_PREFIX)
+    candidates = line_ends - line_starts > prefix_length
+    for i, byte in enumerate(RECORD_PREFIX):
+        candidates &= buffer[np.minimum(line_starts + i, len(buffer) - 1)] == byte
+    line_starts = line_starts[candidates]
+    line_lengths = np.minimum(line_ends[candidates] - line_starts, MAX_LINE_LENGTH)
+    if not len(line_starts):
+        return DiveSeries.empty([ALT_COLUMN])
+
+    # copy just the candidate lines into a (lines x width) array, padded with spaces
+    width = int(line_lengths.max())
+    columns = np.arange(width)
+    rows = buffer[np.minimum(line_starts[:, None] + columns, len(buffer) - 1)]
+    rows[columns >= line_lengths[:, None]] = ord(' ')
+
+    type_length = len(RECORD_TYPE)
+    has_type = np.zeros(len(rows), dtype=bool)
+    if width >= type_length:
+        found = np.ones((len(rows), width - type_length + 1), dtype=bool)
+        for i, byte in enumerate(RECORD_TYPE):
+            found &= rows[:, i:width - type_length + 1 + i] == byte
+        has_type = found.any(axis=1)
+
+    is_space = np.isin(rows, WHITESPACE)
+    is_field_start = ~is_space
+    is_field_start[:, 1:] &= is_space[:, :-1]
+
+    date_start, date_length = field_bounds(is_field_start, is_space, DATE_FIELD)
+    time_start, time_length = field_bounds(is_field_start, is_space, TIME_FIELD)
+    alt_start, alt_length = field_bounds(is_field_start, is_space, ALT_FIELD)
+
+    # YYYY/MM/DD and HH:MM:SS[.fff]
+    dates = gather(rows, date_start, 10)
+    times = gather(rows, time_start, 8)
+    valid = (
+        has_type & (date_length == 10) & (time_length >= 8) & (alt_length > 0)
+        & all_digits(dates, [0, 1, 2, 3, 5, 6, 8, 9]) & (dates[:, 4] == ord('/')) & (dates[:, 7] == ord('/'))
+        & all_digits(times, [0, 1, 3, 4, 6, 7]) & (times[:, 2] == ord(':')) & (times[:, 5] == ord(':'))
+    )
+    dates, times = dates[valid], times[valid]
+    months = (digits_to_int(dates, [0, 1, 2, 3]) - 1970) * 12 + digits_to_int(dates, [5, 6]) - 1
+    days = (np.datetime64('1970-01', 'M') + months.astype('timedelta64[M]')).astype('datetime64[D]').astype(np.int64)
+    days += digits_to_int(dates, [8, 9]) - 1
+    seconds = days * 86400 + digits_to_int(times, [0, 1]) * 3600 + digits_to_int(times, [3, 4]) * 60 + digits_to_int(times, [6, 7])
+
+    alt_fields = gather(rows[valid], alt_start[valid], MAX_ALT_LENGTH)
+    alt_fields[np.arange(MAX_ALT_LENGTH) >= alt_length[valid][:, None]] = 0
+    altitude = parse_float_fields(alt_fields)
+
+    # first record in each second
+    _, first = np.unique(seconds, return_index=True)
+    first.sort()
+    return DiveSeries(seconds[first], {ALT_COLUMN: altitude[first]})
+
+
+def extract_altitude(file_path):
+    if os.path.getsize(file_path) == 0:
+        return DiveSeries.empty([ALT_COLUMN])
+    with open(file_path, 'rb') as dat_file:
+        with mmap.mmap(dat_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            buffer = np.frombuffer(mapped, dtype=np.uint8)
+            try:
+                return decode_records(buffer)
+            finally:
+                # the mapping can't be closed while numpy still holds a view of it
+                del buffer
+
+
+def extract_dive_altitude(dat_files):
+    # every DAT file picked for a dive, one after another, like the `for file in ...` loop in extract_DAT.sh
+    return DiveSeries.concatenate((extract_altitude(file_path) for file_path in dat_files), [ALT_COLUMN])
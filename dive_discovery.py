@@ -0,0 +1,127 @@
+import json
+import os
+import re
+
+from ex_merge import expand_template
+
+CACHE_VERSION = 1
+# what ${dive} matches in a file name template: the shortest name that lets the rest of the template match
+DIVE_PATTERN = '(?P<dive>.+?)'
+
+
+class DirectoryCache:
+    # the files and subdirectories of every directory listed, saved to cache_file. a saved listing is used as
+    # long as the directory's mtime hasn't changed (files were added, removed, or renamed), so a run over a
+    # cruise that's already been processed only stats its directories instead of listing them
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.directories = {}
+        self.changed = False
+        self.load()
+
+    def listing(self, directory):
+        mtime_ns = os.stat(directory).st_mtime_ns
+        entry = self.directories.get(directory)
+        if entry is None or entry['mtime_ns'] != mtime_ns:
+            files = []
+            subdirectories = []
+            with os.scandir(directory) as entries:
+                for dir_entry in entries:
+                    if dir_entry.is_dir():
+                        subdirectories.append(dir_entry.name)
+                    else:
+                        files.append(dir_entry.name)
+            entry = {'mtime_ns': mtime_ns, 'files': sorted(files), 'directories': sorted(subdirectories)}
+            self.directories[directory] = entry
+            self.changed = True
+        return entry
+
+    def files(self, directory):
+        return self.listing(directory)['files']
+
+    def subdirectories(self, directory):
+        return self.listing(directory)['directories']
+
+    def load(self):
+        if self.cache_file is None:
+            return
+        try:
+            with open(self.cache_file, 'r') as cache:
+                saved = json.load(cache)
+        except (OSError, ValueError):
+            return
+        if saved.get('version') == CACHE_VERSION:
+            self.directories = saved['directories']
+
+    def save(self):
+        if self.cache_file is None or not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with open(self.cache_file, 'w') as cache:
+            json.dump({'version': CACHE_VERSION, 'directories': self.directories}, cache)
+        self.changed = False
+
+
+def compile_file_template(template, config):
+    # "${cruise}_${dive}_" -> one regex that finds the file of any dive and captures the dive's name. like the
+    # grep in ex_ctd_processor.sh, the rest of the template is a regular expression
+    return re.compile(DIVE_PATTERN.join(expand_template(part, config) for part in template.split('${dive}')))
+
+
+def files_by_dive(names, pattern):
+    # the first of the (sorted) names that matches for each dive. a template without ${dive} matches the
+    # same file for every dive, which is kept under None
+    matches = {}
+    for name in names:
+        match = pattern.search(name)
+        if match is not None:
+            matches.setdefault(match.groupdict().get('dive'), name)
+    return matches
+
+
+def discover_dives(config, directories=None):
+    # [(dive, ctd file, tracking file)] for every .cnv file that matches ctd_file_names, with None for a
+    # file that wasn't found. each directory is listed once, however many dives there are
+    directories = directories or DirectoryCache()
+    ctd_dir = expand_template(config['ctd_dir'], config)
+    tracking_dir = expand_template(config['tracking_dir'], config)
+    ctd_names = directories.files(ctd_dir)
+    tracking_names = directories.files(tracking_dir)
+
+    ctd_pattern = compile_file_template(config['ctd_file_names'], config)
+    if not ctd_pattern.groups:
+        raise ValueError('The CTD file names need to contain ${dive}')
+    ctd_files = files_by_dive(ctd_names, ctd_pattern)
+    tracking_files = files_by_dive(tracking_names, compile_file_template(config['tracking_file_names'], config))
+    cnv_dives = files_by_dive([name for name in ctd_names if re.search('.cnv', name)], ctd_pattern)
+
+    dives = []
+    for dive in cnv_dives:
+        ctd_name = ctd_files.get(dive)
+        tracking_name = tracking_files.get(dive, tracking_files.get(None))
+        dives.append((
+            dive,
+            os.path.join(ctd_dir, ctd_name) if ctd_name else None,
+            os.path.join(tracking_dir, tracking_name) if tracking_name else None,
+        ))
+    return dives
+
+
+def discover_na_dives(dive_reports_source, directories=None):
+    # [(dive, CTD.NAV tsv, O2S.NAV tsv)] for every H* folder in dive_reports, with None for a file that
+    # isn't in the dive's merged folder
+    directories = directories or DirectoryCache()
+    dives = []
+    for dive in directories.subdirectories(dive_reports_source):
+        if not dive.startswith('H'):
+            continue
+        merged_dir = os.path.join(dive_reports_source, dive, 'merged')
+        try:
+            names = set(directories.files(merged_dir))
+        except OSError:
+            names = set()
+        dives.append(tuple([dive] + [
+            os.path.join(merged_dir, name) if name in names else None
+            for name in [f'{dive}.CTD.NAV.tsv', f'{dive}.O2S.NAV.tsv']
+        ]))
+    return dives
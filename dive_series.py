@@ -0,0 +1,128 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+SERIES_VERSION = 1
+# a .series file: the magic bytes, the length of a JSON header, the header, then each array's raw bytes at
+# an aligned offset, so np.memmap can open any of them without reading the rest of the file
+SERIES_MAGIC = b'CTDSERIES\x00'
+HEADER_LENGTH = struct.Struct('<Q')
+ALIGNMENT = 64
+
+
+def aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+class DiveSeries:
+    # one sensor stream of a dive: int64 epoch seconds and a float array for each named column (float64, or
+    # float32 where that's enough), all the same length. slicing by time gives views of the same arrays
+    __slots__ = ('seconds', 'columns')
+
+    def __init__(self, seconds=None, columns=None):
+        self.seconds = np.empty(0, dtype=np.int64) if seconds is None else np.asarray(seconds, dtype=np.int64)
+        self.columns = dict(columns or {})
+        for name, values in self.columns.items():
+            if len(values) != len(self.seconds):
+                raise ValueError(f'{name} has {len(values)} values for {len(self.seconds)} times')
+
+    @classmethod
+    def empty(cls, names, dtype=np.float64):
+        return cls(None, {name: np.empty(0, dtype=dtype) for name in names})
+
+    def __len__(self):
+        return len(self.seconds)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __repr__(self):
+        return f'DiveSeries({len(self)} rows, columns={list(self.columns)})'
+
+    def select(self, index):
+        # the rows picked by a slice (views of the same arrays), or by an index or mask array (copies)
+        return DiveSeries(self.seconds[index], {name: values[index] for name, values in self.columns.items()})
+
+    def between(self, start, end):
+        # rows with start <= seconds < end, without copying. the series has to be sorted by time
+        first, last = np.searchsorted(self.seconds, [start, end], side='left')
+        return self.select(slice(first, last))
+
+    def sorted_by_time(self):
+        # stable, so rows with the same time stay in file order. an already sorted series is returned as is
+        if len(self) < 2 or (self.seconds[1:] >= self.seconds[:-1]).all():
+            return self
+        return self.select(np.argsort(self.seconds, kind='stable'))
+
+    @classmethod
+    def concatenate(cls, parts, names=()):
+        # parts one after another, e.g. the fragments decoded from each DAT file of a dive. names are the
+        # columns of the result when there are no parts
+        parts = list(parts)
+        if not parts:
+            return cls.empty(names)
+        names = list(parts[0].columns)
+        for part in parts[1:]:
+            if list(part.columns) != names:
+                raise ValueError(f'Cannot concatenate series with columns {names} and {list(part.columns)}')
+        return cls(
+            np.concatenate([part.seconds for part in parts]),
+            {name: np.concatenate([part.columns[name] for part in parts]) for name in names},
+        )
+
+    @classmethod
+    def merge(cls, parts, names=()):
+        # a k-way merge of parts that are each sorted by time. rows with the same time keep the order of the
+        # parts, so it's the same as a stable sort of the parts one after another. the stable sort finds the
+        # sorted runs and merges them, and parts that don't overlap are just concatenated
+        return cls.concatenate(parts, names).sorted_by_time()
+
+    def save(self, file_path):
+        # written to a tmp file first, so a reader never maps a half-written series. the tmp name is unique to
+        # this process, in case another worker is saving the same series
+        arrays = [('seconds', self.seconds)] + list(self.columns.items())
+        arrays = [(name, np.ascontiguousarray(values)) for name, values in arrays]
+        entries = []
+        # offsets are relative to the end of the header, which depends on its own length
+        offset = 0
+        for name, values in arrays:
+            offset = aligned(offset)
+            entries.append({'name': name, 'dtype': values.dtype.str, 'offset': offset})
+            offset += values.nbytes
+        header = json.dumps({'version': SERIES_VERSION, 'rows': len(self), 'arrays': entries}).encode()
+        data_start = aligned(len(SERIES_MAGIC) + HEADER_LENGTH.size + len(header))
+
+        tmp_file = f'{file_path}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as series_file:
+            series_file.write(SERIES_MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+            for entry, (_, values) in zip(entries, arrays):
+                series_file.seek(data_start + entry['offset'])
+                series_file.write(values.tobytes())
+            series_file.truncate(data_start + offset)
+        os.replace(tmp_file, file_path)
+        return file_path
+
+    @classmethod
+    def load(cls, file_path, mmap=True):
+        # with mmap, the arrays are read-only views of the file and only the pages that are used get read
+        with open(file_path, 'rb') as series_file:
+            if series_file.read(len(SERIES_MAGIC)) != SERIES_MAGIC:
+                raise ValueError(f'{file_path} is not a dive series file')
+            header_length, = HEADER_LENGTH.unpack(series_file.read(HEADER_LENGTH.size))
+            header = json.loads(series_file.read(header_length))
+            if header.get('version') != SERIES_VERSION:
+                raise ValueError(f'{file_path} was saved by a different version')
+            data_start = aligned(len(SERIES_MAGIC) + HEADER_LENGTH.size + header_length)
+            rows = header['rows']
+            arrays = {}
+            for entry in header['arrays']:
+                dtype = np.dtype(entry['dtype'])
+                if mmap and rows:
+                    arrays[entry['name']] = np.memmap(file_path, dtype=dtype, mode='r', offset=data_start + entry['offset'], shape=(rows,))
+                else:
+                    series_file.seek(data_start + entry['offset'])
+                    arrays[entry['name']] = np.fromfile(series_file, dtype=dtype, count=rows)
+        seconds = arrays.pop('seconds')
+        return cls(seconds, arrays)
@@ -0,0 +1,245 @@
+import os
+
+from datetime import datetime, timezone
+from string import Template
+
+import numpy as np
+
+from dive_series import DiveSeries
+from joins import join_streams
+from resample import resample_dive
+from rov_store import rov_store_dir, store_dive
+from rovdata_csv import column_formatter, rovdata_file_name, write_rovdata_csv
+from rovdata_npz import npz_file_path, write_rovdata_npz
+from sensor_files import CHUNK_BYTES, numeric_block_chunks, parse_csv_columns
+from stage_events import StageRecorder, file_sizes
+
+# ctd_seconds_from: "2000" = 2000-01-01 00:00:00; "UNIX" = 1970-01-01 00:00:00, "ELAPSED" = dive start time
+EPOCH_OFFSETS = {
+    '2000': 946684800,
+    'UNIX': 0,
+}
+MONTHS = {
+    'Jan': '01', 'Feb': '02', 'Mar': '03', 'Apr': '04', 'May': '05', 'Jun': '06',
+    'Jul': '07', 'Aug': '08', 'Sep': '09', 'Oct': '10', 'Nov': '11', 'Dec': '12',
+}
+OUTPUT_HEADER = ['Latitude', 'Longitude', 'Depth', 'Temperature', 'oxygen_ml_per_l', 'Salinity', 'Date', 'Alt']
+
+
+def first_rows_per_key(keys, seen):
+    # the rows holding the first of each key, in file order, leaving out keys already in `seen` (sorted) ->
+    # (rows, seen with the new keys). EX.R keeps one row for each key across the whole file
+    new_keys, first_rows = np.unique(keys, return_index=True)
+    if len(seen) and len(new_keys) and new_keys[0] <= seen[-1]:
+        # the clock went backwards, drop the keys that were already kept
+        unseen = ~np.isin(new_keys, seen, assume_unique=True)
+        new_keys, first_rows = new_keys[unseen], first_rows[unseen]
+        seen = np.union1d(seen, new_keys)
+    else:
+        seen = np.concatenate([seen, new_keys])
+    return np.sort(first_rows), seen
+
+
+def expand_template(template, config, dive=''):
+    # the same ${...} variables the shell script evals the settings with
+    return Template(template).safe_substitute(
+        base_dir=config['base_dir'],
+        output_dir=config['output_dir'],
+        cruise=config['cruise_number'],
+        cruise_number=config['cruise_number'],
+        dive=dive,
+    )
+
+
+class CnvHeader:
+    # everything the merge needs from the header, read in one pass up to *END*: the start_time fields, the
+    # System UTC, the "# name N = ..." column descriptors, and where the data block starts (in bytes and lines)
+    def __init__(self, file_path=None):
+        self.start_time = None
+        self.system_utc_text = None
+        self.column_names = []
+        self.data_offset = 0
+        self.line_count = 0
+
+        if file_path is not None:
+            self.read(file_path)
+
+    def read(self, file_path):
+        with open(file_path, 'rb') as cnv_file:
+            for line in cnv_file:
+                self.data_offset += len(line)
+                self.line_count += 1
+                line = line.decode('latin-1')
+                if self.start_time is None and 'start_time' in line:
+                    self.start_time = line.split()
+                if '* System UTC = ' in line:
+                    self.system_utc_text = line.split(' = ')[1].strip()
+                if line.startswith('# name '):
+                    # "# name 0 = timeS: Time, Elapsed [seconds]"
+                    self.column_names.append(line.split(' = ', 1)[1].strip())
+                if '*END*' in line:
+                    break
+
+    @property
+    def system_utc(self):
+        if self.system_utc_text is None:
+            return None
+        return datetime.strptime(self.system_utc_text, '%b %d %Y %H:%M:%S').replace(tzinfo=timezone.utc)
+
+    def to_dict(self):
+        return {
+            'start_time': self.start_time,
+            'system_utc': self.system_utc_text,
+            'column_names': self.column_names,
+            'data_offset': self.data_offset,
+            'line_count': self.line_count,
+        }
+
+    @classmethod
+    def from_dict(cls, saved):
+        header = cls()
+        header.start_time = saved['start_time']
+        header.system_utc_text = saved['system_utc']
+        header.column_names = saved['column_names']
+        header.data_offset = saved['data_offset']
+        header.line_count = saved['line_count']
+        return header
+
+    def dive_start_date(self):
+        # same fields the shell script pulls out with awk: "# start_time = Aug 24 2023 ..."
+        if self.start_time is None or len(self.start_time) < 6:
+            raise ValueError('start_time not found in CNV header')
+        month = self.start_time[3]
+        return f'{self.start_time[5]}{MONTHS.get(month, month)}{self.start_time[4]}'
+
+
+class ExMerger:
+    def __init__(self, config):
+        self.config = config
+        self.cruise_number = config['cruise_number']
+        self.store_dir = rov_store_dir(config)
+
+    def epoch_offset(self, header):
+        seconds_from = self.config['ctd_seconds_from']
+        if seconds_from in EPOCH_OFFSETS:
+            return EPOCH_OFFSETS[seconds_from]
+        if seconds_from == 'ELAPSED':
+            if header.system_utc is None:
+                raise ValueError('System start time not found')
+            return int(header.system_utc.timestamp())
+        raise ValueError('Invalid ctd_seconds_from value')
+
+    def read_ctd_data(self, ctd_file, header, chunk_bytes=CHUNK_BYTES, first_per_second=True):
+        # the data block is read a chunk at a time and only the rows and columns that get merged are kept, so
+        # memory depends on the chunk size and the merged rows rather than on how long the dive was logged for.
+        # without first_per_second every row is kept, for a resample reducer that uses all of them
+        wanted = self.ctd_columns()
+        kept = []
+        seen = np.empty(0)
+        with open(ctd_file, 'rb') as cnv_file:
+            cnv_file.seek(header.data_offset)
+            for data in numeric_block_chunks(cnv_file, chunk_bytes):
+                if not first_per_second:
+                    kept.append(data[:, wanted])
+                    continue
+                # only grab one row for each second (EX.R always keys on the first column)
+                first_rows, seen = first_rows_per_key(data[:, 0], seen)
+                if len(first_rows):
+                    kept.append(data[np.ix_(first_rows, wanted)])
+        return self.ctd_series(np.concatenate(kept) if kept else np.empty((0, len(wanted))), header)
+
+    def ctd_columns(self):
+        # the columns of the data block that get merged, the time key first
+        cols = self.config['ctd_cols']
+        return [0] + [int(cols[name]) - 1 for name in ['temperature', 'depth', 'salinity', 'oxygen']]
+
+    def ctd_series(self, data, header):
+        # rows of the ctd_columns -> DiveSeries
+        seconds = np.floor(self.epoch_offset(header) + data[:, 0]).astype(np.int64)
+        return DiveSeries(seconds, {
+            'Temperature': data[:, 1],
+            'Depth': data[:, 2],
+            'Salinity': data[:, 3],
+            'Oxygen.ML.L': data[:, 4],
+        })
+
+    def read_nav_data(self, nav_file):
+        with open(nav_file, 'r', encoding='latin-1') as csv_file:
+            return self.nav_series(csv_file.read())
+
+    def nav_series(self, text):
+        # lines of the tracking csv -> DiveSeries
+        cols = self.config['tracking_cols']
+        unix_time, alt, lat, long = parse_csv_columns(text, [
+            int(cols['unix_time']),
+            int(cols['altitude']),
+            int(cols['latitude']),
+            int(cols['longitude']),
+        ])
+        # select only the rows that have a time, lat, and long
+        keep = ~(np.isnan(unix_time) | np.isnan(lat) | np.isnan(long))
+        return DiveSeries(np.floor(unix_time[keep]).astype(np.int64), {
+            'Alt': alt[keep],
+            'Lat': lat[keep],
+            'Long': long[keep],
+        })
+
+    def join(self, ctd_data, nav_data):
+        return join_streams(
+            ctd_data.seconds,
+            nav_data.seconds,
+            int(self.config['join_tolerance']),
+            self.config['join_direction'],
+        )
+
+    @staticmethod
+    def output_columns(ctd_data, nav_data, indexes):
+        # the joined rows, by OUTPUT_HEADER column
+        ctd_index, nav_index = indexes
+        return {
+            'Latitude': nav_data['Lat'][nav_index],
+            'Longitude': nav_data['Long'][nav_index],
+            'Depth': ctd_data['Depth'][ctd_index],
+            'Temperature': ctd_data['Temperature'][ctd_index],
+            'oxygen_ml_per_l': ctd_data['Oxygen.ML.L'][ctd_index],
+            'Salinity': ctd_data['Salinity'][ctd_index],
+            'Date': ctd_data.seconds[ctd_index],
+            'Alt': nav_data['Alt'][nav_index],
+        }
+
+    def output_formatters(self, columns):
+        # (values, formatter) for write_rovdata_csv
+        decimals = self.config['csv_decimals']
+        return [(values, column_formatter(name, decimals.get(name))) for name, values in columns.items()]
+
+    def write_dive(self, dive, header, ctd_data, nav_data, indexes):
+        file_name = rovdata_file_name(self.cruise_number, dive, header.dive_start_date(), self.config['csv_gzip'])
+        output_file_path = os.path.join(self.config['output_dir'], file_name)
+        columns = self.output_columns(ctd_data, nav_data, indexes)
+        row_count = write_rovdata_csv(output_file_path, OUTPUT_HEADER, self.output_formatters(columns))
+        if self.config['output_format'] == 'csv+npz':
+            write_rovdata_npz(npz_file_path(output_file_path), {
+                'cruise_number': self.cruise_number,
+                'dive': dive,
+                'dive_start_date': header.dive_start_date(),
+            }, columns)
+        if self.store_dir is not None:
+            store_dive(self.store_dir, self.cruise_number, dive, columns)
+        return output_file_path, row_count
+
+    def merge_dive(self, dive, ctd_file, nav_file, recorder=None, header=None):
+        # header is the file's CnvHeader if the caller already has it, e.g. from the cruise's CnvCatalog
+        recorder = recorder or StageRecorder(dive)
+        with recorder.stage('parse', file_sizes([ctd_file, nav_file])) as event:
+            header = header or CnvHeader(ctd_file)
+            ctd_data = self.read_ctd_data(ctd_file, header, first_per_second=self.config['resample_reducer'] == 'first')
+            nav_data = self.read_nav_data(nav_file)
+            event.rows = len(ctd_data) + len(nav_data)
+        ctd_data, nav_data = resample_dive(self.config, recorder, [ctd_data, nav_data])
+        with recorder.stage('join') as event:
+            indexes = self.join(ctd_data, nav_data)
+            event.rows = len(indexes[0])
+        with recorder.stage('write') as event:
+            output_file_path, row_count = self.write_dive(dive, header, ctd_data, nav_data, indexes)
+            event.rows = row_count
+        return output_file_path, row_count
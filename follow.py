@@ -0,0 +1,570 @@
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+import threading
+import time
+
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from config_file_handler import cruise_preset, read_config
+from cruise_scheduler import STATE_DIR_NAME
+from dat_catalog import DatCatalog
+from dat_extractor import ALT_COLUMN, decode_records
+from dive_discovery import discover_dives, discover_na_dives
+from dive_series import DiveSeries
+from ex_merge import OUTPUT_HEADER as EX_OUTPUT_HEADER, CnvHeader, ExMerger, first_rows_per_key
+from na_merge import MISSING_TIME, OUTPUT_HEADER as NA_OUTPUT_HEADER, NaMerger
+from resample import is_default, resample_series
+from rovdata_csv import append_rovdata_csv, rovdata_file_name
+from run_manifest import RunManifest, relevant_config
+from sensor_files import parse_numeric_block, split_delimited
+
+FOLLOW_VERSION = 2
+# most of a file read in one poll, a file that's further behind than this is caught up over several polls
+TAIL_BYTES = 16 << 20
+# bytes before the offset remembered for each file, to notice a file that was rewritten in place
+FINGERPRINT_BYTES = 64
+UNTIMED = [np.iinfo(np.int64).min, MISSING_TIME]
+# seconds a stream can fall behind the first one before its rows are written without it
+MAX_LAG_SECONDS = 600
+
+
+class FileTail:
+    # the complete lines appended to a file since the last read. the file is recognized by its device and
+    # inode, and by the bytes just before the offset, so a file that was replaced (rotated), cut short
+    # (truncated) or rewritten since the last read is noticed instead of being read from the middle
+    def __init__(self, file_path, offset=0):
+        self.file_path = file_path
+        self.offset = offset
+        self.identity = None
+        self.fingerprint = ''
+        # the last read stopped at TAIL_BYTES, there's more to read straight away
+        self.behind = False
+
+    def to_dict(self):
+        return {'file_path': self.file_path, 'offset': self.offset, 'identity': self.identity, 'fingerprint': self.fingerprint}
+
+    @classmethod
+    def from_dict(cls, saved):
+        tail = cls(saved['file_path'], saved['offset'])
+        tail.identity = saved['identity']
+        tail.fingerprint = saved['fingerprint']
+        return tail
+
+    def read(self, max_bytes=TAIL_BYTES):
+        # -> (the new lines, whether the file changed underneath). a file that isn't there (yet) has no new lines
+        self.behind = False
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return b'', False
+        identity = [stat.st_dev, stat.st_ino]
+        if self.identity is not None and (identity != self.identity or stat.st_size < self.offset):
+            return b'', True
+        start = max(0, self.offset - FINGERPRINT_BYTES)
+        with open(self.file_path, 'rb') as tail_file:
+            tail_file.seek(start)
+            before = tail_file.read(self.offset - start)
+            if self.identity is not None and before.hex() != self.fingerprint:
+                return b'', True
+            data = tail_file.read(min(max_bytes, stat.st_size - self.offset))
+        self.behind = len(data) == max_bytes
+        # a line that's still being written is read next time
+        data = data[:data.rfind(b'\n') + 1]
+        self.identity = identity
+        self.offset += len(data)
+        self.fingerprint = (before + data)[-FINGERPRINT_BYTES:].hex()
+        return data, False
+
+
+class FollowStream:
+    # the rows of one sensor stream that have been read but not merged yet. streams are logged in time order,
+    # so rows before the stream's latest second are final (that second can still get more rows), or before the
+    # start of the latest bin when it's resampled. final rows move from pending to ready, resampled on the way
+    def __init__(self, empty, resample_seconds=1, resample_reducer='first'):
+        self.pending = empty
+        self.ready = empty
+        self.latest = None
+        self.resample_seconds = int(resample_seconds)
+        self.resample_reducer = resample_reducer
+
+    @property
+    def final_before(self):
+        if self.latest is None:
+            return -math.inf
+        return self.latest // self.resample_seconds * self.resample_seconds
+
+    def add(self, series):
+        # -> the rows that have no time, which are never pending
+        untimed = np.isin(series.seconds, UNTIMED)
+        timed = series.select(~untimed) if untimed.any() else series
+        if len(timed):
+            self.pending = DiveSeries.merge([self.pending, timed.sorted_by_time()])
+            latest = int(timed.seconds.max())
+            self.latest = latest if self.latest is None else max(self.latest, latest)
+        return series.select(untimed)
+
+    def settle(self, flush=False):
+        # with flush, every pending row is taken as final, for when the stream has ended
+        end = len(self.pending) if flush else int(np.searchsorted(self.pending.seconds, self.final_before, side='left'))
+        if not end:
+            return
+        final = self.pending.select(slice(0, end))
+        self.pending = self.pending.select(slice(end, None))
+        if self.resample_seconds != 1 or self.resample_reducer != 'first':
+            final = resample_series(final, self.resample_seconds, self.resample_reducer)
+        self.ready = DiveSeries.concatenate([self.ready, final])
+
+    def take_before(self, before):
+        # the ready rows before `before`, which no longer wait on the other streams
+        end = int(np.searchsorted(self.ready.seconds, before, side='left')) if before != math.inf else len(self.ready)
+        taken = self.ready.select(slice(0, end))
+        self.ready = self.ready.select(slice(end, None))
+        return taken
+
+    def drop_before(self, before):
+        # ready rows nothing still to come can be matched with
+        self.take_before(before)
+
+    def save(self, file_prefix):
+        self.pending.save(f'{file_prefix}.pending.series')
+        self.ready.save(f'{file_prefix}.ready.series')
+        return self.latest
+
+    def load(self, file_prefix, latest):
+        self.pending = DiveSeries.load(f'{file_prefix}.pending.series', mmap=False)
+        self.ready = DiveSeries.load(f'{file_prefix}.ready.series', mmap=False)
+        self.latest = latest
+
+
+class DiveFollower(ABC):
+    # merges one dive while it's still being logged. each poll reads only what was appended to the input files
+    # since the last one and parses just those lines. the rows every stream has moved past are joined and
+    # appended to the dive's _ROVDATA.csv, so the work done depends on the new data, not on how long the dive
+    # has been going. the first stream is the one the others are joined onto. offsets and the rows still
+    # waiting are saved in <output_dir>/.ctd_process/follow after every poll, so following can be stopped and
+    # started again. an input file that is replaced or cut short starts the dive over from the beginning. a
+    # stream more than max_lag seconds behind the first one (or that hasn't started) isn't waited for, the rows
+    # it's behind on are written without its values, as a batch run does for a file that's missing
+    stream_names = []
+    output_header = []
+
+    def __init__(self, config, dive, log=print, max_lag=MAX_LAG_SECONDS):
+        self.config = config
+        self.dive = dive
+        self.log = log
+        self.max_lag = max_lag
+        self.cruise_number = config['cruise_number']
+        state_dir = os.path.join(config['output_dir'], STATE_DIR_NAME)
+        self.state_dir = state_dir
+        self.follow_dir = os.path.join(state_dir, 'follow', f'{self.cruise_number}_{dive}')
+        self.manifest = RunManifest(os.path.join(state_dir, f'{self.cruise_number}_manifest.json'))
+        self.config_values = relevant_config(config)
+        self.tolerance = int(config['join_tolerance'])
+        self.resample = (1, 'first') if is_default(config) else (int(config['resample_seconds']), config['resample_reducer'])
+        self.clear()
+
+    def clear(self):
+        self.output_file = None
+        self.output_bytes = 0
+        self.row_count = 0
+        self.generation = 0
+        self.tails = {}
+        self.streams = {}
+        # bytes read by the last poll
+        self.bytes_read = 0
+
+    @property
+    def behind(self):
+        return any(tail.behind for tail in self.all_tails())
+
+    def all_tails(self):
+        return list(self.tails.values())
+
+    @abstractmethod
+    def begin(self):
+        # finds the dive's input files and sets up tails and streams -> False while they aren't all there yet
+        pass
+
+    @abstractmethod
+    def read_new(self):
+        # -> ({stream name: DiveSeries of the new rows}, whether an input file changed underneath)
+        pass
+
+    @abstractmethod
+    def output_columns(self, left, rights):
+        # -> (values, formatter) of the joined rows for append_rovdata_csv
+        pass
+
+    def state(self):
+        # what a subclass needs to carry on after a restart, besides the tails and streams
+        return {}
+
+    def restore(self, saved):
+        pass
+
+    def poll(self, flush=False):
+        # -> rows appended to the output. with flush the streams are taken to have ended
+        self.bytes_read = 0
+        if self.output_file is None and not self.start():
+            return 0
+        new, changed = self.read_new()
+        if changed:
+            self.log(f'{self.dive}: an input file was replaced or truncated, merging the dive again from the start')
+            self.restart()
+            return 0
+        left_name, *right_names = self.stream_names
+        untimed = None
+        for name, series in new.items():
+            rows_without_time = self.streams[name].add(series)
+            if name == left_name:
+                untimed = rows_without_time
+        for stream in self.streams.values():
+            stream.settle(flush)
+
+        left = self.streams[left_name]
+        rights = [self.streams[name] for name in right_names]
+        before = math.inf if flush else min(self.waits_until(right, left) for right in rights) - self.tolerance
+        rows = left.take_before(before)
+        if untimed is not None and len(untimed):
+            # rows without a time match nothing, they're written as soon as they're read
+            rows = DiveSeries.concatenate([rows, untimed])
+        written = 0
+        if len(rows):
+            columns = self.output_columns(rows, [right.ready for right in rights])
+            self.output_bytes = append_rovdata_csv(self.output_file, self.output_header, columns)
+            written = len(columns[0][0])
+            self.row_count += written
+        # right rows further back than any left row still to come can match
+        next_left = left.ready.seconds[0] if len(left.ready) else left.final_before
+        for right in rights:
+            right.drop_before(next_left - self.tolerance)
+        if self.bytes_read or len(rows):
+            self.save()
+        return written
+
+    def waits_until(self, right, left):
+        # left rows from this second on wait for more of the right stream
+        if not self.max_lag:
+            return right.final_before
+        return max(right.final_before, left.final_before - self.max_lag)
+
+    def start(self):
+        if not self.begin():
+            return False
+        # the output is rebuilt from the start, so a normal run has to merge the dive again once it's over
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+        self.manifest.forget(self.dive)
+        self.manifest.save()
+        self.output_bytes = append_rovdata_csv(self.output_file, self.output_header, [])
+        self.log(f'{self.dive}: following, writing to {self.output_file}')
+        self.save()
+        return True
+
+    def restart(self):
+        shutil.rmtree(self.follow_dir, ignore_errors=True)
+        if self.output_file is not None and os.path.exists(self.output_file):
+            os.remove(self.output_file)
+        self.clear()
+
+    def state_file(self):
+        return os.path.join(self.follow_dir, 'state.json')
+
+    def save(self):
+        # the streams are saved under a new generation first and only used once state.json points at them, so
+        # a follower that's killed part way carries on from the last complete poll
+        os.makedirs(self.follow_dir, exist_ok=True)
+        self.generation += 1
+        latest = {
+            name: stream.save(os.path.join(self.follow_dir, f'{name}.{self.generation}'))
+            for name, stream in self.streams.items()
+        }
+        tmp_file = f'{self.state_file()}.tmp'
+        with open(tmp_file, 'w') as state_file:
+            json.dump({
+                'version': FOLLOW_VERSION,
+                'dive': self.dive,
+                'config': self.config_values,
+                'output_file': self.output_file,
+                'output_bytes': self.output_bytes,
+                'row_count': self.row_count,
+                'generation': self.generation,
+                'tails': {name: tail.to_dict() for name, tail in self.tails.items()},
+                'latest': latest,
+                **self.state(),
+            }, state_file)
+        os.replace(tmp_file, self.state_file())
+        for name in os.listdir(self.follow_dir):
+            if name.endswith(('.series', '.npy')) and name.split('.')[1] != str(self.generation):
+                os.remove(os.path.join(self.follow_dir, name))
+
+    def resume(self):
+        # carries on where the last follower of this dive stopped -> False if there's nothing to carry on from
+        try:
+            with open(self.state_file(), 'r') as state_file:
+                saved = json.load(state_file)
+        except (OSError, ValueError):
+            return False
+        output_file = saved.get('output_file')
+        if (saved.get('version') != FOLLOW_VERSION or saved.get('dive') != self.dive or saved.get('config') != self.config_values
+                or output_file is None or not os.path.exists(output_file) or os.path.getsize(output_file) < saved['output_bytes']):
+            self.restart()
+            return False
+        try:
+            if not self.begin():
+                raise ValueError(f'The input files of {self.dive} are gone')
+            self.generation = saved['generation']
+            for name, stream in self.streams.items():
+                stream.load(os.path.join(self.follow_dir, f'{name}.{self.generation}'), saved['latest'][name])
+            self.restore(saved)
+        except (OSError, ValueError, KeyError):
+            self.restart()
+            return False
+        self.tails = {name: FileTail.from_dict(tail) for name, tail in saved['tails'].items()}
+        self.output_file = output_file
+        self.output_bytes = saved['output_bytes']
+        self.row_count = saved['row_count']
+        # rows appended after the last save are appended again
+        os.truncate(output_file, self.output_bytes)
+        self.log(f'{self.dive}: following again from row {self.row_count}')
+        return True
+
+    def read_tail(self, name):
+        data, changed = self.tails[name].read()
+        self.bytes_read += len(data)
+        return data, changed
+
+
+def header_complete(ctd_file, header):
+    # the .cnv is still being started while the header doesn't end in a complete *END* line
+    with open(ctd_file, 'rb') as cnv_file:
+        cnv_file.seek(max(0, header.data_offset - 256))
+        end = cnv_file.read(header.data_offset - cnv_file.tell())
+    return end.endswith(b'\n') and b'*END*' in end.rsplit(b'\n', 2)[-2]
+
+
+class ExFollower(DiveFollower):
+    # the .cnv is followed from the end of its header, the tracking csv from its start
+    stream_names = ['ctd', 'nav']
+    output_header = EX_OUTPUT_HEADER
+
+    def __init__(self, config, dive, log=print, max_lag=MAX_LAG_SECONDS):
+        self.merger = ExMerger(config)
+        self.first_per_second = config['resample_reducer'] == 'first'
+        super().__init__(config, dive, log, max_lag)
+
+    def clear(self):
+        super().clear()
+        self.header = None
+        self.column_count = None
+        # the ctd keys already read, sorted
+        self.seen_keys = np.empty(0)
+
+    def begin(self):
+        found = next((dive for dive in discover_dives(self.config) if dive[0] == self.dive), None)
+        if found is None or found[1] is None or found[2] is None:
+            return False
+        _, ctd_file, nav_file = found
+        header = CnvHeader(ctd_file)
+        if not header_complete(ctd_file, header):
+            return False
+        try:
+            dive_start_date = header.dive_start_date()
+        except ValueError:
+            return False
+        self.header = header
+        self.output_file = os.path.join(self.config['output_dir'], rovdata_file_name(self.cruise_number, self.dive, dive_start_date, self.config['csv_gzip']))
+        self.tails = {'ctd': FileTail(ctd_file, header.data_offset), 'nav': FileTail(nav_file)}
+        self.streams = {
+            'ctd': FollowStream(self.merger.ctd_series(np.empty((0, len(self.merger.ctd_columns()))), header), *self.resample),
+            'nav': FollowStream(self.merger.nav_series(''), *self.resample),
+        }
+        return True
+
+    def read_new(self):
+        new = {}
+        ctd_text, changed = self.read_tail('ctd')
+        nav_text, nav_changed = self.read_tail('nav')
+        if changed or nav_changed:
+            return new, True
+        if ctd_text.strip():
+            text = ctd_text.decode('latin-1')
+            if self.column_count is None:
+                self.column_count = len(text.lstrip().split('\n', 1)[0].split())
+            data = parse_numeric_block(text, self.column_count)
+            if self.first_per_second:
+                # one row for each key across the polls, like read_ctd_data
+                first_rows, self.seen_keys = first_rows_per_key(data[:, 0], self.seen_keys)
+                data = data[first_rows]
+            new['ctd'] = self.merger.ctd_series(data[:, self.merger.ctd_columns()], self.header)
+        if nav_text.strip():
+            new['nav'] = self.merger.nav_series(nav_text.decode('latin-1'))
+        return new, False
+
+    def output_columns(self, left, rights):
+        nav_data, = rights
+        return self.merger.output_formatters(self.merger.output_columns(left, nav_data, self.merger.join(left, nav_data)))
+
+    def seen_keys_file(self):
+        # saved with the streams' generation, a key for every second of the dive is too much for state.json
+        return os.path.join(self.follow_dir, f'seen_keys.{self.generation}.npy')
+
+    def state(self):
+        np.save(self.seen_keys_file(), self.seen_keys)
+        return {'header': self.header.to_dict(), 'column_count': self.column_count}
+
+    def restore(self, saved):
+        self.header = CnvHeader.from_dict(saved['header'])
+        self.column_count = saved['column_count']
+        self.seen_keys = np.load(self.seen_keys_file())
+
+
+class NaFollower(DiveFollower):
+    # the CTD.NAV and O2S.NAV files are followed from their start. DAT files are picked from the catalog as
+    # they appear, from the one that was being written when the dive started, and each is followed on its own
+    stream_names = ['ctd', 'o2s', 'dat']
+    output_header = NA_OUTPUT_HEADER
+
+    def __init__(self, config, dive, log=print, max_lag=MAX_LAG_SECONDS):
+        self.merger = NaMerger(config)
+        self.dat_path = os.path.join(config['base_dir'], 'raw', 'nav', 'navest')
+        super().__init__(config, dive, log, max_lag)
+
+    def clear(self):
+        super().clear()
+        self.dive_start = None
+        self.dat_catalog = None
+        # DAT file -> FileTail, and the last second decoded from it
+        self.dat_tails = {}
+        self.dat_seconds = {}
+
+    def all_tails(self):
+        return list(self.tails.values()) + list(self.dat_tails.values())
+
+    def begin(self):
+        dive_reports_source = os.path.join(self.config['base_dir'], 'processed', 'dive_reports')
+        found = next((dive for dive in discover_na_dives(dive_reports_source) if dive[0] == self.dive), None)
+        if found is None or found[1] is None or found[2] is None:
+            return False
+        _, ctd_nav_tsv, o2s_nav_tsv = found
+        try:
+            with open(ctd_nav_tsv, 'r') as tsv_file:
+                first_line = tsv_file.readline()
+            if not first_line.endswith('\n'):
+                return False
+            self.dive_start = int(np.datetime64(first_line.split('\t', 1)[0], 's').astype(np.int64))
+            dive_start_date = NaMerger.dive_start_date(ctd_nav_tsv)
+        except ValueError:
+            return False
+        self.output_file = os.path.join(self.config['output_dir'], rovdata_file_name(self.cruise_number, self.dive, dive_start_date, self.config['csv_gzip']))
+        self.tails = {'ctd': FileTail(ctd_nav_tsv), 'o2s': FileTail(o2s_nav_tsv)}
+        no_cells = split_delimited('', '\t')
+        self.streams = {
+            'ctd': FollowStream(NaMerger.ctd_nav_series(no_cells), *self.resample),
+            'o2s': FollowStream(NaMerger.o2s_nav_series(no_cells), *self.resample),
+            'dat': FollowStream(DiveSeries.empty([ALT_COLUMN]), *self.resample),
+        }
+        return True
+
+    def read_new(self):
+        new = {}
+        ctd_text, changed = self.read_tail('ctd')
+        o2s_text, o2s_changed = self.read_tail('o2s')
+        if changed or o2s_changed:
+            return new, True
+        if ctd_text:
+            new['ctd'] = NaMerger.ctd_nav_series(split_delimited(ctd_text.decode('latin-1'), '\t'))
+        if o2s_text:
+            new['o2s'] = NaMerger.o2s_nav_series(split_delimited(o2s_text.decode('latin-1'), '\t'))
+
+        # the catalog is only scanned again when the navest folder changed
+        if self.dat_catalog is None or not self.dat_catalog.is_current(self.dat_catalog.dir_mtimes):
+            try:
+                self.dat_catalog = DatCatalog(self.dat_path, os.path.join(self.state_dir, f'{self.cruise_number}_dat_catalog.json'))
+            except OSError:
+                # no navest folder yet
+                return new, False
+        fragments = []
+        for dat_file in self.dat_catalog.files_for_dive(self.dive_start, np.iinfo(np.int64).max):
+            tail = self.dat_tails.setdefault(dat_file, FileTail(dat_file))
+            data, changed = tail.read()
+            if changed:
+                return new, True
+            self.bytes_read += len(data)
+            if not data:
+                continue
+            # the first record in each second, like extract_altitude, leaving out seconds an earlier poll had
+            records = decode_records(np.frombuffer(data, dtype=np.uint8))
+            records = records.select(records.seconds > self.dat_seconds.get(dat_file, np.iinfo(np.int64).min))
+            if len(records):
+                self.dat_seconds[dat_file] = int(records.seconds.max())
+                fragments.append(records.sorted_by_time())
+        if fragments:
+            new['dat'] = DiveSeries.merge(fragments)
+        return new, False
+
+    def output_columns(self, left, rights):
+        o2s_data, dat_data = rights
+        columns = self.merger.output_columns(left, o2s_data, dat_data, self.merger.join(left, o2s_data, dat_data))
+        # NA.R's quoting of missing altitudes depends on the whole column, which isn't known until the dive is over
+        return self.merger.output_formatters(columns, quote_alt=False)
+
+    def state(self):
+        return {
+            'dive_start': self.dive_start,
+            'dat_tails': {dat_file: tail.to_dict() for dat_file, tail in self.dat_tails.items()},
+            'dat_seconds': self.dat_seconds,
+        }
+
+    def restore(self, saved):
+        self.dive_start = saved['dive_start']
+        self.dat_tails = {dat_file: FileTail.from_dict(tail) for dat_file, tail in saved['dat_tails'].items()}
+        self.dat_seconds = saved['dat_seconds']
+
+
+def follow_dive(config, dive, interval=5.0, idle_minutes=30.0, log=print, stop_event=None, max_lag=MAX_LAG_SECONDS):
+    # polls every `interval` seconds until stop_event is set (or ^C). once no input has grown for idle_minutes,
+    # the dive is taken to be over: the rows still waiting are written and following stops
+    preset = cruise_preset(config['cruise_number'])
+    if preset not in ('EX', 'NA'):
+        raise ValueError('Cruise number should start with "NA" or "EX"')
+    follower = (ExFollower if preset == 'EX' else NaFollower)(config, dive, log, max_lag)
+    follower.resume()
+    stop_event = stop_event or threading.Event()
+    last_growth = time.time()
+    try:
+        while not stop_event.is_set():
+            rows = follower.poll()
+            if rows:
+                log(f'{dive}: +{rows} rows, {follower.row_count} in all')
+            if follower.bytes_read:
+                last_growth = time.time()
+            elif idle_minutes and time.time() - last_growth > idle_minutes * 60:
+                rows = follower.poll(flush=True)
+                log(f'{dive}: no new data for {idle_minutes:g} minutes, wrote the last {rows} rows')
+                break
+            if not follower.behind:
+                stop_event.wait(interval)
+    except KeyboardInterrupt:
+        log(f'{dive}: stopped, following it again carries on from row {follower.row_count}')
+    return 0 if follower.output_file is not None else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge a dive while it is being logged, appending to its _ROVDATA.csv as the files grow')
+    parser.add_argument('config_file_path', help='config file saved by the GUI')
+    parser.add_argument('dive', help='dive to follow, e.g. DIVE01 or H1915')
+    parser.add_argument('--interval', type=float, default=5.0, help='seconds between looking for new data')
+    parser.add_argument('--idle-minutes', type=float, default=30.0, help='stop once no file has grown for this long (0 = never)')
+    parser.add_argument('--max-lag', type=float, default=MAX_LAG_SECONDS,
+                        help='seconds a sensor stream can fall behind before rows are written without it (0 = wait for it)')
+    args = parser.parse_args()
+    cli_config = read_config(args.config_file_path)
+    cli_config['config_file_path'] = args.config_file_path
+    sys.exit(follow_dive(cli_config, args.dive, args.interval, args.idle_minutes, max_lag=args.max_lag))
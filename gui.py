@@ -1,10 +1,17 @@
-import math
+import os
+import queue
 import tkinter as tk
-import subprocess
 
 from tkinter import filedialog, ttk
 
-from config_file_handler import ConfigFileHandler
+from config_file_handler import ConfigFileHandler, cruise_preset, read_config
+from cruise_scheduler import CruiseRun
+from resample import REDUCERS
+from stage_events import format_stage_totals
+from worker_pool import WorkerPool
+
+# how often the Tk loop looks at a run's events when the cruise thread can't wake it
+EVENT_CHECK_MS = 100
 
 
 class PlaceholderEntry(ttk.Entry):
@@ -46,6 +53,16 @@ class Gui(tk.Tk):
 
         self.config_handler = ConfigFileHandler()
         self.config = self.config_handler.config
+        # merge workers started by the first run and kept until the window is closed
+        self.worker_pool = None
+        self.worker_pool_settings = None
+        self.process = None
+        # dive -> row of dive_list, for dives that are still running
+        self.dive_rows = {}
+        # event_generate is only safe from another thread when Tcl was built with threads
+        self.tcl_threaded = bool(self.tk.call('info', 'exists', 'tcl_platform(threaded)')) and \
+            str(self.tk.call('set', 'tcl_platform(threaded)')) not in ('', '0')
+        self.protocol('WM_DELETE_WINDOW', self.close)
 
         self.cruise_number = tk.StringVar(value=self.config['cruise_number'])
         self.base_dir = tk.StringVar(value=self.config['base_dir'])
@@ -59,6 +76,14 @@ class Gui(tk.Tk):
         self.timestamp_col = tk.StringVar(value=self.config['ctd_cols']['timestamp'])
         self.temperature_col = tk.StringVar(value=self.config['ctd_cols']['temperature'])
         self.ctd_seconds_from = self.config['ctd_seconds_from']
+        self.merge_engine = self.config['merge_engine']
+        self.max_workers = tk.StringVar(value=self.config['max_workers'])
+        self.join_tolerance = tk.StringVar(value=self.config['join_tolerance'])
+        self.join_direction = self.config['join_direction']
+        self.resample_seconds = tk.StringVar(value=self.config['resample_seconds'])
+        self.resample_reducer = self.config['resample_reducer']
+        self.output_format = self.config['output_format']
+        self.profile = self.config['profile']
         self.depth_col = tk.StringVar(value=self.config['ctd_cols']['depth'])
         self.salinity_col = tk.StringVar(value=self.config['ctd_cols']['salinity'])
         self.oxygen_col = tk.StringVar(value=self.config['ctd_cols']['oxygen'])
@@ -74,9 +99,13 @@ class Gui(tk.Tk):
 
         self.button_text = tk.StringVar(value='GO')
         self.processing_text = tk.StringVar(value='')
+        self.progress_text = tk.StringVar(value='')
+        self.stage_text = tk.StringVar(value='')
+        self.log_text = tk.StringVar(value='')
+        self.dive_list = tk.Listbox(master=self.process_bg, width=44, height=6, font=('Courier', '11'))
+        self.progress_bar = ttk.Progressbar(master=self.process_bg, length=300, mode='determinate')
+        self.shown_dive_count = 0
         self.config_save_status = tk.StringVar(value='')
-        self.canvas = tk.Canvas(master=self.process_bg, width=50, height=50, bg='#e5e5e5', highlightthickness=0)
-        self.processing = False
 
         self.columns_frame = ttk.Frame(master=self.settings_bg)
         self.ctd_columns_frame = tk.Frame(
@@ -101,59 +130,147 @@ class Gui(tk.Tk):
 
     def go_button_callback(self, go_button):
         cruise_number = self.cruise_number.get()
-        base_dir = self.base_dir.get()
-        output_dir = self.output_dir.get()
-        process = None
         self.save_button_callback()
-        if cruise_number.startswith('EX'):
-            process = subprocess.Popen([
-                'EX/ex_ctd_processor.sh',
-                f'{self.config_handler.config_file_path}/CTDProcess/ctd_process_config.json',
-            ])
-        elif cruise_number.startswith('NA'):
-            process = subprocess.Popen([
-                'NA/na_ctd_processor.sh',
-                cruise_number,
-                base_dir,
-                f'{base_dir}/processed/dive_reports',
-                output_dir,
-            ])
-        else:
+        if cruise_preset(cruise_number) is None:
             self.processing_text.set('Could not determine preset \nCruise number should start with "NA" or "EX"')
             return
+        config_file_path = f'{self.config_handler.config_file_path}/CTDProcess/ctd_process_config.json'
+        notify = self.wake if self.tcl_threaded else None
+        process = CruiseRun(config_file_path, notify=notify, pool=self.session_worker_pool(config_file_path))
+        self.process = process
+        if self.tcl_threaded:
+            # the cruise thread wakes the Tk loop when something happens, nothing is polled
+            self.bind('<<CruiseEvent>>', lambda event: self.drain_events(process, go_button))
+        else:
+            self.after(EVENT_CHECK_MS, self.check_events, process, go_button)
         self.button_text.set('CANCEL')
         go_button.config(command=lambda: self.stop_button_callback(process, go_button))
-        self.processing_text.set('Processing - See terminal for details')
-        self.processing = True
-        self.update_spinner(0)
-        self.check_process(process, go_button)
+        self.processing_text.set('Processing...')
+        self.progress_text.set('')
+        self.stage_text.set('')
+        self.log_text.set('')
+        self.dive_list.delete(0, tk.END)
+        self.dive_rows = {}
+        self.progress_bar.config(value=0, maximum=1)
+        self.shown_dive_count = 0
+        process.start()
 
     def stop_button_callback(self, process, go_button):
+        # the dives already running finish and the run cleans up its temp files and manifest, GO only comes back
+        # once it's done so the next run can't start on top of that
         process.terminate()
-        self.processing = False
+        go_button.config(state='disabled')
+        self.processing_text.set('Cancelling...')
+
+    def session_worker_pool(self, config_file_path):
+        # the same workers are used for every run, unless the settings they were started with have changed.
+        # dives still running in the old pool (after a cancel) finish before its workers stop
+        config = read_config(config_file_path)
+        settings = (config['max_workers'], config['worker_max_jobs'], config['worker_max_memory_mb'])
+        if self.worker_pool is None or settings != self.worker_pool_settings:
+            if self.worker_pool is not None:
+                self.worker_pool.shutdown(wait=False)
+            self.worker_pool = WorkerPool.for_config(config)
+            self.worker_pool_settings = settings
+        return self.worker_pool
+
+    def skip_dive_callback(self):
+        # stops the selected dive, the rest of the cruise carries on
+        selection = self.dive_list.curselection()
+        if self.process is None or not selection:
+            return
+        dive = next((dive for dive, row in self.dive_rows.items() if row == selection[0]), None)
+        if dive is not None and self.process.abort_dive(dive):
+            self.log_text.set(f'Skipping {dive}...')
+
+    def close(self):
+        if self.process is not None:
+            self.process.terminate()
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
+
+    def wake(self):
+        # called from the cruise thread, only with a threaded Tcl, which hands the event to the Tk loop
+        try:
+            self.event_generate('<<CruiseEvent>>', when='tail')
+        except (RuntimeError, tk.TclError):
+            # the window is being closed
+            pass
+
+    def check_events(self, process, go_button):
+        # the Tk loop takes the run's events off its queue itself, until the run is done
+        if not self.drain_events(process, go_button):
+            self.after(EVENT_CHECK_MS, self.check_events, process, go_button)
+
+    def drain_events(self, process, go_button):
+        # -> whether the run is done
+        done = False
+        while True:
+            try:
+                kind, payload = process.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'line' and payload.strip():
+                self.log_text.set(payload.strip())
+            elif kind == 'start':
+                self.progress_bar.config(maximum=payload)
+            elif kind == 'running':
+                self.dive_list.insert(tk.END, f'{payload:<8}running...')
+                self.dive_rows[payload] = self.dive_list.size() - 1
+                self.dive_list.see(tk.END)
+            elif kind == 'dive':
+                self.show_dive(payload, process.dive_count)
+            elif kind == 'done':
+                self.finish_process(payload, go_button)
+                done = True
+        stage_text = format_stage_totals(process.stage_totals())
+        if process.trace_file:
+            stage_text += f'\nTrace saved to {os.path.basename(process.trace_file)}'
+        self.stage_text.set(stage_text)
+        return done
+
+    def show_dive(self, result, dive_count):
+        if result.skipped:
+            line = f'{result.dive:<8}up to date'
+        elif result.ok:
+            # the R merge engine doesn't report row counts
+            rows = f'{result.row_count:>9,} rows' if result.row_count else f'{"merged":>14}'
+            line = f'{result.dive:<8}{rows} {result.seconds:>7.1f} s'
+        else:
+            line = f'{result.dive:<8}SKIPPED - {result.message}'
+        # a running dive's line is replaced, the rest are added at the end
+        row = self.dive_rows.pop(result.dive, None)
+        if row is None:
+            self.dive_list.insert(tk.END, line)
+            row = self.dive_list.size() - 1
+            self.dive_list.see(tk.END)
+        else:
+            self.dive_list.delete(row)
+            self.dive_list.insert(row, line)
+        if not result.ok:
+            self.dive_list.itemconfig(row, foreground='red')
+        self.shown_dive_count += 1
+        self.progress_bar.config(value=self.shown_dive_count)
+        self.progress_text.set(f'{self.shown_dive_count} of {dive_count} dives done')
+
+    def finish_process(self, exit_val, go_button):
         self.button_text.set('GO')
-        go_button.config(command=lambda: self.go_button_callback(go_button))
-        self.processing_text.set('Cancelled')
-
-    def check_process(self, process, go_button):
-        if process.poll() is None:
-            self.after(1000, self.check_process, process, go_button)
+        go_button.config(state='normal', command=lambda: self.go_button_callback(go_button))
+        if self.processing_text.get() == 'Cancelling...':
+            self.processing_text.set('Cancelled')
+        elif exit_val != 0:
+            self.processing_text.set('Error - See terminal for details')
         else:
-            exit_val = process.returncode
-            self.processing = False
-            self.button_text.set('GO')
-            go_button.config(command=lambda: self.go_button_callback(go_button))
-            if exit_val != 0:
-                self.processing_text.set('Cancelled' if self.processing_text.get() == 'Cancelled' else 'Error - See terminal for details')
-                return
-            self.processing_text.set('Cancelled' if self.processing_text.get() == 'Cancelled' else 'Complete!')
+            self.processing_text.set('Complete!')
 
     def get_file_path(self, path):
         file_path = filedialog.askdirectory(initialdir='/Volumes/maxarray2/varsadditional', title='Select a folder')
         path.set(file_path)
 
     def save_button_callback(self):
-        config = {
+        # settings that are only in the config file (worker, cache, and csv options) are kept as they were
+        config = dict(self.config, **{
             'cruise_number': self.cruise_number.get(),
             'base_dir': self.base_dir.get(),
             'output_dir': self.output_dir.get(),
@@ -174,22 +291,21 @@ class Gui(tk.Tk):
                 'altitude': self.altitude_col.get(),
                 'latitude': self.latitude_col.get(),
                 'longitude': self.longitude_col.get(),
-            }
-        }
+            },
+            'merge_engine': self.merge_engine,
+            'max_workers': self.max_workers.get(),
+            'join_tolerance': self.join_tolerance.get(),
+            'join_direction': self.join_direction,
+            'resample_seconds': self.resample_seconds.get(),
+            'resample_reducer': self.resample_reducer,
+            'output_format': self.output_format,
+            'profile': self.profile,
+        })
         if self.config_handler.save_config(config):
             self.config_save_status.set('Saved!')
         else:
             self.config_save_status.set('Error saving config')
 
-    def update_spinner(self, angle):
-        self.canvas.delete('spinner')
-        if not self.processing:
-            return
-        x = 25 + 10 * math.cos(angle)
-        y = 25 + 10 * math.sin(angle)
-        self.canvas.create_oval(x - 5, y - 5, x + 5, y + 5, fill='black', tags='spinner')
-        self.after(30, self.update_spinner, angle + 0.1)
-
     def initialize_process_widgets(self):
         background = self.process_bg
 
@@ -256,6 +372,13 @@ class Gui(tk.Tk):
             command=lambda: self.go_button_callback(go_button),
         )
 
+        # stops the dive selected in the list
+        skip_dive_button = ttk.Button(
+            master=background,
+            text='SKIP DIVE',
+            command=self.skip_dive_callback,
+        )
+
         # packin
         cruise_frame.pack(pady=(5, 10), fill=tk.X)
         cruise_label.pack(side=tk.TOP, anchor='w')
@@ -271,21 +394,46 @@ class Gui(tk.Tk):
         output_directory_entry.pack(anchor='w')
         output_directory_browse_button.pack(anchor='w')
 
+        # dive progress and time per stage
+        progress_label = ttk.Label(
+            master=self.process_bg,
+            textvariable=self.progress_text,
+            font=('Helvetica', '12'),
+        )
+        log_label = ttk.Label(
+            master=self.process_bg,
+            textvariable=self.log_text,
+            font=('Helvetica', '10'),
+            wraplength=340,
+        )
+        stage_label = ttk.Label(
+            master=self.process_bg,
+            textvariable=self.stage_text,
+            font=('Helvetica', '10'),
+            wraplength=340,
+            justify=tk.CENTER,
+        )
+
         go_button.pack(pady=(20, 5))
         processing_status_label.pack(pady=(0, 10))
-        self.canvas.pack()
+        self.progress_bar.pack()
+        progress_label.pack()
+        self.dive_list.pack(padx=5, pady=5)
+        skip_dive_button.pack(pady=(0, 5))
+        stage_label.pack(pady=(0, 5))
+        log_label.pack(pady=(0, 10))
 
     def initialize_settings_widgets(self):
         background = self.settings_bg
 
         settings_label = ttk.Label(
             master=background,
-            text='EX SETTINGS',
+            text='SETTINGS',
             font=('Helvetica', '14', 'bold'),
         )
         settings_sub_label = ttk.Label(
             master=background,
-            text='These settings are only used for EX cruises',
+            text='Directories, file names, and columns are only used for EX cruises',
             font=('Helvetica', '10'),
         )
         # ctd directory input
@@ -338,6 +486,103 @@ class Gui(tk.Tk):
             textvariable=self.tracking_file_names,
         )
 
+        merge_engine_frame = ttk.Frame(master=background)
+        merge_engine_label = ttk.Label(
+            master=merge_engine_frame,
+            text='MERGE ENGINE',
+            font=('Helvetica', '12', 'bold'),
+        )
+        merge_engine_combobox = ttk.Combobox(
+            master=merge_engine_frame,
+            values=['Python', 'R'],
+            width=10,
+            state='readonly',
+        )
+        merge_engine_combobox.current(0 if self.merge_engine == 'python' else 1)
+        merge_engine_combobox.bind('<<ComboboxSelected>>', lambda event: self.set_merge_engine(merge_engine_combobox.get()))
+
+        output_format_frame = ttk.Frame(master=background)
+        output_format_label = ttk.Label(
+            master=output_format_frame,
+            text='OUTPUT FORMAT',
+            font=('Helvetica', '12', 'bold'),
+        )
+        output_format_combobox = ttk.Combobox(
+            master=output_format_frame,
+            values=['CSV', 'CSV + NPZ'],
+            width=10,
+            state='readonly',
+        )
+        output_format_combobox.current(0 if self.output_format == 'csv' else 1)
+        output_format_combobox.bind('<<ComboboxSelected>>', lambda event: self.set_output_format(output_format_combobox.get()))
+
+        max_workers_frame = ttk.Frame(master=background)
+        max_workers_label = ttk.Label(
+            master=max_workers_frame,
+            text='DIVES AT ONCE',
+            font=('Helvetica', '12', 'bold'),
+        )
+        max_workers_entry = ttk.Entry(
+            master=max_workers_frame,
+            width=6,
+            textvariable=self.max_workers,
+        )
+
+        join_frame = ttk.Frame(master=background)
+        join_label = ttk.Label(
+            master=join_frame,
+            text='JOIN TOLERANCE (S)',
+            font=('Helvetica', '12', 'bold'),
+        )
+        join_tolerance_entry = ttk.Entry(
+            master=join_frame,
+            width=4,
+            textvariable=self.join_tolerance,
+        )
+        join_direction_combobox = ttk.Combobox(
+            master=join_frame,
+            values=['Nearest', 'Backward', 'Forward'],
+            width=8,
+            state='readonly',
+        )
+        join_direction_combobox.current(['nearest', 'backward', 'forward'].index(self.join_direction))
+        join_direction_combobox.bind('<<ComboboxSelected>>', lambda event: self.set_join_direction(join_direction_combobox.get()))
+
+        resample_frame = ttk.Frame(master=background)
+        resample_label = ttk.Label(
+            master=resample_frame,
+            text='RESAMPLE (S)',
+            font=('Helvetica', '12', 'bold'),
+        )
+        resample_seconds_entry = ttk.Entry(
+            master=resample_frame,
+            width=4,
+            textvariable=self.resample_seconds,
+        )
+        resample_reducer_combobox = ttk.Combobox(
+            master=resample_frame,
+            values=['First', 'Mean', 'Median', 'Min', 'Max'],
+            width=8,
+            state='readonly',
+        )
+        resample_reducer_combobox.current(REDUCERS.index(self.resample_reducer))
+        resample_reducer_combobox.bind('<<ComboboxSelected>>', lambda event: self.set_resample_reducer(resample_reducer_combobox.get()))
+
+        profile_frame = ttk.Frame(master=background)
+        profile_label = ttk.Label(
+            master=profile_frame,
+            text='PROFILE DIVES',
+            font=('Helvetica', '12', 'bold'),
+        )
+        profile_combobox = ttk.Combobox(
+            master=profile_frame,
+            values=['Off', 'On'],
+            width=10,
+            state='readonly',
+        )
+        profile_combobox.current(1 if self.profile else 0)
+        profile_combobox.bind('<<ComboboxSelected>>', lambda event: self.set_profile(profile_combobox.get()))
+
         columns_header_frame = ttk.Frame(master=self.columns_frame)
         columns_label = ttk.Label(
             master=columns_header_frame,
@@ -516,6 +761,32 @@ class Gui(tk.Tk):
         dive_naming_label.pack(anchor='w')
         dive_naming_entry.pack(anchor='w')
 
+        merge_engine_frame.pack(fill=tk.X, pady=(0, 5))
+        merge_engine_label.pack(side=tk.LEFT, anchor='w')
+        merge_engine_combobox.pack(side=tk.RIGHT, anchor='w')
+
+        output_format_frame.pack(fill=tk.X, pady=(0, 5))
+        output_format_label.pack(side=tk.LEFT, anchor='w')
+        output_format_combobox.pack(side=tk.RIGHT, anchor='w')
+
+        max_workers_frame.pack(fill=tk.X, pady=(0, 5))
+        max_workers_label.pack(side=tk.LEFT, anchor='w')
+        max_workers_entry.pack(side=tk.RIGHT, anchor='w')
+
+        join_frame.pack(fill=tk.X, pady=(0, 5))
+        join_label.pack(side=tk.LEFT, anchor='w')
+        join_tolerance_entry.pack(side=tk.RIGHT, anchor='w')
+        join_direction_combobox.pack(side=tk.RIGHT, anchor='w')
+
+        resample_frame.pack(fill=tk.X, pady=(0, 5))
+        resample_label.pack(side=tk.LEFT, anchor='w')
+        resample_seconds_entry.pack(side=tk.RIGHT, anchor='w')
+        resample_reducer_combobox.pack(side=tk.RIGHT, anchor='w')
+
+        profile_frame.pack(fill=tk.X, pady=(0, 5))
+        profile_label.pack(side=tk.LEFT, anchor='w')
+        profile_combobox.pack(side=tk.RIGHT, anchor='w')
+
         self.columns_frame.pack(fill=tk.X)
         columns_header_frame.pack(fill=tk.X)
         columns_label.pack(side=tk.LEFT, anchor='w')
@@ -544,6 +815,21 @@ class Gui(tk.Tk):
         else:
             self.ctd_seconds_from = 'ELAPSED'
 
+    def set_merge_engine(self, engine):
+        self.merge_engine = 'python' if engine == 'Python' else 'r'
+
+    def set_output_format(self, output_format):
+        self.output_format = 'csv' if output_format == 'CSV' else 'csv+npz'
+
+    def set_join_direction(self, direction):
+        self.join_direction = direction.lower()
+
+    def set_resample_reducer(self, reducer):
+        self.resample_reducer = reducer.lower()
+
+    def set_profile(self, profile):
+        self.profile = profile == 'On'
+
     def set_column_widgets(self, _type):
         if _type == 'CTD':
             # set CTD columns
@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+
+from datetime import datetime, timezone
+
+QUEUE_VERSION = 1
+# pending -> running -> done or failed. cancelled cruises go back to pending, their finished dives are
+# remembered by the cruise's run manifest
+STATUSES = ['pending', 'running', 'done', 'failed']
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+class JobQueue:
+    # cruises waiting to be processed, saved after every change so a batch can be stopped (or killed) and
+    # picked up again later. safe to use from several threads
+    def __init__(self, queue_file):
+        self.queue_file = queue_file
+        self.jobs = []
+        self.lock = threading.Lock()
+        try:
+            with open(queue_file, 'r') as saved_file:
+                saved = json.load(saved_file)
+            if saved.get('version') == QUEUE_VERSION:
+                self.jobs = saved['jobs']
+        except (OSError, ValueError):
+            pass
+        # cruises that were running when the last batch died
+        for job in self.jobs:
+            if job['status'] == 'running':
+                job['status'] = 'pending'
+
+    @staticmethod
+    def job_id(config):
+        # the same cruise can be queued more than once with different output directories
+        return f'{config["cruise_number"]}:{os.path.abspath(config["output_dir"])}'
+
+    def add(self, config):
+        # a cruise that's already queued gets the new settings, and runs again if it had finished
+        with self.lock:
+            job_id = self.job_id(config)
+            job = next((job for job in self.jobs if job['id'] == job_id), None)
+            if job is None:
+                job = {'id': job_id, 'cruise_number': config['cruise_number'], 'attempts': 0, 'added': now()}
+                self.jobs.append(job)
+            if job.get('status') != 'running':
+                job.update({'config': config, 'status': 'pending', 'returncode': None, 'message': ''})
+            self.save()
+            return job
+
+    def next_pending(self):
+        with self.lock:
+            job = next((job for job in self.jobs if job['status'] == 'pending'), None)
+            if job is not None:
+                job['status'] = 'running'
+                job['attempts'] += 1
+                job['started'] = now()
+                self.save()
+            return job
+
+    def finish(self, job, returncode, cancelled=False, message=''):
+        with self.lock:
+            if cancelled:
+                job['status'] = 'pending'
+            else:
+                job['status'] = 'done' if returncode == 0 else 'failed'
+            job['returncode'] = returncode
+            job['message'] = message
+            job['finished'] = now()
+            self.save()
+
+    def retry_failed(self):
+        with self.lock:
+            for job in self.jobs:
+                if job['status'] == 'failed':
+                    job['status'] = 'pending'
+            self.save()
+
+    def remove_done(self):
+        with self.lock:
+            self.jobs = [job for job in self.jobs if job['status'] != 'done']
+            self.save()
+
+    def counts(self):
+        with self.lock:
+            return {status: sum(job['status'] == status for job in self.jobs) for status in STATUSES}
+
+    def save(self):
+        # called with the lock held
+        os.makedirs(os.path.dirname(os.path.abspath(self.queue_file)), exist_ok=True)
+        tmp_file = f'{self.queue_file}.tmp'
+        with open(tmp_file, 'w') as queue_output:
+            json.dump({'version': QUEUE_VERSION, 'jobs': self.jobs}, queue_output, indent=2)
+        os.replace(tmp_file, self.queue_file)
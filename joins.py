@@ -0,0 +1,109 @@
+import numpy as np
+
+
+def match_ranges(left_keys, right_keys):
+    # for every left key, where its matches start in right_order and how many there are
+    right_order = np.argsort(right_keys, kind='stable')
+    sorted_right = right_keys[right_order]
+    starts = np.searchsorted(sorted_right, left_keys, side='left')
+    counts = np.searchsorted(sorted_right, left_keys, side='right') - starts
+    return right_order, starts, counts
+
+
+def expand_matches(right_order, starts, counts):
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return right_order[np.repeat(starts, counts) + offsets]
+
+
+def inner_join(left_keys, right_keys):
+    # every matching (left, right) pair, in left order then right order, like dplyr::inner_join
+    right_order, starts, counts = match_ranges(left_keys, right_keys)
+    left_index = np.repeat(np.arange(len(left_keys)), counts)
+    return left_index, expand_matches(right_order, starts, counts)
+
+
+def left_join(left_keys, right_keys):
+    # like inner_join, but left rows without a match are kept once with a right index of -1
+    right_order, starts, counts = match_ranges(left_keys, right_keys)
+    unmatched = counts == 0
+    counts_kept = np.where(unmatched, 1, counts)
+    left_index = np.repeat(np.arange(len(left_keys)), counts_kept)
+    right_index = np.full(len(left_index), -1, dtype=np.int64)
+    matched_rows = np.repeat(~unmatched, counts_kept)
+    right_index[matched_rows] = expand_matches(right_order, starts[~unmatched], counts[~unmatched])
+    return left_index, right_index
+
+
+def take(values, index, fill=np.nan):
+    # values[index], with fill where index is -1
+    taken = values[np.maximum(index, 0)] if len(values) else np.full(len(index), fill)
+    return np.where(index < 0, fill, taken)
+
+
+def is_sorted(keys):
+    return bool(np.all(keys[1:] >= keys[:-1]))
+
+
+def neighbours(left_keys, right_keys):
+    # for every left key, the last right key at or before it and the first one at or after it (-1 and
+    # len(right_keys) when there is none). right_keys is sorted. when left_keys is too (the usual case) the
+    # two are merged in one linear pass: a stable argsort of two sorted runs is a single timsort merge, and a
+    # left key's place in the merge less its own rank is how many right keys come before it. which stream goes
+    # first decides where equal keys land. otherwise every left key is a binary search, O(n log m)
+    if not is_sorted(left_keys):
+        return np.searchsorted(right_keys, left_keys, side='right') - 1, np.searchsorted(right_keys, left_keys, side='left')
+    left_count = len(left_keys)
+    rank = np.arange(left_count)
+    merged = np.argsort(np.concatenate([right_keys, left_keys]), kind='stable')
+    before = np.flatnonzero(merged >= len(right_keys)) - rank - 1
+    merged = np.argsort(np.concatenate([left_keys, right_keys]), kind='stable')
+    after = np.flatnonzero(merged < left_count) - rank
+    return before, after
+
+
+def asof_join(left_keys, right_keys, tolerance, direction='nearest'):
+    # for every left key, the closest right key within tolerance (-1 if there is none). keys are int64 times
+    # in any unit; right_keys has to be sorted (join_streams sorts it when it isn't). "backward" only looks at
+    # earlier or equal right keys, "forward" at later or equal ones
+    if direction not in ('nearest', 'backward', 'forward'):
+        raise ValueError(f'Invalid join direction: {direction}')
+    right_count = len(right_keys)
+    right_index = np.full(len(left_keys), -1, dtype=np.int64)
+    if not right_count:
+        return right_index
+
+    before, after = neighbours(left_keys, right_keys)
+    has_before = before >= 0
+    has_after = after < right_count
+    before_distance = np.where(has_before, left_keys - right_keys[np.maximum(before, 0)], np.iinfo(np.int64).max)
+    after_distance = np.where(has_after, right_keys[np.minimum(after, right_count - 1)] - left_keys, np.iinfo(np.int64).max)
+
+    if direction == 'backward':
+        candidate, distance = before, before_distance
+    elif direction == 'forward':
+        candidate, distance = after, after_distance
+    else:
+        use_after = after_distance < before_distance
+        candidate = np.where(use_after, after, before)
+        distance = np.where(use_after, after_distance, before_distance)
+    within = distance <= tolerance
+    right_index[within] = candidate[within]
+    return right_index
+
+
+def join_streams(left_keys, right_keys, tolerance=0, direction='nearest', keep_unmatched=False):
+    # with no tolerance this is the exact join the R scripts do (every matching pair of rows). otherwise
+    # every left row gets its closest right row within the tolerance. neither stream has to be sorted, a file
+    # with a clock jump in it isn't, but a right stream that already is (the usual case) isn't sorted again
+    if not tolerance:
+        return left_join(left_keys, right_keys) if keep_unmatched else inner_join(left_keys, right_keys)
+    if is_sorted(right_keys):
+        right_index = asof_join(left_keys, right_keys, tolerance, direction)
+    else:
+        right_order = np.argsort(right_keys, kind='stable')
+        right_index = asof_join(left_keys, right_keys[right_order], tolerance, direction)
+        right_index = np.where(right_index < 0, -1, right_order[np.maximum(right_index, 0)])
+    if keep_unmatched:
+        return np.arange(len(left_keys)), right_index
+    matched = np.flatnonzero(right_index >= 0)
+    return matched, right_index[matched]
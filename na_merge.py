@@ -0,0 +1,184 @@
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from dat_extractor import ALT_COLUMN, extract_altitude
+from dive_series import DiveSeries
+from joins import join_streams, take
+from oxygen import compensate_oxygen
+from resample import resample_dive
+from rov_store import rov_store_dir, store_dive
+from rovdata_csv import column_formatter, rovdata_file_name, write_rovdata_csv
+from rovdata_npz import MISSING_SECONDS, npz_file_path, write_rovdata_npz
+from sensor_files import float_column, iso_seconds_column, split_delimited
+from stage_events import StageRecorder, file_sizes
+
+OUTPUT_HEADER = ['Latitude', 'Longitude', 'Depth', 'Temperature', 'oxygen_mg_per_l', 'oxygen_ml_per_l', 'Salinity', 'Date', 'Alt']
+# missing timestamps sort after everything else, like arrange() puts NA last
+MISSING_TIME = np.iinfo(np.int64).max
+
+
+def read_tsv(file_path):
+    with open(file_path, 'r', encoding='latin-1') as tsv_file:
+        return split_delimited(tsv_file.read(), '\t')
+
+
+def sorted_by_time(seconds, columns):
+    seconds = np.where(seconds == np.iinfo(np.int64).min, MISSING_TIME, seconds)
+    return DiveSeries(seconds, columns).sorted_by_time()
+
+
+def alt_formatter(alt, decimals=None):
+    # NA.R replaces missing altitudes with "", which turns the whole column into (quoted) text. that depends on
+    # the whole column, so it's decided before the column is written a block at a time
+    format_values = column_formatter('Alt', decimals)
+    if not np.isnan(alt).any():
+        return format_values
+
+    def format_quoted(values):
+        return np.array([
+            '""' if is_missing else f'"{text}"'
+            for text, is_missing in zip(format_values(values), np.isnan(values))
+        ], dtype=object)
+    return format_quoted
+
+
+class NaMerger:
+    def __init__(self, config):
+        self.config = config
+        self.cruise_number = config['cruise_number']
+        self.store_dir = rov_store_dir(config)
+
+    @classmethod
+    def read_ctd_nav_data(cls, ctd_nav_tsv):
+        return cls.ctd_nav_series(read_tsv(ctd_nav_tsv))
+
+    @staticmethod
+    def ctd_nav_series(cells):
+        # Timestamp, Latitude, Longitude, Depth, Temperature, X1, X2, Salinity, X3
+        return sorted_by_time(iso_seconds_column(cells, 1), {
+            'Latitude': float_column(cells, 2),
+            'Longitude': float_column(cells, 3),
+            'Depth': float_column(cells, 4),
+            'Temperature': float_column(cells, 5),
+            'Salinity': float_column(cells, 8),
+        })
+
+    @classmethod
+    def read_o2s_nav_data(cls, o2s_nav_tsv):
+        return cls.o2s_nav_series(read_tsv(o2s_nav_tsv))
+
+    @staticmethod
+    def o2s_nav_series(cells):
+        # Timestamp, X1, X2, X3, Oxygen, X4, X5
+        return sorted_by_time(iso_seconds_column(cells, 1), {
+            'Oxygen': float_column(cells, 5),
+        })
+
+    @staticmethod
+    def read_dat_fragment(dat_file, dat_cache=None):
+        # one DAT file's records, sorted by time so the fragments can be merged
+        records = dat_cache.altitude(dat_file) if dat_cache is not None else extract_altitude(dat_file)
+        return records.sorted_by_time()
+
+    def load_dive(self, ctd_nav_tsv, o2s_nav_tsv, dat_files, recorder, dat_cache=None):
+        # the NAV files and every DAT file are read at the same time, io_threads at once, since they're mostly
+        # waiting on the server. the DAT fragments are merged in file order, the same as sorting the records of
+        # every file one after another
+        started = time.time()
+        decoded = dat_cache.bytes_decoded if dat_cache is not None else 0
+        with ThreadPoolExecutor(max_workers=max(1, int(self.config['io_threads']))) as executor:
+            ctd_future = executor.submit(self.read_ctd_nav_data, ctd_nav_tsv)
+            o2s_future = executor.submit(self.read_o2s_nav_data, o2s_nav_tsv)
+            dat_futures = [executor.submit(self.read_dat_fragment, dat_file, dat_cache) for dat_file in dat_files]
+            ctd_data = ctd_future.result()
+            o2s_data = o2s_future.result()
+            dive_start_date = self.dive_start_date(ctd_nav_tsv)
+            recorder.add('parse', started, time.time(), file_sizes([ctd_nav_tsv, o2s_nav_tsv]), len(ctd_data) + len(o2s_data))
+            records = DiveSeries.merge([future.result() for future in dat_futures], [ALT_COLUMN])
+        dat_data = sorted_by_time(records.seconds, records.columns)
+        # with a cache, files that came from it weren't read
+        dat_bytes = dat_cache.bytes_decoded - decoded if dat_cache is not None else file_sizes(dat_files)
+        recorder.add('dat decode', started, time.time(), dat_bytes, len(dat_data))
+        return dive_start_date, ctd_data, o2s_data, dat_data
+
+    @staticmethod
+    def dive_start_date(ctd_nav_tsv):
+        with open(ctd_nav_tsv, 'r') as tsv_file:
+            first_timestamp = tsv_file.readline().split('\t', 1)[0]
+        return datetime.strptime(first_timestamp, '%Y-%m-%dT%H:%M:%S').strftime('%Y%m%d')
+
+    def join(self, ctd_data, o2s_data, dat_data):
+        # left_join(ctd_data, o2s_data) %>% left_join(dat_data)
+        tolerance = int(self.config['join_tolerance'])
+        direction = self.config['join_direction']
+        ctd_index, o2s_index = join_streams(ctd_data.seconds, o2s_data.seconds, tolerance, direction, keep_unmatched=True)
+        merged_index, dat_index = join_streams(ctd_data.seconds[ctd_index], dat_data.seconds, tolerance, direction, keep_unmatched=True)
+        return ctd_index[merged_index], o2s_index[merged_index], dat_index
+
+    @staticmethod
+    def output_columns(ctd_data, o2s_data, dat_data, indexes):
+        # the joined rows, by OUTPUT_HEADER column
+        ctd_index, o2s_index, dat_index = indexes
+        depth = ctd_data['Depth'][ctd_index]
+        temperature = ctd_data['Temperature'][ctd_index]
+        salinity = ctd_data['Salinity'][ctd_index]
+        # the oxygen column is only needed here, so the µmol/L result can be written over it
+        oxygen = take(o2s_data['Oxygen'], o2s_index)
+        _, oxygen_mg_per_l, oxygen_ml_per_l = compensate_oxygen(oxygen, salinity, temperature, depth, out=(oxygen, np.empty_like(oxygen), np.empty_like(oxygen)))
+        timestamps = ctd_data.seconds[ctd_index]
+        timestamps = np.where(timestamps == MISSING_TIME, MISSING_SECONDS, timestamps)
+        alt = take(dat_data['Alt'], dat_index)
+
+        return dict(zip(OUTPUT_HEADER, [
+            ctd_data['Latitude'][ctd_index],
+            ctd_data['Longitude'][ctd_index],
+            depth,
+            temperature,
+            oxygen_mg_per_l,
+            oxygen_ml_per_l,
+            salinity,
+            timestamps,
+            alt,
+        ]))
+
+    def output_formatters(self, columns, quote_alt=True):
+        # (values, formatter) for write_rovdata_csv. with quote_alt, missing altitudes are written the way NA.R
+        # writes them, which depends on the whole column
+        decimals = self.config['csv_decimals']
+        formatters = [column_formatter(name, decimals.get(name)) for name in OUTPUT_HEADER]
+        if quote_alt:
+            formatters[-1] = alt_formatter(columns['Alt'], decimals.get('Alt'))
+        return list(zip(columns.values(), formatters))
+
+    def write_dive(self, dive, dive_start_date, ctd_data, o2s_data, dat_data, indexes):
+        columns = self.output_columns(ctd_data, o2s_data, dat_data, indexes)
+        file_name = rovdata_file_name(self.cruise_number, dive, dive_start_date, self.config['csv_gzip'])
+        output_file_path = os.path.join(self.config['output_dir'], file_name)
+        row_count = write_rovdata_csv(output_file_path, OUTPUT_HEADER, self.output_formatters(columns))
+        if self.config['output_format'] == 'csv+npz':
+            write_rovdata_npz(npz_file_path(output_file_path), {
+                'cruise_number': self.cruise_number,
+                'dive': dive,
+                'dive_start_date': dive_start_date,
+            }, columns)
+        if self.store_dir is not None:
+            store_dive(self.store_dir, self.cruise_number, dive, columns)
+        return output_file_path, row_count
+
+    def merge_dive(self, dive, ctd_nav_tsv, o2s_nav_tsv, dat_files, recorder=None, dat_cache=None):
+        # dat_cache is a DatCache shared with the cruise's other dives, otherwise every DAT file is decoded
+        recorder = recorder or StageRecorder(dive)
+        dive_start_date, ctd_data, o2s_data, dat_data = self.load_dive(ctd_nav_tsv, o2s_nav_tsv, dat_files, recorder, dat_cache)
+        ctd_data, o2s_data, dat_data = resample_dive(self.config, recorder, [ctd_data, o2s_data, dat_data])
+        with recorder.stage('join') as event:
+            indexes = self.join(ctd_data, o2s_data, dat_data)
+            event.rows = len(indexes[0])
+        with recorder.stage('write') as event:
+            output_file_path, row_count = self.write_dive(dive, dive_start_date, ctd_data, o2s_data, dat_data, indexes)
+            event.rows = row_count
+        return output_file_path, row_count
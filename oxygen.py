@@ -0,0 +1,65 @@
+import numpy as np
+
+# pressure compensation coefficients (NA.R calculate_oxygen_microMolar)
+B0 = -0.00624097
+B1 = -0.00693498
+B2 = -0.00690358
+B3 = -0.00429155
+C0 = -0.00000031168
+# rows per block, small enough that the scratch arrays stay in cache
+BLOCK_SIZE = 16384
+
+
+def compensate_oxygen(o2, sal, temp, depth, out=None, block_size=BLOCK_SIZE):
+    # oxygen in µmol/L, mg/L, and mL/L, computed together block by block. every operation is done in the same
+    # order as the R formulas so the results match NA.R. `out` can be three preallocated arrays (any of them
+    # may be one of the inputs) to avoid allocating full length columns
+    o2, sal, temp, depth = (np.asarray(values, dtype=np.float64) for values in (o2, sal, temp, depth))
+    length = len(o2)
+    if out is None:
+        out = (np.empty(length), np.empty(length), np.empty(length))
+    micro_molar, mg_per_l, ml_per_l = out
+    if not length:
+        return micro_molar, mg_per_l, ml_per_l
+
+    scratch = np.empty((3, min(block_size, length)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for start in range(0, length, block_size):
+            stop = min(start + block_size, length)
+            t_s, acc, tmp = scratch[:, :stop - start]
+            block_temp, block_sal = temp[start:stop], sal[start:stop]
+
+            # t_s <- log((298.15 - temp) / (273.15 + temp))
+            np.subtract(298.15, block_temp, out=t_s)
+            np.add(273.15, block_temp, out=tmp)
+            np.divide(t_s, tmp, out=t_s)
+            np.log(t_s, out=t_s)
+
+            # b0 + b1 * t_s + b2 * t_s^2 + b3 * t_s^3
+            np.multiply(B1, t_s, out=acc)
+            np.add(B0, acc, out=acc)
+            np.multiply(t_s, t_s, out=tmp)
+            np.multiply(B2, tmp, out=tmp)
+            np.add(acc, tmp, out=acc)
+            np.power(t_s, 3.0, out=tmp)
+            np.multiply(B3, tmp, out=tmp)
+            np.add(acc, tmp, out=acc)
+
+            # sal_comp_fact <- exp(sal * (...) + c0 * sal^2)
+            np.multiply(block_sal, acc, out=acc)
+            np.multiply(block_sal, block_sal, out=tmp)
+            np.multiply(C0, tmp, out=tmp)
+            np.add(acc, tmp, out=acc)
+            np.exp(acc, out=acc)
+
+            # mMo2 <- (o2 * sal_comp_fact) * (1 + (0.032 * depth) / 1000)
+            np.multiply(o2[start:stop], acc, out=acc)
+            np.multiply(0.032, depth[start:stop], out=tmp)
+            np.divide(tmp, 1000, out=tmp)
+            np.add(1, tmp, out=tmp)
+            np.multiply(acc, tmp, out=micro_molar[start:stop])
+
+            np.multiply(micro_molar[start:stop], 32, out=tmp)
+            np.divide(tmp, 1000, out=mg_per_l[start:stop])
+            np.divide(micro_molar[start:stop], 44.659, out=ml_per_l[start:stop])
+    return micro_molar, mg_per_l, ml_per_l
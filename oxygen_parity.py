@@ -0,0 +1,130 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from oxygen import B0, B1, B2, B3, C0, compensate_oxygen
+from rovdata_csv import format_r_number
+
+NA_R = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'NA', 'NA.R')
+# largest relative difference allowed between the kernel and the R formulas. a few ulp, since R on x86_64
+# computes t_s^3 with powl and numpy's log/exp can differ from libm's in the last bit
+RELATIVE_TOLERANCE = 1e-12
+
+
+def reference_oxygen(o2, sal, temp, depth):
+    # calculate_oxygen_microMolar, calculate_oxygen_mgperliter, and calculate_oxygen_mlperliter from NA.R as
+    # written, whole columns at a time. numpy follows the same IEEE rules as R for Inf, NaN, and log(0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t_s = np.log((298.15 - temp) / (273.15 + temp))
+        sal_comp_fact = np.exp(sal * (B0 + B1 * t_s + B2 * t_s ** 2 + B3 * t_s ** 3) + C0 * sal ** 2)
+        o2c = (o2 * sal_comp_fact)
+        micro_molar = o2c * (1 + (0.032 * depth) / 1000)
+    return micro_molar, (micro_molar * 32) / 1000, micro_molar / 44.659
+
+
+def r_oxygen(o2, sal, temp, depth):
+    # the same columns computed by the functions in NA.R itself, when R is installed
+    with open(NA_R, 'r') as na_r:
+        lines = na_r.read().splitlines()
+    start = next(i for i, line in enumerate(lines) if line.startswith('calculate_oxygen_microMolar <- function'))
+    stop = next(i for i, line in enumerate(lines) if line.startswith('format_time <- function'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, 'input.csv')
+        output_file = os.path.join(tmp_dir, 'output.csv')
+        script_file = os.path.join(tmp_dir, 'oxygen.R')
+        np.savetxt(input_file, np.column_stack([o2, sal, temp, depth]), delimiter=',', fmt='%.17g', header='o2,sal,temp,depth', comments='')
+        with open(script_file, 'w') as script:
+            script.write('\n'.join(lines[start:stop]) + '\n')
+            script.write(
+                f'd <- read.csv("{input_file}")\n'
+                'm <- calculate_oxygen_microMolar(d$o2, d$sal, d$temp, d$depth)\n'
+                f'write.csv(data.frame(m, calculate_oxygen_mgperliter(m), calculate_oxygen_mlperliter(m)), "{output_file}", row.names = FALSE)\n'
+            )
+        subprocess.run(['Rscript', script_file], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        columns = np.genfromtxt(output_file, delimiter=',', skip_header=1, missing_values='NA', filling_values=np.nan).reshape(-1, 3)
+    return columns[:, 0], columns[:, 1], columns[:, 2]
+
+
+def parity_inputs(random_rows, seed):
+    rng = np.random.default_rng(seed)
+    # a grid over the ranges the sensors report, plus values where the formulas break down
+    o2, sal, temp, depth = (grid.ravel() for grid in np.meshgrid(
+        [0.0, 1.5, 45.0, 210.0, 380.0],
+        [0.0, 0.05, 33.0, 34.7, 40.0],
+        [-2.0, 0.0, 1.7, 12.5, 30.0],
+        [-1.0, 0.0, 800.0, 4000.0, 6500.0],
+    ))
+    edge_cases = np.array([
+        [np.nan, 34.0, 2.0, 1000.0],
+        [200.0, np.nan, 2.0, 1000.0],
+        [200.0, 34.0, np.nan, 1000.0],
+        [200.0, 34.0, 2.0, np.nan],
+        [200.0, 34.0, -273.15, 1000.0],
+        [200.0, 34.0, 298.15, 1000.0],
+        [200.0, 34.0, 400.0, 1000.0],
+        [200.0, 34.0, np.inf, 1000.0],
+        [-5.0, -1.0, -5.0, -50.0],
+    ])
+    o2 = np.concatenate([o2, edge_cases[:, 0], rng.uniform(0, 400, random_rows)])
+    sal = np.concatenate([sal, edge_cases[:, 1], rng.uniform(30, 38, random_rows)])
+    temp = np.concatenate([temp, edge_cases[:, 2], rng.uniform(-2, 30, random_rows)])
+    depth = np.concatenate([depth, edge_cases[:, 3], rng.uniform(0, 6500, random_rows)])
+    return o2, sal, temp, depth
+
+
+def compare(name, values, expected):
+    # problems found, the largest relative difference, and how many values would be written differently
+    problems = []
+    missing = np.isnan(values)
+    if not np.array_equal(missing, np.isnan(expected)):
+        problems.append(f'{name}: missing values in {np.count_nonzero(missing != np.isnan(expected))} rows differ')
+    both = ~missing & ~np.isnan(expected)
+    scale = np.maximum(np.abs(expected[both]), np.finfo(np.float64).tiny)
+    relative = np.abs(values[both] - expected[both]) / scale
+    worst = relative.max() if len(relative) else 0.0
+    if worst > RELATIVE_TOLERANCE:
+        problems.append(f'{name}: relative difference {worst:.3g} is over {RELATIVE_TOLERANCE:g}')
+    text_differences = sum(format_r_number(a) != format_r_number(b) for a, b in zip(values.tolist(), expected.tolist()))
+    return problems, worst, text_differences
+
+
+def check_parity(random_rows=20000, seed=0, use_r=False):
+    o2, sal, temp, depth = parity_inputs(random_rows, seed)
+    problems = []
+    references = [('NA.R formulas', reference_oxygen(o2, sal, temp, depth))]
+    if shutil.which('Rscript'):
+        references.append(('R', r_oxygen(o2, sal, temp, depth)))
+    elif use_r:
+        problems.append('Rscript not found, only checked against the formulas')
+
+    results = [('kernel', compensate_oxygen(o2, sal, temp, depth))]
+    # block boundaries inside the data, and output written over the inputs
+    results.append(('kernel, 7 row blocks', compensate_oxygen(o2, sal, temp, depth, block_size=7)))
+    aliased = (o2.copy(), sal.copy(), temp.copy())
+    results.append(('kernel, in place', compensate_oxygen(aliased[0], sal.copy(), aliased[2], depth, out=aliased)))
+
+    print(f'{len(o2)} rows, relative tolerance {RELATIVE_TOLERANCE:g}')
+    for reference_name, expected in references:
+        for result_name, values in results:
+            for unit, value_column, expected_column in zip(['micro_molar', 'mg_per_l', 'ml_per_l'], values, expected):
+                unit_problems, worst, text_differences = compare(f'{result_name} vs {reference_name} {unit}', value_column, expected_column)
+                problems.extend(unit_problems)
+                print(f'{result_name} vs {reference_name} {unit}: max relative difference {worst:.3g}, {text_differences} csv values differ')
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the oxygen kernel against the formulas in NA.R')
+    parser.add_argument('--rows', type=int, default=20000, help='number of random rows on top of the fixed cases')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--r', dest='use_r', action='store_true', help='fail if Rscript is not installed')
+    args = parser.parse_args()
+    found_problems = check_parity(args.rows, args.seed, args.use_r)
+    for problem in found_problems:
+        print(problem)
+    sys.exit(1 if found_problems else 0)
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from run_manifest import file_hash
+from stage_events import StageEvent
+
+BLOCK_SIZE = 1 << 20
+
+
+def local_path(cache_dir, source):
+    # files keep their names (the R scripts look for them by name), in a folder for each source folder
+    folder = hashlib.sha1(os.path.dirname(os.path.abspath(source)).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, folder, os.path.basename(source))
+
+
+def index_path(cache_dir, dive):
+    return os.path.join(cache_dir, f'{dive}.json')
+
+
+def copy_verified(source, destination):
+    # copies source, hashing it as it's read, then checks the copy against that hash. -> the source's state,
+    # the same as run_manifest.file_state, so the worker doesn't have to hash the file on the server again
+    before = os.stat(source)
+    sha256 = hashlib.sha256()
+    tmp_file = f'{destination}.tmp'
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        with open(source, 'rb') as source_file, open(tmp_file, 'wb') as copy_file:
+            for block in iter(lambda: source_file.read(BLOCK_SIZE), b''):
+                sha256.update(block)
+                copy_file.write(block)
+        after = os.stat(source)
+        if (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+            raise ValueError(f'{source} changed while it was being copied')
+        digest = sha256.hexdigest()
+        if file_hash(tmp_file) != digest:
+            raise ValueError(f'The copy of {source} does not match the original')
+        # same mtime as the original, so caches keyed by mtime treat them alike
+        os.utime(tmp_file, ns=(after.st_atime_ns, after.st_mtime_ns))
+        os.replace(tmp_file, destination)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    return {'size': after.st_size, 'mtime_ns': after.st_mtime_ns, 'sha256': digest}
+
+
+class Prefetcher:
+    # copies the input files of the next dives to a local folder while the workers merge the dives before
+    # them, so reading from the server overlaps with merging. it stays at most max_dives dives ahead of the
+    # workers and keeps at most max_bytes in cache_dir. the files of a dive are removed once its output has
+    # been written, unless a dive that's still to come uses them too. each dive's copies are listed in
+    # <cache_dir>/<dive>.json, which the worker reads with prefetched_inputs. on_event is called with a
+    # 'prefetch' StageEvent for every dive copied, from the prefetch thread
+    def __init__(self, jobs, cache_dir, max_bytes, max_dives, on_event=None):
+        self.jobs = list(jobs)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_dives = max(1, max_dives)
+        self.on_event = on_event
+        self.condition = threading.Condition()
+        # dives a worker has picked up, dives that are done, and dives whose copies are ready
+        self.started = set()
+        self.finished = set()
+        self.prefetched = set()
+        # source -> (local path, state), and the dives still to come that use it
+        self.files = {}
+        self.users = {}
+        self.bytes_cached = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.thread.start()
+
+    def dive_started(self, dive):
+        with self.condition:
+            self.started.add(dive)
+            self.condition.notify_all()
+
+    def dive_finished(self, dive):
+        # the dive's output has been written, its copies are only kept for the dives that share them
+        with self.condition:
+            self.started.add(dive)
+            self.finished.add(dive)
+            self.release(dive)
+            self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread.is_alive():
+            self.thread.join()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def release(self, dive):
+        # called with the lock held
+        self.prefetched.discard(dive)
+        for source, users in list(self.users.items()):
+            users.discard(dive)
+            if not users:
+                self.evict(source)
+        try:
+            os.remove(index_path(self.cache_dir, dive))
+        except OSError:
+            pass
+
+    def evict(self, source):
+        # called with the lock held
+        path, state = self.files.pop(source)
+        self.users.pop(source, None)
+        self.bytes_cached -= state['size']
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def has_room(self, needed):
+        # called with the lock held
+        ahead = len(self.prefetched - self.started)
+        return ahead < self.max_dives and self.bytes_cached + needed <= self.max_bytes
+
+    def run(self):
+        for job in self.jobs:
+            try:
+                sizes = {source: os.path.getsize(source) for source in job.input_files}
+            except OSError:
+                # the worker reports the missing file
+                continue
+            with self.condition:
+                needed = sum(size for source, size in sizes.items() if source not in self.files)
+                if needed > self.max_bytes:
+                    # never fits, the worker reads this dive from the server
+                    continue
+                while not self.stopped and job.dive not in self.started and not self.has_room(needed):
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                if job.dive in self.started:
+                    continue
+                # reserved now, so finished dives can't evict files this dive shares with them
+                for source in sizes:
+                    if source in self.users:
+                        self.users[source].add(job.dive)
+                self.bytes_cached += needed
+            self.prefetch(job, sizes, needed)
+
+    def prefetch(self, job, sizes, reserved):
+        started = time.time()
+        index = {}
+        copied = 0
+        for source in sizes:
+            with self.condition:
+                if self.stopped:
+                    break
+                cached = self.files.get(source)
+            if cached is not None:
+                index[source] = {'path': cached[0], 'state': cached[1]}
+                continue
+            path = local_path(self.cache_dir, source)
+            try:
+                state = copy_verified(source, path)
+            except (OSError, ValueError):
+                # not worth failing over, the worker reads this file from the server
+                continue
+            with self.condition:
+                self.files[source] = (path, state)
+                self.users[source] = {job.dive}
+            index[source] = {'path': path, 'state': state}
+            copied += state['size']
+
+        with self.condition:
+            # the reservation is swapped for what was actually copied
+            self.bytes_cached += copied - reserved
+            if job.dive in self.finished:
+                # merged from the server while it was being copied
+                self.release(job.dive)
+            else:
+                tmp_file = f'{index_path(self.cache_dir, job.dive)}.tmp'
+                with open(tmp_file, 'w') as index_file:
+                    json.dump(index, index_file)
+                os.replace(tmp_file, index_path(self.cache_dir, job.dive))
+                self.prefetched.add(job.dive)
+            self.condition.notify_all()
+        if self.on_event is not None:
+            self.on_event(StageEvent(job.dive, 'prefetch', started, time.time(), bytes_read=copied))
+
+
+def prefetched_inputs(cache_dir, dive):
+    # {source: {'path': local copy, 'state': file state}} for the dive's inputs that were prefetched and
+    # haven't changed on the server since
+    try:
+        with open(index_path(cache_dir, dive), 'r') as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        return {}
+    inputs = {}
+    for source, entry in index.items():
+        try:
+            stat = os.stat(source)
+        except OSError:
+            continue
+        state = entry['state']
+        if (stat.st_size, stat.st_mtime_ns) == (state['size'], state['mtime_ns']) and os.path.isfile(entry['path']):
+            inputs[source] = entry
+    return inputs
+
+
+def localize(value, paths):
+    # job arguments with every prefetched input swapped for its local copy
+    if isinstance(value, str):
+        return paths.get(value, value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(localize(item, paths) for item in value)
+    return value
@@ -0,0 +1,187 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+# functions and allocation sites listed in the summaries
+PROFILE_TOP = 25
+# how often the memory in use is checked for a new peak
+PEAK_SAMPLE_SECONDS = 0.1
+# frames kept of each allocation, enough to get from numpy back to the line of ours that called it
+ALLOCATION_FRAMES = 8
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# allocations in these files are the profiler's own
+IGNORED_ALLOCATIONS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+# (profile_dir, name) of the block being profiled in this process, for the R session to profile into as well
+active_profile = None
+
+
+def profile_dir_name(cruise_number, started):
+    # next to the run's trace, which is named after the same start time
+    return f'{cruise_number}_profile_{started.strftime("%Y%m%dT%H%M%SZ")}'
+
+
+def r_profile_file():
+    # where the R script of the dive being profiled writes its Rprof samples, None when nothing is profiled
+    if active_profile is None:
+        return None
+    profile_dir, name = active_profile
+    return os.path.join(profile_dir, f'{name}.Rprof')
+
+
+def format_bytes(size):
+    if size < 1024 * 1024:
+        return f'{size / 1024:,.1f} kB'
+    return f'{size / (1024 * 1024):,.1f} MB'
+
+
+def format_stats(stats, sort, top):
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats(sort).print_stats(top)
+    # print_stats starts with the totals and a blank line, the function table is what's wanted
+    return out.getvalue().strip('\n')
+
+
+class Profile:
+    # what profiled() measured, filled in when the block ends
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.peak_bytes = 0
+        # [(file:line, bytes, blocks)] of the allocations held at the peak, largest first
+        self.allocations = []
+        self.profile_file = None
+        self.summary_file = None
+
+    def to_dict(self):
+        return {
+            'seconds': round(self.seconds, 6),
+            'peak_bytes': self.peak_bytes,
+            'allocations': [{'where': where, 'bytes': size, 'blocks': count} for where, size, count in self.allocations],
+            'profile_file': self.profile_file,
+            'summary_file': self.summary_file,
+        }
+
+
+def allocation_site(traceback):
+    # the innermost line of this repo the allocation came from, or where it was made if none of it is ours
+    frame = next((frame for frame in reversed(traceback) if frame.filename.startswith(REPO_DIR)), traceback[-1])
+    return f'{frame.filename}:{frame.lineno}'
+
+
+def allocation_sites(snapshot):
+    # [(file:line, bytes, blocks)] of a snapshot, largest first
+    sites = {}
+    for stat in snapshot.statistics('traceback'):
+        size, count = sites.get(allocation_site(stat.traceback), (0, 0))
+        sites[allocation_site(stat.traceback)] = (size + stat.size, count + stat.count)
+    return sorted(((site, size, count) for site, (size, count) in sites.items()), key=lambda site: -site[1])
+
+
+class PeakSampler(threading.Thread):
+    # keeps the tracemalloc snapshot of when the most memory was in use. by the end of a dive its arrays are
+    # gone, the peak is where they show up
+    def __init__(self, interval=PEAK_SAMPLE_SECONDS):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.traced = -1
+        self.snapshot = None
+
+    def sample(self):
+        traced, _ = tracemalloc.get_traced_memory()
+        if traced > self.traced:
+            self.traced = traced
+            self.snapshot = tracemalloc.take_snapshot()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+        return self.snapshot
+
+
+@contextmanager
+def profiled(profile_dir, name, top=PROFILE_TOP):
+    # runs the block under cProfile and tracemalloc. <name>.prof is the cProfile dump (pstats, snakeviz, ...),
+    # <name>_profile.txt lists the top functions by cumulative and by own time, the peak memory traced, and
+    # the lines that held the most of it. nothing is traced outside the block. only the calling thread is
+    # profiled, time spent in io_threads shows up as waiting on them
+    global active_profile
+    os.makedirs(profile_dir, exist_ok=True)
+    profile = Profile(name)
+    profiler = cProfile.Profile()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start(ALLOCATION_FRAMES)
+    tracemalloc.reset_peak()
+    sampler = PeakSampler()
+    sampler.start()
+    active_profile = (profile_dir, name)
+    started = time.time()
+    profiler.enable()
+    try:
+        yield profile
+    finally:
+        profiler.disable()
+        profile.seconds = time.time() - started
+        active_profile = None
+        _, profile.peak_bytes = tracemalloc.get_traced_memory()
+        snapshot = sampler.stop().filter_traces(IGNORED_ALLOCATIONS)
+        if not tracing:
+            tracemalloc.stop()
+        profile.allocations = allocation_sites(snapshot)[:top]
+        profile.profile_file = os.path.join(profile_dir, f'{name}.prof')
+        profiler.dump_stats(profile.profile_file)
+        profile.summary_file = os.path.join(profile_dir, f'{name}_profile.txt')
+        write_summary(profile.summary_file, f'{name}: {profile.seconds:.2f} s, peak traced memory {format_bytes(profile.peak_bytes)}',
+                      pstats.Stats(profiler), profile.allocations, top)
+
+
+def write_summary(summary_file, title, stats, allocations, top=PROFILE_TOP):
+    with open(summary_file, 'w') as summary:
+        summary.write(f'{title}\n\n')
+        summary.write(f'Top {top} functions by cumulative time\n{format_stats(stats, "cumulative", top)}\n\n')
+        summary.write(f'Top {top} functions by own time\n{format_stats(stats, "tottime", top)}\n\n')
+        summary.write(f'Top {top} lines by memory held at the peak (checked every {PEAK_SAMPLE_SECONDS} s)\n')
+        for where, size, count in allocations[:top]:
+            summary.write(f'{format_bytes(size):>12}  {count:>9,} blocks  {where}\n')
+
+
+def write_run_summary(profile_dir, title, profiles, top=PROFILE_TOP):
+    # every dive's profile added together: the hottest functions across the run, the dives by peak memory, and
+    # the allocation sites that held the most, summed over the dives -> the summary's path, None if nothing ran
+    profile_files = [profile.profile_file for profile in profiles if profile.profile_file and os.path.exists(profile.profile_file)]
+    if not profile_files:
+        return None
+    stats = pstats.Stats(*profile_files)
+    allocations = {}
+    for profile in profiles:
+        for where, size, count in profile.allocations:
+            total_size, total_count = allocations.get(where, (0, 0))
+            allocations[where] = (total_size + size, total_count + count)
+    summary_file = os.path.join(profile_dir, 'summary.txt')
+    write_summary(summary_file, title, stats, sorted(
+        ((where, size, count) for where, (size, count) in allocations.items()), key=lambda allocation: -allocation[1],
+    ), top)
+    with open(summary_file, 'a') as summary:
+        summary.write('\nPeak traced memory by dive\n')
+        for profile in sorted(profiles, key=lambda profile: -profile.peak_bytes):
+            summary.write(f'{format_bytes(profile.peak_bytes):>12}  {profile.seconds:>9.2f} s  {profile.name}\n')
+    return summary_file
@@ -0,0 +1,83 @@
+import numpy as np
+
+from dive_series import DiveSeries
+
+# resample_reducer: how the samples in each bin become one row. "first" is what the R scripts do at 1 s
+REDUCERS = ['first', 'mean', 'median', 'min', 'max']
+# times that stand for a missing timestamp, those rows are passed through as they are
+MISSING_TIMES = [np.iinfo(np.int64).min, np.iinfo(np.int64).max]
+
+
+def is_default(config):
+    # 1 s, first sample: what reading the files already gives, so there is nothing to do
+    return int(config['resample_seconds']) == 1 and config['resample_reducer'] == 'first'
+
+
+def bin_starts(bins):
+    # the first row of every run of equal bins in a sorted array
+    if not len(bins):
+        return np.empty(0, dtype=np.intp)
+    return np.concatenate(([0], np.flatnonzero(bins[1:] != bins[:-1]) + 1))
+
+
+def reduce_bins(values, starts, reducer):
+    # one value per bin, ignoring missing (nan) values. a bin with nothing but missing values stays missing
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    if reducer == 'first':
+        # the lowest row of each bin that isn't missing, past the end for a bin that's all missing
+        rows = np.minimum.reduceat(np.where(missing, len(values), np.arange(len(values))), starts)
+        return np.where(rows < len(values), values[np.minimum(rows, len(values) - 1)], np.nan)
+    counts = np.add.reduceat(~missing, starts)
+    if reducer == 'mean':
+        sums = np.add.reduceat(np.where(missing, 0.0, values), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan)
+    if reducer == 'min':
+        return np.fmin.reduceat(values, starts)
+    if reducer == 'max':
+        return np.fmax.reduceat(values, starts)
+    if reducer == 'median':
+        # sort each bin's values (missing ones last) and average the middle one or two
+        bin_ids = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(values))))
+        ordered = values[np.lexsort((values, bin_ids))]
+        last = np.maximum(counts - 1, 0)
+        middle = (ordered[starts + last // 2] + ordered[starts + (last + 1) // 2]) / 2
+        return np.where(counts > 0, middle, np.nan)
+    raise ValueError(f'Invalid resample reducer: {reducer}')
+
+
+def resample_series(series, seconds, reducer='first'):
+    # one row per bin of `seconds` seconds, at the start of the bin. bins are computed from the sorted int64
+    # times and every column is reduced in one vectorized pass over them
+    seconds = int(seconds)
+    if seconds < 1:
+        raise ValueError('The resample resolution has to be at least 1 second')
+    if reducer not in REDUCERS:
+        raise ValueError(f'Invalid resample reducer: {reducer}')
+    series = series.sorted_by_time()
+    # missing times sort to the very start or end, they're kept there as they are
+    first, last = np.searchsorted(series.seconds, [MISSING_TIMES[0] + 1, MISSING_TIMES[1]], side='left')
+    timed = series.select(slice(first, last))
+    if not len(timed):
+        return series
+
+    bins = timed.seconds // seconds * seconds
+    starts = bin_starts(bins)
+    resampled = DiveSeries(bins[starts], {
+        name: reduce_bins(values, starts, reducer).astype(values.dtype, copy=False)
+        for name, values in timed.columns.items()
+    })
+    if first == 0 and last == len(series):
+        return resampled
+    return DiveSeries.concatenate([series.select(slice(0, first)), resampled, series.select(slice(last, None))])
+
+
+def resample_dive(config, recorder, streams):
+    # the resample stage of a dive: each of its sensor streams at the configured resolution, before they're joined
+    if is_default(config):
+        return streams
+    with recorder.stage('resample') as event:
+        streams = [resample_series(series, config['resample_seconds'], config['resample_reducer']) for series in streams]
+        event.rows = sum(len(series) for series in streams)
+    return streams
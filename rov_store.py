@@ -0,0 +1,176 @@
+import argparse
+import os
+import sys
+
+from datetime import datetime, timezone
+from string import Template
+
+import numpy as np
+
+from config_file_handler import read_config
+from dive_series import DiveSeries
+from joins import asof_join
+from rovdata_csv import format_r_column, format_r_number, format_timestamps, write_csv_rows
+from rovdata_npz import MISSING_SECONDS, parse_timestamps
+
+# nearest() without a tolerance looks at every row of the cruise
+ANY_DISTANCE = np.iinfo(np.int64).max - 1
+
+
+def rov_store_dir(config):
+    # rov_store_dir with the same ${...} variables as the other folder settings, or None when rov_store is off
+    if not config['rov_store']:
+        return None
+    return Template(config['rov_store_dir']).safe_substitute(
+        base_dir=config['base_dir'],
+        output_dir=config['output_dir'],
+        cruise=config['cruise_number'],
+        cruise_number=config['cruise_number'],
+    )
+
+
+def dive_store_path(store_dir, cruise_number, dive):
+    return os.path.join(store_dir, cruise_number, f'{dive}.series')
+
+
+def store_dive(store_dir, cruise_number, dive, columns):
+    # loads a merged dive into the store: its output columns (Date as int64 epoch seconds, the rest float64, like
+    # write_rovdata_npz) sorted by time, in one .series file. rows without a Date can't be looked up by time
+    # and are left out. replaces what was stored for the dive before
+    seconds = np.asarray(columns['Date'], dtype=np.int64)
+    timed = seconds != MISSING_SECONDS
+    series = DiveSeries(seconds[timed], {
+        name: np.asarray(values, dtype=np.float64)[timed]
+        for name, values in columns.items() if name != 'Date'
+    }).sorted_by_time()
+    file_path = dive_store_path(store_dir, cruise_number, dive)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    return series.save(file_path)
+
+
+def epoch_seconds(when):
+    # epoch seconds, a datetime (naive ones are UTC), "2023-06-14T03:12:05" or "20230614T031205Z" -> int
+    if isinstance(when, datetime):
+        return int((when if when.tzinfo else when.replace(tzinfo=timezone.utc)).timestamp())
+    if isinstance(when, (int, np.integer)):
+        return int(when)
+    text = str(when).strip()
+    if len(text) == 16 and text[8] == 'T' and text.endswith('Z'):
+        seconds = int(parse_timestamps([text])[0])
+    else:
+        seconds = int(np.datetime64(text.removesuffix('Z'), 's').astype(np.int64))
+    if seconds == MISSING_SECONDS:
+        raise ValueError(f'Invalid time: {when}')
+    return seconds
+
+
+class RovStore:
+    # the read side of the store: a time-sorted DiveSeries of every dive loaded, in <store_dir>/<cruise>/<dive>.series.
+    # dives are memory-mapped the first time they're used, so a lookup only reads the pages it needs, and opened
+    # again when a later run replaced them. nothing runs in the background, any number of readers can share a store
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        # (cruise, dive) -> (mtime of the file, DiveSeries)
+        self.opened = {}
+
+    def cruises(self):
+        try:
+            return sorted(entry.name for entry in os.scandir(self.store_dir) if entry.is_dir())
+        except FileNotFoundError:
+            return []
+
+    def dives(self, cruise_number):
+        try:
+            names = os.listdir(os.path.join(self.store_dir, cruise_number))
+        except FileNotFoundError:
+            return []
+        return sorted(name.removesuffix('.series') for name in names if name.endswith('.series'))
+
+    def dive(self, cruise_number, dive):
+        file_path = dive_store_path(self.store_dir, cruise_number, dive)
+        mtime = os.stat(file_path).st_mtime_ns
+        opened = self.opened.get((cruise_number, dive))
+        if opened is None or opened[0] != mtime:
+            opened = (mtime, DiveSeries.load(file_path))
+            self.opened[(cruise_number, dive)] = opened
+        return opened[1]
+
+    def candidate_dives(self, cruise_number, dive=None):
+        return [dive] if dive is not None else self.dives(cruise_number)
+
+    def between(self, cruise_number, start, end, dive=None):
+        # {dive: DiveSeries of its rows with start <= time <= end}, for the dives that have any. the series are
+        # views of the stored arrays
+        start, end = epoch_seconds(start), epoch_seconds(end)
+        found = {}
+        for name in self.candidate_dives(cruise_number, dive):
+            rows = self.dive(cruise_number, name).between(start, end + 1)
+            if len(rows):
+                found[name] = rows
+        return found
+
+    def nearest(self, cruise_number, when, tolerance=None, direction='nearest', dive=None):
+        # the row closest to `when` (within tolerance seconds, earlier rows only with "backward", later ones
+        # with "forward"), as {'dive': ..., 'Date': epoch seconds, column: value}, or None if there's none.
+        # a time two dives share gives the row of the first dive
+        seconds = epoch_seconds(when)
+        tolerance = ANY_DISTANCE if tolerance is None else int(tolerance)
+        best = None
+        for name in self.candidate_dives(cruise_number, dive):
+            series = self.dive(cruise_number, name)
+            index = int(asof_join(np.array([seconds], dtype=np.int64), series.seconds, tolerance, direction)[0])
+            if index < 0:
+                continue
+            distance = abs(int(series.seconds[index]) - seconds)
+            if best is None or distance < best[0]:
+                best = (distance, name, series, index)
+        if best is None:
+            return None
+        _, name, series, index = best
+        row = {'dive': name, 'Date': int(series.seconds[index])}
+        row.update((column, float(values[index])) for column, values in series.columns.items())
+        return row
+
+
+def format_row(row):
+    cells = [row['dive'], format_timestamps([row['Date']])[0]]
+    cells += [format_r_number(value) for name, value in row.items() if name not in ('dive', 'Date')]
+    return ','.join(cells)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Look up merged ROV data by time in the store the runs load it into')
+    parser.add_argument('config_file_path', help='config file saved by the GUI')
+    parser.add_argument('time', help='e.g. 2023-06-14T03:12:05 (UTC) or epoch seconds')
+    parser.add_argument('--end', help='print every row from time to end instead of the nearest one')
+    parser.add_argument('--cruise', help='defaults to the cruise number in the config file')
+    parser.add_argument('--dive', help='only look in this dive')
+    parser.add_argument('--tolerance', type=int, help='most seconds the nearest row can be away')
+    parser.add_argument('--direction', default='nearest', choices=['nearest', 'backward', 'forward'])
+    args = parser.parse_args()
+    cli_config = read_config(args.config_file_path)
+    cli_store_dir = rov_store_dir(dict(cli_config, rov_store=True))
+    cli_cruise = args.cruise or cli_config['cruise_number']
+    store = RovStore(cli_store_dir)
+    time_arg = int(args.time) if args.time.isdigit() else args.time
+    if args.end is None:
+        found = store.nearest(cli_cruise, time_arg, args.tolerance, args.direction, args.dive)
+        if found is None:
+            print(f'No rows of {cli_cruise} near {args.time}')
+            sys.exit(1)
+        print(','.join(found))
+        print(format_row(found))
+        sys.exit(0)
+    end_arg = int(args.end) if args.end.isdigit() else args.end
+    found = store.between(cli_cruise, time_arg, end_arg, args.dive)
+    if not found:
+        print(f'No rows of {cli_cruise} between {args.time} and {args.end}')
+        sys.exit(1)
+    print(','.join(['dive', 'Date', *next(iter(found.values())).columns]))
+    for dive_name, rows in found.items():
+        write_csv_rows(sys.stdout, [
+            (np.full(len(rows), dive_name, dtype=object), lambda values: values),
+            (rows.seconds, format_timestamps),
+            *((values, format_r_column) for values in rows.columns.values()),
+        ])
+    sys.exit(0)
@@ -0,0 +1,152 @@
+import gzip
+import io
+import math
+import os
+
+import numpy as np
+
+# positions of the digits in "YYYY-MM-DDTHH:MM:SS" that make up "YYYYMMDDTHHMMSS"
+ISO_TIMESTAMP_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9, 10, 11, 12, 14, 15, 17, 18]
+# rows formatted and written at a time, so memory doesn't grow with the length of the dive
+BLOCK_ROWS = 1 << 16
+WRITE_BUFFER_BYTES = 1 << 20
+GZIP_LEVEL = 6
+
+
+def format_r_number(value):
+    # mirrors how R's write.csv prints a double: up to 15 significant digits, trailing zeros dropped,
+    # and fixed notation unless scientific notation is narrower (e.g. 1e-04, 1e+05)
+    if math.isnan(value):
+        return 'NA'
+    if math.isinf(value):
+        return 'Inf' if value > 0 else '-Inf'
+    if value == 0:
+        return '0'
+    mantissa, exponent = f'{value:.14e}'.split('e')
+    kpower = int(exponent)
+    sig_digits = len(mantissa.lstrip('-').replace('.', '').rstrip('0'))
+    neg = value < 0
+    right_digits = max(0, sig_digits - kpower - 1)
+    fixed_width = neg + max(kpower + 1, 1) + right_digits + (right_digits > 0)
+    # R's neg + (d > 0) + d + 4 + e, with d = sig_digits - 1 mantissa decimals and e = 1 exponent digit past
+    # the first (2 from e+100 on), so a tie (0.001, 10000) stays fixed
+    sci_width = neg + (sig_digits > 1) + sig_digits + 4 + (abs(kpower) >= 100)
+    if fixed_width <= sci_width:
+        return f'{value:.{right_digits}f}'
+    return f'{value:.{sig_digits - 1}e}'
+
+
+def format_r_column(values):
+    # sensor columns repeat a lot of values, so format each distinct value once
+    unique, inverse = np.unique(np.asarray(values, dtype=np.float64), return_inverse=True)
+    formatted = np.array([format_r_number(value) for value in unique.tolist()], dtype=object)
+    return formatted[inverse.reshape(-1)]
+
+
+def format_fixed_column(values, decimals):
+    # csv_decimals: the same number of decimal places for every value of the column, NA for missing values
+    values = np.asarray(values, dtype=np.float64)
+    formatted = np.char.mod(f'%.{int(decimals)}f', values).astype(object)
+    formatted[np.isnan(values)] = 'NA'
+    return formatted
+
+
+def column_formatter(name, decimals=None):
+    # the function that turns a block of a column's values into csv cells. numbers are written like R's
+    # write.csv does, unless the column has a fixed number of decimals
+    if name == 'Date':
+        return lambda values: quote_column(format_timestamps(values))
+    if decimals is None:
+        return format_r_column
+    return lambda values: format_fixed_column(values, decimals)
+
+
+def format_timestamps(seconds):
+    # int64 epoch seconds -> "%Y%m%dT%H%M%SZ" without going through datetime objects, NaT -> None
+    times = np.asarray(seconds, dtype=np.int64).astype('datetime64[s]')
+    missing = np.isnat(times)
+    iso = np.datetime_as_string(np.where(missing, np.datetime64(0, 's'), times), unit='s').astype('S19')
+    digits = iso.view(np.uint8).reshape(-1, 19)[:, ISO_TIMESTAMP_DIGITS]
+    stamped = np.empty((len(digits), 16), dtype=np.uint8)
+    stamped[:, :15] = digits
+    stamped[:, 15] = ord('Z')
+    formatted = stamped.view('S16').reshape(-1).astype('U16').astype(object)
+    formatted[missing] = None
+    return formatted
+
+
+def quote_column(values, na='NA'):
+    # character columns are quoted, missing values are written unquoted
+    return np.array([na if value is None else f'"{value}"' for value in values], dtype=object)
+
+
+def rovdata_file_name(cruise_number, dive, dive_start_date, compress=False):
+    # compress: csv_gzip, the file is written gzipped as _ROVDATA.csv.gz
+    return f'{cruise_number}_{dive}_{dive_start_date}_ROVDATA.csv' + ('.gz' if compress else '')
+
+
+def open_csv_output(file_path, compress=False, append=False):
+    # the gzip header has no timestamp, so the same rows always give the same bytes. appending to a .gz adds
+    # another gzip member, which gzip readers carry straight on into
+    if compress:
+        return io.TextIOWrapper(gzip.GzipFile(file_path, 'ab' if append else 'wb', compresslevel=GZIP_LEVEL, mtime=0), newline='')
+    return open(file_path, 'a' if append else 'w', newline='', buffering=WRITE_BUFFER_BYTES)
+
+
+def write_csv_rows(csv_file, columns, block_rows=BLOCK_ROWS):
+    row_count = len(columns[0][0]) if columns else 0
+    for start in range(0, row_count, block_rows):
+        cells = [formatter(values[start:start + block_rows]) for values, formatter in columns]
+        csv_file.write('\n'.join(','.join(row) for row in zip(*cells)) + '\n')
+    return row_count
+
+
+def csv_header_line(header):
+    return ','.join(f'"{name}"' for name in header) + '\n'
+
+
+def write_rovdata_csv(file_path, header, columns, block_rows=BLOCK_ROWS):
+    # columns are (values, formatter) pairs in the same order as the header, see column_formatter. the rows are
+    # formatted and written a block at a time to a tmp file, which only replaces file_path once it's complete,
+    # so a run that stops part way never leaves a half-written csv behind
+    tmp_file = f'{file_path}.tmp'
+    try:
+        with open_csv_output(tmp_file, file_path.endswith('.gz')) as csv_file:
+            csv_file.write(csv_header_line(header))
+            row_count = write_csv_rows(csv_file, columns, block_rows)
+        os.replace(tmp_file, file_path)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    return row_count
+
+
+def append_rovdata_csv(file_path, header, columns, block_rows=BLOCK_ROWS):
+    # adds rows to the end of file_path, starting it with the header if there's no file yet. -> the size of the
+    # file afterwards, so a reader that stopped part way can cut it back to the last complete append
+    if not os.path.exists(file_path):
+        with open_csv_output(file_path, file_path.endswith('.gz')) as csv_file:
+            csv_file.write(csv_header_line(header))
+    if columns and len(columns[0][0]):
+        with open_csv_output(file_path, file_path.endswith('.gz'), append=True) as csv_file:
+            write_csv_rows(csv_file, columns, block_rows)
+    return os.path.getsize(file_path)
+
+
+def gzip_rovdata_csv(csv_file_path):
+    # for dives merged by the R scripts, which only write a plain csv. -> the path of the .csv.gz
+    gz_file_path = f'{csv_file_path}.gz'
+    tmp_file = f'{gz_file_path}.tmp'
+    with open(csv_file_path, 'rb') as csv_file, gzip.GzipFile(tmp_file, 'wb', compresslevel=GZIP_LEVEL, mtime=0) as gz_file:
+        for block in iter(lambda: csv_file.read(WRITE_BUFFER_BYTES), b''):
+            gz_file.write(block)
+    os.replace(tmp_file, gz_file_path)
+    os.remove(csv_file_path)
+    return gz_file_path
+
+
+def open_rovdata_csv(file_path):
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rt', newline='')
+    return open(file_path, 'r', newline='')
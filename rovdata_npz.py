@@ -0,0 +1,75 @@
+import json
+import os
+
+import numpy as np
+
+from rovdata_csv import open_rovdata_csv
+from sensor_files import split_delimited
+
+NPZ_VERSION = 1
+# output_format: "csv" = _ROVDATA.csv only (for VARS), "csv+npz" = also a typed _ROVDATA.npz next to it
+OUTPUT_FORMATS = ['csv', 'csv+npz']
+# missing Date values, the same bits as NaT so .astype('datetime64[s]') gives NaT back
+MISSING_SECONDS = np.iinfo(np.int64).min
+
+
+def npz_file_path(csv_file_path):
+    # _ROVDATA.csv or _ROVDATA.csv.gz -> _ROVDATA.npz
+    return csv_file_path.removesuffix('.gz').removesuffix('.csv') + '.npz'
+
+
+def write_rovdata_npz(file_path, metadata, columns):
+    # columns in the same order as the csv header: Date as int64 epoch seconds, everything else float64
+    # with nan for NA. values are kept at full precision, the csv rounds them to 15 significant digits
+    arrays = {name: np.ascontiguousarray(values, dtype=np.int64 if name == 'Date' else np.float64) for name, values in columns.items()}
+    arrays['metadata'] = np.array(json.dumps(dict(metadata, version=NPZ_VERSION, columns=list(columns))))
+    tmp_file = f'{file_path}.tmp'
+    # written to a file object, np.savez would add .npz to the tmp name
+    with open(tmp_file, 'wb') as npz_file:
+        np.savez(npz_file, **arrays)
+    os.replace(tmp_file, file_path)
+    return file_path
+
+
+def read_rovdata_npz(file_path):
+    # -> (metadata dict, {column name: array}), without unpickling anything
+    with np.load(file_path, allow_pickle=False) as npz:
+        metadata = json.loads(npz['metadata'][()])
+        return metadata, {name: npz[name] for name in metadata['columns']}
+
+
+def parse_timestamps(values):
+    # "%Y%m%dT%H%M%SZ" -> int64 epoch seconds, the inverse of format_timestamps. anything else is missing
+    values = np.asarray(values, dtype='U16')
+    valid = (np.char.str_len(values) == 16) & (np.char.find(values, 'T') == 8)
+    digits = np.where(valid, values, '19700101T000000Z').astype('S16').view(np.uint8).reshape(-1, 16)
+    iso = np.full((len(digits), 19), ord('-'), dtype=np.uint8)
+    iso[:, [0, 1, 2, 3, 5, 6, 8, 9]] = digits[:, :8]
+    iso[:, 10] = ord('T')
+    iso[:, [11, 12, 14, 15, 17, 18]] = digits[:, 9:15]
+    iso[:, [13, 16]] = ord(':')
+    seconds = iso.view('S19').reshape(-1).astype('datetime64[s]').astype(np.int64)
+    return np.where(valid, seconds, MISSING_SECONDS)
+
+
+def read_rovdata_csv(csv_file_path):
+    # a _ROVDATA.csv (or .csv.gz) -> {column name: array}, typed the same way as write_rovdata_npz
+    with open_rovdata_csv(csv_file_path) as csv_file:
+        header = [name.strip('"') for name in csv_file.readline().rstrip('\n').split(',')]
+        cells = np.char.strip(split_delimited(csv_file.read(), ','), '"')
+    if not cells.size:
+        cells = np.empty((0, len(header)), dtype=str)
+    columns = {}
+    for column, name in enumerate(header):
+        values = cells[:, column]
+        if name == 'Date':
+            columns[name] = parse_timestamps(values)
+        else:
+            values[np.isin(values, ['', 'NA'])] = 'nan'
+            columns[name] = values.astype(np.float64)
+    return columns
+
+
+def rovdata_csv_to_npz(csv_file_path, metadata):
+    # for dives merged by the R scripts, which only write the csv
+    return write_rovdata_npz(npz_file_path(csv_file_path), metadata, read_rovdata_csv(csv_file_path))
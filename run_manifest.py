@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+
+from datetime import datetime, timezone
+
+MANIFEST_VERSION = 1
+# settings that change what ends up in a dive's output files
+RELEVANT_CONFIG_KEYS = [
+    'cruise_number', 'ctd_cols', 'ctd_seconds_from', 'tracking_cols', 'join_tolerance', 'join_direction', 'output_format',
+    'csv_decimals', 'csv_gzip', 'resample_seconds', 'resample_reducer', 'rov_store', 'rov_store_dir',
+]
+
+
+def file_hash(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def file_state(file_path, with_hash=True):
+    stat = os.stat(file_path)
+    state = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if with_hash:
+        state['sha256'] = file_hash(file_path)
+    return state
+
+
+def relevant_config(config):
+    # round-tripped through json so it compares equal to what was saved
+    return json.loads(json.dumps({key: config.get(key) for key in RELEVANT_CONFIG_KEYS}, sort_keys=True))
+
+
+class RunManifest:
+    # inputs, settings, and output of every dive that was merged successfully, saved after each dive so a
+    # cancelled run picks up where it stopped
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        self.dives = {}
+        try:
+            with open(manifest_file, 'r') as saved_file:
+                saved = json.load(saved_file)
+            if saved.get('version') == MANIFEST_VERSION:
+                self.dives = saved['dives']
+        except (OSError, ValueError):
+            pass
+
+    def is_current(self, dive, input_files, config_values):
+        entry = self.dives.get(dive)
+        if entry is None or entry['config'] != config_values:
+            return False
+        if sorted(entry['inputs']) != sorted(input_files):
+            return False
+        if entry.get('output_file') and not os.path.isfile(entry['output_file']):
+            return False
+        for file_path, saved_state in entry['inputs'].items():
+            try:
+                state = file_state(file_path, with_hash=False)
+            except OSError:
+                return False
+            if state['size'] != saved_state['size']:
+                return False
+            if state['mtime_ns'] != saved_state['mtime_ns']:
+                # touched, but only reprocess if the contents actually changed
+                if file_hash(file_path) != saved_state['sha256']:
+                    return False
+                saved_state['mtime_ns'] = state['mtime_ns']
+        return True
+
+    def record(self, dive, input_states, config_values, output_file):
+        self.dives[dive] = {
+            'inputs': input_states,
+            'config': config_values,
+            'output_file': output_file,
+            'completed': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }
+
+    def forget(self, dive):
+        self.dives.pop(dive, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.manifest_file), exist_ok=True)
+        tmp_file = f'{self.manifest_file}.tmp'
+        with open(tmp_file, 'w') as manifest:
+            json.dump({'version': MANIFEST_VERSION, 'dives': self.dives}, manifest, indent=2)
+        os.replace(tmp_file, self.manifest_file)
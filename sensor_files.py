@@ -0,0 +1,93 @@
+import numpy as np
+
+NA_STRINGS = ['', 'NA']
+# bytes of a data file parsed at a time by numeric_block_chunks
+CHUNK_BYTES = 4 << 20
+
+
+def parse_numeric_block(text, column_count):
+    # whitespace separated numbers, like read.table
+    cells = np.array(text.split())
+    if len(cells) % column_count:
+        raise ValueError(f'Expected {column_count} columns in every row')
+    return cells.astype(np.float64).reshape(-1, column_count)
+
+
+def numeric_block_chunks(data_file, chunk_bytes=CHUNK_BYTES):
+    # parse_numeric_block over the rest of an open binary file, a chunk of whole lines at a time, so only one
+    # chunk of text is in memory. every row has as many columns as the first one
+    column_count = None
+    remainder = b''
+    while True:
+        block = data_file.read(chunk_bytes)
+        text = remainder + block
+        remainder = b''
+        if block:
+            # the last line carries over to the next chunk unless it's complete
+            cut = text.rfind(b'\n') + 1
+            text, remainder = text[:cut], text[cut:]
+        if text.strip():
+            text = text.decode('latin-1')
+            if column_count is None:
+                column_count = len(text.lstrip().split('\n', 1)[0].split())
+            yield parse_numeric_block(text, column_count)
+        if not block:
+            return
+
+
+def split_delimited(text, delimiter):
+    # header-less csv/tsv text -> 2D array of cells, as many columns as the first row. like readr, short rows
+    # (e.g. a last row that was still being written) are padded with "" and extra cells are dropped
+    lines = text.replace('\r\n', '\n').rstrip('\n')
+    if not lines:
+        return np.empty((0, 0), dtype=str)
+    column_count = lines.split('\n', 1)[0].count(delimiter) + 1
+    cells = lines.replace('\n', delimiter).split(delimiter)
+    if len(cells) == (lines.count('\n') + 1) * column_count:
+        return np.array(cells).reshape(-1, column_count)
+    rows = [line.split(delimiter)[:column_count] for line in lines.split('\n')]
+    return np.array([row + [''] * (column_count - len(row)) for row in rows])
+
+
+def cell_column(cells, column):
+    # 1-based column of the cells, whitespace trimmed like readr does
+    if cells.shape[1] < column:
+        return np.full(len(cells), '')
+    return np.char.strip(cells[:, column - 1])
+
+
+def float_column(cells, column):
+    # only the cells that aren't missing are converted, the cell array can be too narrow to hold "nan"
+    values = cell_column(cells, column)
+    present = ~np.isin(values, NA_STRINGS)
+    result = np.full(len(values), np.nan)
+    result[present] = values[present].astype(np.float64)
+    return result
+
+
+def iso_seconds(value):
+    try:
+        return np.datetime64(value, 's')
+    except ValueError:
+        return np.datetime64('NaT')
+
+
+def iso_seconds_column(cells, column):
+    # "2019-08-30T06:45:17" -> int64 epoch seconds, missing or unparseable values (e.g. a line cut short) -> NaT
+    values = cell_column(cells, column)
+    present = ~np.isin(values, NA_STRINGS)
+    result = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[s]')
+    try:
+        result[present] = values[present].astype('datetime64[s]')
+    except ValueError:
+        # only a file with a bad cell pays for parsing one value at a time
+        result[present] = [iso_seconds(value) for value in values[present].tolist()]
+    return result.astype(np.int64)
+
+
+def parse_csv_columns(text, columns, delimiter=','):
+    # returns the requested 1-based columns as float arrays ("" and "NA" -> nan)
+    cells = split_delimited(text, delimiter)
+    if not cells.size:
+        return [np.empty(0, dtype=np.float64) for _ in columns]
+    return [float_column(cells, column) for column in columns]
@@ -0,0 +1,83 @@
+import json
+import os
+import time
+
+from contextlib import contextmanager
+
+# the order stages are shown in, a dive only goes through the ones its merge engine uses
+STAGES = ['discover', 'dat scan', 'cnv scan', 'prefetch', 'hash', 'copy', 'parse', 'dat decode', 'resample', 'join', 'write', 'merge']
+
+
+class StageEvent:
+    # one stage of one dive (dive is None for stages that cover the whole cruise). start and end are epoch
+    # seconds so events from different worker processes line up
+    def __init__(self, dive, stage, start, end=None, bytes_read=0, rows=0):
+        self.dive = dive
+        self.stage = stage
+        self.start = start
+        self.end = start if end is None else end
+        self.bytes_read = bytes_read
+        self.rows = rows
+
+    @property
+    def seconds(self):
+        return self.end - self.start
+
+    def to_dict(self):
+        return {
+            'dive': self.dive,
+            'stage': self.stage,
+            'start': self.start,
+            'end': self.end,
+            'seconds': round(self.seconds, 6),
+            'bytes_read': self.bytes_read,
+            'rows': self.rows,
+        }
+
+
+class StageRecorder:
+    def __init__(self, dive=None):
+        self.dive = dive
+        self.events = []
+
+    @contextmanager
+    def stage(self, name, bytes_read=0):
+        # the event is handed back so rows (and bytes, once known) can be filled in while the stage runs
+        event = StageEvent(self.dive, name, time.time(), bytes_read=bytes_read)
+        try:
+            yield event
+        finally:
+            event.end = time.time()
+            self.events.append(event)
+
+    def add(self, name, start, end, bytes_read=0, rows=0):
+        # for stages timed by the caller, e.g. reads that ran at the same time in threads
+        event = StageEvent(self.dive, name, start, end, bytes_read, rows)
+        self.events.append(event)
+        return event
+
+    def totals(self):
+        return stage_totals(self.events)
+
+
+def stage_totals(events):
+    # seconds spent in each stage, in STAGES order
+    totals = {}
+    for event in events:
+        totals[event.stage] = totals.get(event.stage, 0.0) + event.seconds
+    return dict(sorted(totals.items(), key=lambda item: STAGES.index(item[0]) if item[0] in STAGES else len(STAGES)))
+
+
+def format_stage_totals(totals):
+    return ', '.join(f'{stage} {seconds:.1f} s' for stage, seconds in totals.items())
+
+
+def file_sizes(file_paths):
+    return sum(os.path.getsize(file_path) for file_path in file_paths)
+
+
+def write_trace(trace_file, trace):
+    tmp_file = f'{trace_file}.tmp'
+    with open(tmp_file, 'w') as trace_output:
+        json.dump(trace, trace_output, indent=2)
+    os.replace(tmp_file, trace_file)
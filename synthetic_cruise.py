@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+
+from datetime import datetime, timezone
+
+import numpy as np
+
+from config_file_handler import ConfigFileHandler
+from ex_merge import EPOCH_OFFSETS
+
+EX_START = datetime(2023, 8, 24, 12, tzinfo=timezone.utc)
+NA_START = datetime(2022, 4, 7, 6, 30, tzinfo=timezone.utc)
+# time on deck between dives
+SURFACE_INTERVAL = 2 * 3600
+# column names of a ROVCTD_DERIVE.cnv, in the order the default ctd_cols expect them
+CNV_COLUMNS = [
+    'timeQ: Time, NMEA [seconds]',
+    'prdM: Pressure, Strain Gauge [db]',
+    'latitude: Latitude [deg]',
+    't090C: Temperature [ITS-90, deg C]',
+    'c0S/m: Conductivity [S/m]',
+    'sbeox0V: Oxygen raw, SBE 43 [V]',
+    'flECO-AFL: Fluorescence, WET Labs ECO-AFL/FL [mg/m^3]',
+    'turbWETntu0: Turbidity, WET Labs ECO [NTU]',
+    'sbeox0Mm/Kg: Oxygen, SBE 43 [umol/kg]',
+    'depSM: Depth [salt water, m]',
+    'sal00: Salinity, Practical [PSU]',
+    'sigma-t00: Density [sigma-t, kg/m^3 ]',
+    'svCM: Sound Velocity [Chen-Millero, m/s]',
+    'sbeox0ML/L: Oxygen, SBE 43 [ml/l]',
+    'potemp090C: Potential Temperature [ITS-90, deg C]',
+    'flag:  0.000e+00',
+]
+
+
+class DiveProfile:
+    # what the sensors see on one dive: descend, work near the bottom, come back up
+    def __init__(self, start, seconds, max_depth, rng):
+        self.start = int(start.timestamp())
+        self.seconds = seconds
+        self.max_depth = max_depth
+        self.rng = rng
+
+    @property
+    def end(self):
+        return self.start + int(self.seconds)
+
+    def depth(self, elapsed):
+        transit = self.seconds / 4
+        descent = np.clip(elapsed / transit, 0, 1)
+        ascent = np.clip((self.seconds - elapsed) / transit, 0, 1)
+        bottom_wander = 15 * np.sin(elapsed / 300)
+        return np.maximum(self.max_depth * np.minimum(descent, ascent) + bottom_wander * np.minimum(descent, ascent), 0)
+
+    def sensors(self, elapsed):
+        depth = self.depth(elapsed)
+        noise = self.rng.normal(size=(5, len(elapsed)))
+        return {
+            'depth': depth,
+            'temperature': 2 + 24 * np.exp(-depth / 700) + 0.02 * noise[0],
+            'salinity': 34.6 - 0.4 * np.exp(-depth / 400) + 0.005 * noise[1],
+            'oxygen_ml_l': 4.8 - 3.5 * np.exp(-((depth - 800) / 400) ** 2) + 0.03 * noise[2],
+            'latitude': 21.12 + 0.002 * np.sin(elapsed / 1800) + 0.00001 * noise[3],
+            'longitude': -157.5 + 0.002 * np.cos(elapsed / 1800) + 0.00001 * noise[4],
+            'altitude': np.clip(3 + 2 * np.sin(elapsed / 120), 0.5, None) + np.where(depth < self.max_depth - 30, 40, 0),
+        }
+
+
+def dive_profiles(start, dives, dive_hours, max_depth, rng):
+    profiles = []
+    for i in range(dives):
+        dive_start = datetime.fromtimestamp(int(start.timestamp()) + i * int(dive_hours * 3600 + SURFACE_INTERVAL), timezone.utc)
+        profiles.append(DiveProfile(dive_start, dive_hours * 3600, max_depth * (0.6 + 0.4 * rng.random()), rng))
+    return profiles
+
+
+def cnv_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%b %d %Y %H:%M:%S')
+
+
+def write_cnv(file_path, profile, sample_rate):
+    elapsed = np.arange(int(profile.seconds * sample_rate)) / sample_rate
+    sensors = profile.sensors(elapsed)
+    depth = sensors['depth']
+    columns = np.column_stack([
+        profile.start - EPOCH_OFFSETS['2000'] + elapsed,
+        depth * 1.0076,
+        sensors['latitude'],
+        sensors['temperature'],
+        3.2 + 0.06 * sensors['temperature'],
+        0.9 + 0.4 * sensors['oxygen_ml_l'],
+        profile.rng.gamma(2, 0.05, len(elapsed)),
+        profile.rng.gamma(2, 0.1, len(elapsed)),
+        sensors['oxygen_ml_l'] * 43.6,
+        depth,
+        sensors['salinity'],
+        26 + depth / 1500,
+        1480 + 0.016 * depth + 2 * sensors['temperature'],
+        sensors['oxygen_ml_l'],
+        sensors['temperature'] - depth / 10000,
+        np.zeros(len(elapsed)),
+    ])
+    with open(file_path, 'w') as cnv_file:
+        cnv_file.write(f'* Sea-Bird SBE 9 Data File:\n* FileName = {os.path.basename(file_path)}\n')
+        cnv_file.write(f'* System UTC = {cnv_time(profile.start)}\n')
+        cnv_file.write(f'# nquan = {len(CNV_COLUMNS)}\n# nvalues = {len(columns)}\n')
+        cnv_file.writelines(f'# name {i} = {name}\n' for i, name in enumerate(CNV_COLUMNS))
+        cnv_file.write(f"# start_time = {cnv_time(profile.start)} [Instrument's time stamp, header]\n")
+        cnv_file.write('# bad_flag = -9.990e-29\n# file_type = ascii\n*END*\n')
+        np.savetxt(cnv_file, columns, fmt=['%14.3f'] + ['%11.4f'] * 14 + ['%10.3e'])
+
+
+def write_rov_track(file_path, profile, cruise_number, dive):
+    elapsed = np.arange(int(profile.seconds))
+    sensors = profile.sensors(elapsed)
+    # the occasional row without a position fix
+    no_fix = profile.rng.random(len(elapsed)) < 0.002
+    with open(file_path, 'w') as csv_file:
+        for second, altitude, latitude, longitude, missing in zip(
+            (profile.start + elapsed).tolist(), sensors['altitude'].tolist(), sensors['latitude'].tolist(), sensors['longitude'].tolist(), no_fix.tolist(),
+        ):
+            position = ',' if missing else f'{latitude:.6f},{longitude:.6f}'
+            csv_file.write(f'{cruise_number},{dive},{second},Hercules,{altitude:.2f},{position}\n')
+
+
+def generate_ex_cruise(root, cruise_number='EX2306', dives=3, dive_hours=1.0, sample_rate=1.0, max_depth=2500, seed=0):
+    # ${base_dir}/CTD/*_ROVCTD_DERIVE.cnv and ${base_dir}/Tracking/*_RovTrack1Hz.csv, returns a config for the cruise
+    rng = np.random.default_rng(seed)
+    base_dir = os.path.join(root, cruise_number)
+    os.makedirs(os.path.join(base_dir, 'CTD'), exist_ok=True)
+    os.makedirs(os.path.join(base_dir, 'Tracking'), exist_ok=True)
+    for i, profile in enumerate(dive_profiles(EX_START, dives, dive_hours, max_depth, rng)):
+        dive = f'DIVE{i + 1:02d}'
+        dive_date = datetime.fromtimestamp(profile.start, timezone.utc).strftime('%Y%m%d')
+        write_cnv(os.path.join(base_dir, 'CTD', f'{cruise_number}_{dive}_{dive_date}_ROVCTD_DERIVE.cnv'), profile, sample_rate)
+        write_rov_track(os.path.join(base_dir, 'Tracking', f'{cruise_number}_{dive}_RovTrack1Hz.csv'), profile, cruise_number, dive)
+    return cruise_config(cruise_number, base_dir, os.path.join(root, 'output', cruise_number))
+
+
+def iso_time(seconds):
+    return np.datetime_as_string(seconds.astype('datetime64[s]'), unit='s')
+
+
+def write_dive_report(merged_dir, dive, profile, sample_rate):
+    os.makedirs(merged_dir, exist_ok=True)
+    elapsed = np.arange(int(profile.seconds * sample_rate)) / sample_rate
+    sensors = profile.sensors(elapsed)
+    # the merged tsv files only keep whole seconds
+    timestamps = iso_time(profile.start + np.floor(elapsed).astype(np.int64))
+    with open(os.path.join(merged_dir, f'{dive}.CTD.NAV.tsv'), 'w') as tsv_file:
+        for row in zip(
+            timestamps.tolist(), sensors['latitude'].tolist(), sensors['longitude'].tolist(), sensors['depth'].tolist(),
+            sensors['temperature'].tolist(), (3.2 + 0.06 * sensors['temperature']).tolist(), sensors['salinity'].tolist(),
+        ):
+            tsv_file.write('%s\t%.6f\t%.6f\t%.2f\t%.4f\t%.5f\t1500.0\t%.4f\t0\n' % row)
+
+    # the optode reports every two seconds
+    o2s_elapsed = np.arange(0, int(profile.seconds), 2)
+    o2s_oxygen = profile.sensors(o2s_elapsed)['oxygen_ml_l'] * 44.659
+    with open(os.path.join(merged_dir, f'{dive}.O2S.NAV.tsv'), 'w') as tsv_file:
+        for timestamp, oxygen in zip(iso_time(profile.start + o2s_elapsed).tolist(), o2s_oxygen.tolist()):
+            tsv_file.write(f'{timestamp}\t21.12\t-157.5\t0\t{oxygen:.3f}\t92.1\t2.4\n')
+
+
+def write_navest_files(navest_dir, profiles, sample_rate, rng):
+    # hourly YYYYMMDD_HHMM.DAT files from an hour before the first dive to the end of the last one. altitude
+    # comes from the dive when there is one, and the VFR records are mixed in with the other navest records
+    os.makedirs(navest_dir, exist_ok=True)
+    first_hour = (profiles[0].start - 3600) // 3600 * 3600
+    for hour in range(first_hour, profiles[-1].end + 1, 3600):
+        record_times = hour + np.arange(int(3600 * sample_rate)) / sample_rate + rng.uniform(0, 0.5 / sample_rate)
+        altitude = np.full(len(record_times), 99.0)
+        for profile in profiles:
+            during = (record_times >= profile.start) & (record_times < profile.end)
+            altitude[during] = profile.sensors(record_times[during] - profile.start)['altitude']
+        stamps = [datetime.fromtimestamp(record_time, timezone.utc).strftime('%Y/%m/%d %H:%M:%S.%f')[:-3] for record_time in record_times.tolist()]
+        file_name = datetime.fromtimestamp(hour, timezone.utc).strftime('%Y%m%d_%H%M.DAT')
+        with open(os.path.join(navest_dir, file_name), 'w') as dat_file:
+            for stamp, alt in zip(stamps, altitude.tolist()):
+                dat_file.write(f'VFR {stamp} 13 0 SOLN_DEADRECK -174.606671 30.693783 0.000 {alt:.3f} 100 0.16 59.80\n')
+                dat_file.write(f'VFR {stamp} 13 1 SOLN_USBL -174.606702 30.693811 1012.400 0.000 100 0.55 12.10\n')
+                dat_file.write(f'PAROSCI {stamp} 2 1012.391\n')
+
+
+def generate_na_cruise(root, cruise_number='NA138', dives=3, dive_hours=1.0, sample_rate=1.0, max_depth=2500, seed=0):
+    # ${base_dir}/processed/dive_reports/H*/merged/*.NAV.tsv and ${base_dir}/raw/nav/navest/*.DAT, returns a config for the cruise
+    rng = np.random.default_rng(seed)
+    base_dir = os.path.join(root, cruise_number)
+    profiles = dive_profiles(NA_START, dives, dive_hours, max_depth, rng)
+    for i, profile in enumerate(profiles):
+        dive = f'H{1915 + i}'
+        write_dive_report(os.path.join(base_dir, 'processed', 'dive_reports', dive, 'merged'), dive, profile, sample_rate)
+    write_navest_files(os.path.join(base_dir, 'raw', 'nav', 'navest'), profiles, sample_rate, rng)
+    return cruise_config(cruise_number, base_dir, os.path.join(root, 'output', cruise_number))
+
+
+def cruise_config(cruise_number, base_dir, output_dir):
+    config = ConfigFileHandler.default_config()
+    config.update({'cruise_number': cruise_number, 'base_dir': base_dir, 'output_dir': output_dir})
+    os.makedirs(output_dir, exist_ok=True)
+    return config
+
+
+def save_config(config, config_file_path):
+    with open(config_file_path, 'w') as config_file:
+        json.dump(config, config_file, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a fake cruise that the processors can run on')
+    parser.add_argument('root', help='directory the cruise is written to')
+    parser.add_argument('kind', choices=['EX', 'NA'])
+    parser.add_argument('--cruise-number', help='defaults to EX2306 or NA138')
+    parser.add_argument('--dives', type=int, default=3)
+    parser.add_argument('--dive-hours', type=float, default=1.0)
+    parser.add_argument('--sample-rate', type=float, default=1.0, help='CTD (and navest) samples per second')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate = generate_ex_cruise if args.kind == 'EX' else generate_na_cruise
+    cruise_config_values = generate(
+        args.root,
+        args.cruise_number or ('EX2306' if args.kind == 'EX' else 'NA138'),
+        args.dives,
+        args.dive_hours,
+        args.sample_rate,
+        seed=args.seed,
+    )
+    config_path = os.path.join(args.root, f'{cruise_config_values["cruise_number"]}_config.json')
+    save_config(cruise_config_values, config_path)
+    print(f'Cruise written to {cruise_config_values["base_dir"]}, config saved to {config_path}')
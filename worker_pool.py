@@ -0,0 +1,304 @@
+import collections
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import threading
+
+from concurrent.futures import Future
+from multiprocessing.connection import wait as wait_for_ready
+
+from profiling import r_profile_file
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+R_WORKER_SCRIPT = os.path.join(REPO_DIR, 'merge_worker.R')
+# printed by merge_worker.R after each job, followed by the job id and the script's exit status
+R_DONE_MARKER = '#ctd-process-done'
+
+
+class JobAborted(Exception):
+    pass
+
+
+class WorkerExited(Exception):
+    pass
+
+
+def process_rss(pid):
+    # resident memory of a process in bytes, or None where it can't be read
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return int(subprocess.run(['ps', '-o', 'rss=', '-p', str(pid)], capture_output=True, text=True).stdout) * 1024
+    except (OSError, ValueError):
+        return None
+
+
+class RSession:
+    # an Rscript process that keeps the packages EX.R and NA.R use loaded between dives (see merge_worker.R).
+    # its messages and errors (stderr) come back with its output, so they can be logged with the dive
+    def __init__(self):
+        self.process = subprocess.Popen(
+            ['Rscript', R_WORKER_SCRIPT], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+        )
+        self.job_id = 0
+
+    def run(self, script_dir, script, args, profile_file=None):
+        self.job_id += 1
+        job = {'id': self.job_id, 'dir': script_dir, 'script': script, 'args': list(args)}
+        if profile_file is not None:
+            job['profile'] = profile_file
+        self.process.stdin.write(json.dumps(job) + '\n')
+        self.process.stdin.flush()
+        output = []
+        for line in self.process.stdout:
+            if line.startswith(R_DONE_MARKER):
+                _, job_id, status = line.split()
+                if int(job_id) == self.job_id:
+                    return int(status), output
+            else:
+                output.append(line.rstrip('\n'))
+        raise WorkerExited(f'R exited with {self.process.wait()}')
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+# the R session of this worker process, started by the first R job
+r_session = None
+
+
+def run_r_script(script_dir, script, args):
+    # same as `Rscript <script> <args>` run in script_dir, returning its exit status and the lines it printed
+    # (stdout and stderr), but without paying for
+    # R and its packages to start up on every dive. a dive that's being profiled is profiled in R too
+    global r_session
+    if r_session is None or r_session.process.poll() is not None:
+        r_session = RSession()
+    try:
+        return r_session.run(script_dir, script, args, r_profile_file())
+    except (OSError, WorkerExited):
+        r_session = None
+        raise
+
+
+def memory_in_use():
+    # this worker and its R session
+    pids = [os.getpid()] + ([r_session.process.pid] if r_session is not None and r_session.process.poll() is None else [])
+    return sum(process_rss(pid) or 0 for pid in pids)
+
+
+def worker_main(conn):
+    global r_session
+    # in its own process group, so Ctrl+C in the terminal is left to the parent, and aborting a job stops the
+    # worker together with its R session
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            if message is None:
+                break
+            function, args = message
+            try:
+                reply = ('ok', function(*args))
+            except Exception as err:
+                reply = ('error', err)
+            try:
+                conn.send((*reply, memory_in_use()))
+            except Exception as err:
+                # the result or exception couldn't be pickled
+                conn.send(('error', WorkerExited(f'{type(err).__name__}: {err}'), memory_in_use()))
+    finally:
+        if r_session is not None:
+            r_session.close()
+            r_session = None
+
+
+def kill_worker(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except (AttributeError, OSError):
+        process.terminate()
+
+
+class Worker:
+    def __init__(self, context):
+        self.conn, worker_conn = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(worker_conn,), daemon=True)
+        self.process.start()
+        worker_conn.close()
+        self.future = None
+        self.job_count = 0
+        self.aborted = False
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=10)
+        if self.process.is_alive():
+            kill_worker(self.process)
+            self.process.join()
+        self.conn.close()
+
+
+class WorkerPool:
+    # long-lived worker processes that jobs are sent to over a pipe, one at a time, so a session only pays for
+    # starting Python (and R) once. submit() returns a concurrent.futures.Future like ProcessPoolExecutor does.
+    # a worker is replaced after max_jobs jobs, or after a job that left it (and its R session) using more
+    # than max_rss bytes. abort() stops one running job by killing its worker, the other workers carry on
+    def __init__(self, max_workers, max_jobs=None, max_rss=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self.context = multiprocessing.get_context()
+        self.lock = threading.Lock()
+        self.queue = collections.deque()
+        self.workers = []
+        self.shutting_down = False
+        self.wake_reader, self.wake_writer = self.context.Pipe(duplex=False)
+        self.woken = False
+        self.thread = threading.Thread(target=self.dispatch, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def for_config(cls, config, max_workers=None):
+        max_jobs = int(config['worker_max_jobs'])
+        max_memory_mb = int(config['worker_max_memory_mb'])
+        return cls(max_workers or config['max_workers'], max_jobs or None, max_memory_mb * 1024 * 1024 or None)
+
+    def submit(self, function, *args, on_start=None):
+        # on_start, if given, is called from the pool's thread once a worker has been given the job
+        future = Future()
+        with self.lock:
+            if self.shutting_down:
+                raise RuntimeError('cannot submit jobs after shutdown')
+            self.queue.append((future, function, args, on_start))
+            self.wake()
+        return future
+
+    def wake(self):
+        # called with the lock held. one wake-up is enough however many jobs were queued since the last one
+        if not self.woken:
+            self.woken = True
+            self.wake_writer.send(None)
+
+    def abort(self, future):
+        # True if the job was running and its worker has been stopped, or it hadn't started and was cancelled
+        with self.lock:
+            worker = next((worker for worker in self.workers if worker.future is future), None)
+            if worker is None:
+                return future.cancel()
+            worker.aborted = True
+            kill_worker(worker.process)
+            return True
+
+    def abort_all(self):
+        # stops every running job by killing its worker, like abort() -> how many were stopped
+        with self.lock:
+            busy = [worker for worker in self.workers if worker.future is not None]
+            for worker in busy:
+                worker.aborted = True
+                kill_worker(worker.process)
+        return len(busy)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self.lock:
+            self.shutting_down = True
+            if cancel_futures:
+                while self.queue:
+                    # notified too, so wait() on the future returns
+                    future = self.queue.popleft()[0]
+                    future.cancel()
+                    future.set_running_or_notify_cancel()
+            self.wake()
+        if wait:
+            self.thread.join()
+
+    def start_jobs(self):
+        # called with the lock held
+        for worker in [worker for worker in self.workers if worker.future is None and not worker.process.is_alive()]:
+            self.workers.remove(worker)
+        while self.queue:
+            worker = next((worker for worker in self.workers if worker.future is None), None)
+            if worker is None:
+                if len(self.workers) >= self.max_workers:
+                    return
+                worker = Worker(self.context)
+                self.workers.append(worker)
+            future, function, args, on_start = self.queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                worker.conn.send((function, args))
+            except OSError as err:
+                self.workers.remove(worker)
+                future.set_exception(WorkerExited(str(err)))
+            except Exception as err:
+                # couldn't be pickled, the worker never saw it
+                future.set_exception(err)
+            else:
+                worker.future = future
+                if on_start is not None:
+                    on_start()
+
+    def dispatch(self):
+        while True:
+            with self.lock:
+                while self.wake_reader.poll():
+                    self.wake_reader.recv()
+                self.woken = False
+                self.start_jobs()
+                busy = [worker for worker in self.workers if worker.future is not None]
+                if self.shutting_down and not self.queue and not busy:
+                    break
+            ready = wait_for_ready([self.wake_reader] + [worker.conn for worker in busy] + [worker.process.sentinel for worker in busy])
+            for worker in busy:
+                if worker.conn in ready or worker.process.sentinel in ready:
+                    self.collect(worker)
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            worker.stop()
+
+    def collect(self, worker):
+        future = worker.future
+        try:
+            status, value, rss = worker.conn.recv()
+        except Exception:
+            # the worker died (or was killed by abort) before it could send the whole result
+            if worker.process.is_alive():
+                kill_worker(worker.process)
+            worker.process.join()
+            with self.lock:
+                self.workers.remove(worker)
+            if worker.aborted:
+                future.set_exception(JobAborted('Cancelled'))
+            else:
+                future.set_exception(WorkerExited(f'Worker exited with {worker.process.exitcode}'))
+            return
+        with self.lock:
+            worker.future = None
+            worker.job_count += 1
+            retire = worker.aborted or (self.max_jobs and worker.job_count >= self.max_jobs) or (self.max_rss and rss >= self.max_rss)
+            if retire:
+                self.workers.remove(worker)
+        if status == 'ok':
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+        if retire:
+            worker.stop()